@@ -1,8 +1,20 @@
 import typer
 from chroma_ops.collection_snapshot import command as snapshot_command
+from chroma_ops.collection_restore import command as restore_command
+from chroma_ops.collection_verify import command as verify_command
 
 collection_commands = typer.Typer(no_args_is_help=True)
 
 collection_commands.command(
     name="snapshot", no_args_is_help=True, help="Snapshot a collection to a file."
 )(snapshot_command)
+collection_commands.command(
+    name="restore",
+    no_args_is_help=True,
+    help="Restore a collection snapshot into a persist directory.",
+)(restore_command)
+collection_commands.command(
+    name="verify",
+    no_args_is_help=True,
+    help="Verify the integrity of a collection snapshot.",
+)(verify_command)
@@ -0,0 +1,466 @@
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+import hashlib
+import os
+from pathlib import Path
+import pickle
+import shutil
+import sqlite3
+import time
+from typing import Any, Deque, Iterator, List, Optional, Tuple
+
+import typer
+from rich.console import Console
+from rich.progress import BarColumn, Progress, SpinnerColumn, TextColumn
+from rich.table import Table
+
+from chroma_ops.collection_snapshot import get_snapshot_chain, is_legacy_snapshot
+from chroma_ops.compression import Codec, decompress, validate_codec
+from chroma_ops.constants import (
+    DEFAULT_CHROMA_SQLITE_FILE,
+    DEFAULT_TENANT_ID,
+    DEFAULT_TOPIC_NAMESPACE,
+)
+from chroma_ops.utils import (
+    SqliteMode,
+    get_sqlite_connection,
+    print_chroma_version,
+    sizeof_fmt,
+)
+
+# SQLite allows at most 10 attached databases unless compiled otherwise
+MAX_SNAPSHOT_CHAIN_LENGTH = 10
+
+
+def _decompress_chunk(data: bytes, codec: Optional[str], sha256: str) -> bytes:
+    chunk = decompress(data, Codec(codec) if codec is not None else None)
+    if hashlib.sha256(chunk).hexdigest() != sha256:
+        raise ValueError(f"Chunk checksum mismatch, expected {sha256}")
+    return chunk
+
+
+def hnsw_chunk_query(conn: sqlite3.Connection, schema: str) -> str:
+    """Query for the data, codec and checksum of one chunk of an HNSW segment file in a snapshot.
+
+    Legacy snapshots store every file whole as its only chunk, without a codec.
+    """
+    if is_legacy_snapshot(conn, schema):
+        return f"SELECT data, NULL, sha256 FROM {schema}.hnsw_segment_data WHERE segment_id = ? AND filename = ? AND ? = 0"
+    return f"SELECT data, codec, sha256 FROM {schema}.hnsw_segment_data WHERE segment_id = ? AND filename = ? AND chunk = ?"
+
+
+def hnsw_files_query(conn: sqlite3.Connection, schema: str) -> str:
+    """Query for the segment id, filename, size, chunk count and checksum of the HNSW segment files in a snapshot.
+
+    The size of the files in legacy snapshots is only known once they are decompressed and is NULL.
+    """
+    if is_legacy_snapshot(conn, schema):
+        return f"SELECT segment_id, filename, NULL, 1, sha256 FROM {schema}.hnsw_segment_data ORDER BY segment_id, filename"
+    return f"SELECT segment_id, filename, size, chunks, sha256 FROM {schema}.hnsw_segment_files ORDER BY segment_id, filename"
+
+
+def hnsw_codecs_query(conn: sqlite3.Connection, schemas: List[str]) -> Optional[str]:
+    """Query for the distinct codecs used across the snapshots, None if all of them are legacy snapshots."""
+    selects = [
+        f"SELECT DISTINCT codec FROM {schema}.hnsw_segment_data"
+        for schema in schemas
+        if not is_legacy_snapshot(conn, schema)
+    ]
+    return " UNION ".join(selects) if selects else None
+
+
+def _resolve_chunk(
+    conn: sqlite3.Connection,
+    chunk_queries: List[str],
+    segment_id: str,
+    filename: str,
+    chunk: int,
+) -> Tuple[bytes, Optional[str], str]:
+    """Find the stored data of a chunk, following references down the snapshot chain."""
+    for query in chunk_queries:
+        row = conn.execute(query, (segment_id, filename, chunk)).fetchone()
+        if row and row[0] is not None:
+            return row[0], row[1], row[2]
+    raise ValueError(
+        f"Chunk {chunk} of {segment_id}/{filename} not found in the snapshot chain"
+    )
+
+
+def stream_hnsw_file(
+    conn: sqlite3.Connection,
+    chunk_queries: List[str],
+    segment_id: str,
+    filename: str,
+    chunks: int,
+    sha256: str,
+    executor: Executor,
+    max_in_flight: int,
+) -> Iterator[bytes]:
+    """Yield the verified chunks of an HNSW segment file from the snapshot chain, in order.
+
+    Chunks are decompressed and checked by the executor while the calling thread reads the
+    next ones, at most `max_in_flight` chunks are held in memory. The whole-file checksum is
+    checked once the last chunk has been yielded. `chunk_queries` are the `hnsw_chunk_query` of
+    the snapshots in the chain, newest first.
+    """
+    file_hash = hashlib.sha256()
+    pending: Deque["Future[bytes]"] = deque()
+    for ordinal in range(chunks):
+        data, codec, chunk_sha256 = _resolve_chunk(
+            conn, chunk_queries, segment_id, filename, ordinal
+        )
+        pending.append(executor.submit(_decompress_chunk, data, codec, chunk_sha256))
+        if len(pending) >= max_in_flight:
+            chunk = pending.popleft().result()
+            file_hash.update(chunk)
+            yield chunk
+    while pending:
+        chunk = pending.popleft().result()
+        file_hash.update(chunk)
+        yield chunk
+    if file_hash.hexdigest() != sha256:
+        raise ValueError(
+            f"Checksum mismatch for {segment_id}/{filename}, expected {sha256} got {file_hash.hexdigest()}"
+        )
+
+
+def _restore_hnsw_file(
+    conn: sqlite3.Connection,
+    chunk_queries: List[str],
+    segment_id: str,
+    filename: str,
+    chunks: int,
+    sha256: str,
+    target_file: str,
+    executor: Executor,
+    max_in_flight: int,
+) -> int:
+    """Stream an HNSW segment file from the snapshot chain to disk, verifying it as it is written.
+
+    Returns the number of bytes written.
+    """
+    written = 0
+    with open(target_file, "wb", buffering=1024 * 1024) as file:
+        for chunk in stream_hnsw_file(
+            conn,
+            chunk_queries,
+            segment_id,
+            filename,
+            chunks,
+            sha256,
+            executor,
+            max_in_flight,
+        ):
+            file.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def _shift_hnsw_metadata_seq_ids(metadata_file: str, offset: int) -> None:
+    """Shift the seq ids recorded in index_metadata.pickle by offset."""
+    with open(metadata_file, "rb") as f:
+        metadata: Any = pickle.load(f)
+    is_dict = isinstance(metadata, dict)
+    max_seq_id = metadata["max_seq_id"] if is_dict else metadata.max_seq_id
+    id_to_seq_id = metadata["id_to_seq_id"] if is_dict else metadata.id_to_seq_id
+    if isinstance(max_seq_id, int):
+        max_seq_id += offset
+    id_to_seq_id = {
+        k: v + offset if isinstance(v, int) else v for k, v in id_to_seq_id.items()
+    }
+    if is_dict:
+        metadata["max_seq_id"] = max_seq_id
+        metadata["id_to_seq_id"] = id_to_seq_id
+    else:
+        metadata.max_seq_id = max_seq_id
+        metadata.id_to_seq_id = id_to_seq_id
+    with open(metadata_file, "wb") as f:
+        pickle.dump(metadata, f, pickle.HIGHEST_PROTOCOL)
+
+
+def _get_offset(
+    conn: sqlite3.Connection, schemas: List[str], target_query: str, source_query: str
+) -> int:
+    """Offset needed to move the snapshot's ids past the ids already in the target database."""
+    target_max = conn.execute(target_query).fetchone()[0]
+    if target_max is None:
+        return 0
+    source_min = None
+    for schema in schemas:
+        value = conn.execute(source_query.format(schema=schema)).fetchone()[0]
+        if value is not None and (source_min is None or value < source_min):
+            source_min = value
+    if source_min is None or source_min > target_max:
+        return 0
+    return int(target_max)
+
+
+def _delete_embeddings(
+    conn: sqlite3.Connection, ids_query: str, params: Tuple[Any, ...], has_fts: bool
+) -> None:
+    if has_fts:
+        conn.execute(
+            f"DELETE FROM main.embedding_fulltext_search WHERE rowid IN ({ids_query})",
+            params,
+        )
+    conn.execute(
+        f"DELETE FROM main.embedding_metadata WHERE id IN ({ids_query})", params
+    )
+    conn.execute(f"DELETE FROM main.embeddings WHERE id IN ({ids_query})", params)
+
+
+def collection_restore(
+    persist_dir: str,
+    snapshot_file: Path,
+    yes: Optional[bool] = False,
+    workers: int = 1,
+) -> None:
+    console = Console()
+    if workers <= 0:
+        raise ValueError("Number of workers must be a positive number")
+    if not snapshot_file.exists():
+        raise ValueError(
+            f"Snapshot file {snapshot_file.absolute().as_posix()} does not exist"
+        )
+    print_chroma_version(console)
+    if not os.path.exists(os.path.join(persist_dir, DEFAULT_CHROMA_SQLITE_FILE)):
+        # let Chroma create and migrate an empty database to restore into
+        import chromadb
+
+        os.makedirs(persist_dir, exist_ok=True)
+        chromadb.PersistentClient(path=persist_dir)
+    # oldest (full) snapshot first, newest last
+    chain = list(reversed(get_snapshot_chain(snapshot_file.absolute().as_posix())))
+    if len(chain) > MAX_SNAPSHOT_CHAIN_LENGTH:
+        raise ValueError(
+            f"Snapshot chain is {len(chain)} snapshots long, at most {MAX_SNAPSHOT_CHAIN_LENGTH} are supported. Take a full snapshot to start a new chain."
+        )
+    schemas = [f"snapshot_{i}" for i in range(len(chain))]
+    newest = schemas[-1]
+    start_time = time.perf_counter()
+    with get_sqlite_connection(persist_dir, SqliteMode.READ_WRITE) as conn:
+        for schema, snapshot in zip(schemas, chain):
+            conn.execute(
+                f"ATTACH DATABASE ? AS {schema}", (f"file:{snapshot}?mode=ro",)
+            )
+        collections = conn.execute(
+            f"SELECT id, name, database_name, tenant_id FROM {newest}.collections"
+        ).fetchall()
+        if len(collections) == 0:
+            raise ValueError("No collections found in the snapshot")
+        for collection_id, name, database_name, tenant_id in collections:
+            if conn.execute(
+                "SELECT 1 FROM main.collections c JOIN main.databases d ON c.database_id = d.id WHERE c.id = ? OR (c.name = ? AND d.name = ? AND d.tenant_id = ?)",
+                (collection_id, name, database_name, tenant_id),
+            ).fetchone():
+                raise ValueError(
+                    f"Collection {name} ({collection_id}) already exists in {persist_dir}"
+                )
+        codecs_query = hnsw_codecs_query(conn, schemas)
+        if codecs_query is not None:
+            for (codec,) in conn.execute(codecs_query).fetchall():
+                validate_codec(Codec(codec))
+        has_fts = (
+            conn.execute(
+                "SELECT 1 FROM main.sqlite_master WHERE name = 'embedding_fulltext_search'"
+            ).fetchone()
+            is not None
+        )
+        id_offset = _get_offset(
+            conn,
+            schemas,
+            "SELECT MAX(id) FROM main.embeddings",
+            "SELECT MIN(id) FROM {schema}.embeddings",
+        )
+        seq_id_offset = _get_offset(
+            conn,
+            schemas,
+            "SELECT MAX(seq_id) FROM (SELECT MAX(seq_id) AS seq_id FROM main.embeddings_queue UNION ALL SELECT MAX(seq_id) FROM main.max_seq_id UNION ALL SELECT MAX(seq_id) FROM main.embeddings)",
+            "SELECT MIN(seq_id) FROM (SELECT MIN(seq_id) AS seq_id FROM {schema}.embeddings_queue UNION ALL SELECT MIN(seq_id) FROM {schema}.max_seq_id UNION ALL SELECT MIN(seq_id) FROM {schema}.embeddings)",
+        )
+        files = conn.execute(hnsw_files_query(conn, newest)).fetchall()
+        chunk_queries = [hnsw_chunk_query(conn, schema) for schema in reversed(schemas)]
+        table = Table(title="Restoring snapshot...")
+        table.add_column("Property", style="cyan")
+        table.add_column("Value", style="magenta")
+        table.add_row("Snapshot", snapshot_file.absolute().as_posix())
+        table.add_row("Snapshot Chain Length", str(len(chain)))
+        table.add_row("Collections", ", ".join(c[1] for c in collections))
+        table.add_row("HNSW Segment Data Files", f"{len(files):,}")
+        table.add_row(
+            "HNSW Segment Data Size",
+            (
+                sizeof_fmt(sum(f[2] for f in files))
+                if all(f[2] is not None for f in files)
+                else "unknown"
+            ),
+        )
+        table.add_row("Embedding ID Offset", f"{id_offset:,}")
+        table.add_row("Seq ID Offset", f"{seq_id_offset:,}")
+        console.print(table)
+        if not yes:
+            if not typer.confirm(
+                f"\nAre you sure you want to restore the snapshot into {persist_dir}?",
+                default=False,
+                show_default=True,
+            ):
+                console.print("[yellow]Restore cancelled by user[/yellow]")
+                return
+        restored_dirs = []
+        rows = 0
+        written = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            with Progress(
+                SpinnerColumn(
+                    finished_text="[bold green]:heavy_check_mark:[/bold green]"
+                ),
+                TextColumn("[progress.description]{task.description}"),
+                BarColumn(),
+                TextColumn("{task.percentage:>3.0f}%"),
+                transient=True,
+            ) as progress:
+                task = progress.add_task("Restoring collections...", total=0)
+                for collection_id, _, database_name, tenant_id in collections:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO main.tenants (id) VALUES (?)",
+                        (tenant_id,),
+                    )
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO main.databases (id, name, tenant_id) SELECT database_id, database_name, tenant_id FROM {newest}.collections WHERE id = ?",
+                        (collection_id,),
+                    )
+                    conn.execute(
+                        f"""
+                        INSERT INTO main.collections (id, name, dimension, database_id, config_json_str)
+                        SELECT c.id, c.name, c.dimension, d.id, c.config_json_str
+                        FROM {newest}.collections c
+                        JOIN main.databases d ON d.name = c.database_name AND d.tenant_id = c.tenant_id
+                        WHERE c.id = ?
+                        """,
+                        (collection_id,),
+                    )
+                for table_name, columns in [
+                    (
+                        "collection_metadata",
+                        "collection_id, key, str_value, int_value, float_value, bool_value",
+                    ),
+                    ("segments", "id, type, scope, collection"),
+                    (
+                        "segment_metadata",
+                        "segment_id, key, str_value, int_value, float_value, bool_value",
+                    ),
+                ]:
+                    conn.execute(
+                        f"INSERT INTO main.{table_name} ({columns}) SELECT {columns} FROM {newest}.{table_name}"
+                    )
+                conn.execute(
+                    f"INSERT INTO main.max_seq_id (segment_id, seq_id) SELECT segment_id, seq_id + ? FROM {newest}.max_seq_id",
+                    (seq_id_offset,),
+                )
+                progress.update(task, advance=1)
+                # bases may still hold collections dropped before the newest snapshot was taken
+                segments = f"SELECT id FROM {newest}.segments"
+                topic_prefix = (
+                    f"persistent://{DEFAULT_TENANT_ID}/{DEFAULT_TOPIC_NAMESPACE}/"
+                )
+                for schema, snapshot in zip(schemas, chain):
+                    task = progress.add_task(
+                        f"Restoring rows from {os.path.basename(snapshot)}...",
+                        total=0,
+                    )
+                    if schema != schemas[0]:
+                        # incremental snapshots carry the live id set, drop anything deleted since the base
+                        _delete_embeddings(
+                            conn,
+                            f"SELECT id FROM main.embeddings WHERE segment_id IN (SELECT id FROM {newest}.segments WHERE scope = 'METADATA') AND id - ? NOT IN (SELECT id FROM {schema}.embedding_ids)",
+                            (id_offset,),
+                            has_fts,
+                        )
+                        # rows changed since the base are replaced as a whole
+                        _delete_embeddings(
+                            conn,
+                            f"SELECT id + ? FROM {schema}.embeddings WHERE segment_id IN ({segments})",
+                            (id_offset,),
+                            has_fts,
+                        )
+                    rows += conn.execute(
+                        f"INSERT INTO main.embeddings (id, segment_id, embedding_id, seq_id, created_at) SELECT id + ?, segment_id, embedding_id, seq_id + ?, created_at FROM {schema}.embeddings WHERE segment_id IN ({segments})",
+                        (id_offset, seq_id_offset),
+                    ).rowcount
+                    rows += conn.execute(
+                        f"INSERT INTO main.embedding_metadata (id, key, string_value, int_value, float_value, bool_value) SELECT id + ?, key, string_value, int_value, float_value, bool_value FROM {schema}.embedding_metadata WHERE id IN (SELECT id FROM {schema}.embeddings WHERE segment_id IN ({segments}))",
+                        (id_offset,),
+                    ).rowcount
+                    if has_fts:
+                        conn.execute(
+                            f"INSERT INTO main.embedding_fulltext_search (rowid, string_value) SELECT id + ?, string_value FROM {schema}.embedding_metadata WHERE key = 'chroma:document' AND id IN (SELECT id FROM {schema}.embeddings WHERE segment_id IN ({segments}))",
+                            (id_offset,),
+                        )
+                    # incremental snapshots may repeat queue entries already in their base
+                    rows += conn.execute(
+                        f"INSERT OR IGNORE INTO main.embeddings_queue (seq_id, created_at, operation, topic, id, vector, encoding, metadata) SELECT seq_id + ?, created_at, operation, topic, id, vector, encoding, metadata FROM {schema}.embeddings_queue WHERE topic IN (SELECT ? || id FROM {newest}.collections)",
+                        (seq_id_offset, topic_prefix),
+                    ).rowcount
+                    progress.update(task, advance=1)
+
+                task = progress.add_task(
+                    "Restoring hnsw_segment_data...", total=len(files)
+                )
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for segment_id, filename, _, chunks, sha256 in files:
+                        segment_dir = os.path.join(persist_dir, segment_id)
+                        if segment_dir not in restored_dirs:
+                            if os.path.exists(segment_dir):
+                                raise ValueError(
+                                    f"HNSW segment directory {segment_dir} already exists"
+                                )
+                            os.makedirs(segment_dir)
+                            restored_dirs.append(segment_dir)
+                        written += _restore_hnsw_file(
+                            conn,
+                            chunk_queries,
+                            segment_id,
+                            filename,
+                            chunks,
+                            sha256,
+                            os.path.join(segment_dir, filename),
+                            executor,
+                            max_in_flight=workers * 2,
+                        )
+                        if seq_id_offset and filename == "index_metadata.pickle":
+                            _shift_hnsw_metadata_seq_ids(
+                                os.path.join(segment_dir, filename), seq_id_offset
+                            )
+                        progress.update(task, advance=1)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for segment_dir in restored_dirs:
+                shutil.rmtree(segment_dir, ignore_errors=True)
+            raise e
+    elapsed = time.perf_counter() - start_time
+    console.print(
+        f"[green]Restored {rows:,} rows and {sizeof_fmt(written)} of HNSW segment data into [red]{persist_dir}[/red] "
+        f"in {elapsed:.2f}s ({sizeof_fmt(int(written / max(elapsed, 1e-9)))}/s)[/green]"
+    )
+
+
+def command(
+    persist_dir: str = typer.Argument(
+        ..., help="The persist directory to restore into"
+    ),
+    snapshot_file: Path = typer.Option(
+        ..., "--snapshot", "-s", help="The snapshot file to restore"
+    ),
+    yes: Optional[bool] = typer.Option(
+        False, "--yes", "-y", help="Skip confirmation prompt"
+    ),
+    workers: int = typer.Option(
+        1,
+        "--workers",
+        "-w",
+        help="Number of threads used to decompress and verify HNSW segment data",
+    ),
+) -> None:
+    collection_restore(persist_dir, snapshot_file, yes=yes, workers=workers)
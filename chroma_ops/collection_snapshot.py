@@ -1,18 +1,38 @@
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 import hashlib
 import os
 from pathlib import Path
+import shutil
+import sqlite3
+import struct
 import sys
-from typing import Optional
-import zlib
+import tempfile
+import time
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
 import typer
 from chromadb import __version__ as chroma_version
-from chroma_ops.constants import DEFAULT_TENANT_ID, DEFAULT_TOPIC_NAMESPACE
+from chroma_ops.constants import (
+    DEFAULT_CHROMA_SQLITE_FILE,
+    DEFAULT_SNAPSHOT_CACHE_SIZE,
+    DEFAULT_SNAPSHOT_CHUNK_SIZE,
+    DEFAULT_SNAPSHOT_PAGE_SIZE,
+    DEFAULT_TENANT_ID,
+    DEFAULT_TOPIC_NAMESPACE,
+    DEFAULT_BUSY_BACKOFF,
+    SNAPSHOT_PIN_RETRIES,
+)
+from chroma_ops.compression import Codec, compress, validate_codec
 from chroma_ops.utils import (
+    PersistentData,
     SqliteMode,
+    clone_file,
+    decode_seq_id,
     get_sqlite_connection,
     get_sqlite_snapshot_connection,
     print_chroma_version,
     read_script,
+    sizeof_fmt,
     validate_chroma_persist_dir,
 )
 from rich.console import Console
@@ -20,91 +40,638 @@ from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn
 from rich.table import Table
 
 
-def _copy_collection_to_snapshot_db(
-    persist_dir: str, collection: str, output_file: Path, yes: Optional[bool] = False
-) -> None:
-    console = Console()
-    with get_sqlite_connection(persist_dir, SqliteMode.READ_WRITE) as conn:
-        collection_id = conn.execute(
-            "SELECT id FROM collections WHERE name = ?",
-            (collection,),
-        ).fetchone()
-        if not collection_id:
-            raise ValueError(f"Collection {collection} not found")
-        collection_id = collection_id[0]
-        vector_segment_id = conn.execute(
-            "SELECT id FROM segments WHERE scope = 'VECTOR' AND collection = ?",
-            (collection_id,),
+def _read_chunks(filepath: str, chunk_size: int) -> Iterator[bytes]:
+    """Yield the file in chunks of `chunk_size` bytes. Empty files yield a single empty chunk."""
+    with open(filepath, "rb") as file:
+        chunk = file.read(chunk_size)
+        yield chunk
+        while len(chunk) == chunk_size:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _compress_chunk(
+    chunk: bytes, codec: Codec, level: Optional[int], base_sha256: Optional[str]
+) -> Tuple[Optional[bytes], str]:
+    """Compress and hash a chunk. Chunks unchanged since the base snapshot are not compressed."""
+    sha256 = hashlib.sha256(chunk).hexdigest()
+    if sha256 == base_sha256:
+        return None, sha256
+    return compress(chunk, codec, level), sha256
+
+
+def _copy_hnsw_file_to_snapshot_db(
+    conn: sqlite3.Connection,
+    segment_id: str,
+    filepath: str,
+    chunk_size: int,
+    executor: Executor,
+    max_in_flight: int,
+    codec: Codec = Codec.ZLIB,
+    level: Optional[int] = None,
+    base_chunks: Optional[Dict[int, str]] = None,
+) -> int:
+    """Stream an HNSW segment file into the snapshot db one compressed chunk at a time.
+
+    Chunks are compressed and hashed by the executor while the calling thread, the only
+    SQLite writer, inserts the results in order. At most `max_in_flight` chunks are held
+    in memory at any point, regardless of the file size.
+
+    `base_chunks` maps chunk ordinals to their hashes in the base snapshot. Chunks with an
+    unchanged hash are stored as references (NULL data) to the base snapshot.
+
+    Returns the size of the file.
+    """
+    base_chunks = base_chunks or {}
+    filename = os.path.basename(filepath)
+    file_hash = hashlib.sha256()
+    size = 0
+    chunks = 0
+    pending: Deque["Future[Tuple[Optional[bytes], str]]"] = deque()
+
+    def _write_next() -> None:
+        nonlocal chunks
+        compressed_data, sha256 = pending.popleft().result()
+        conn.execute(
+            "INSERT INTO snapshot.hnsw_segment_data (segment_id, filename, chunk, codec, data, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+            (segment_id, filename, chunks, codec.value, compressed_data, sha256),
+        )
+        chunks += 1
+
+    for ordinal, chunk in enumerate(_read_chunks(filepath, chunk_size)):
+        file_hash.update(chunk)
+        size += len(chunk)
+        pending.append(
+            executor.submit(
+                _compress_chunk, chunk, codec, level, base_chunks.get(ordinal)
+            )
+        )
+        if len(pending) >= max_in_flight:
+            _write_next()
+    while pending:
+        _write_next()
+    conn.execute(
+        "INSERT INTO snapshot.hnsw_segment_files (segment_id, filename, size, chunks, sha256) VALUES (?, ?, ?, ?, ?)",
+        (segment_id, filename, size, chunks, file_hash.hexdigest()),
+    )
+    return size
+
+
+def get_snapshot_metadata(
+    conn: sqlite3.Connection, schema: str = "main"
+) -> Dict[str, str]:
+    """Read the key/value metadata of a snapshot. Snapshots predating it return an empty dict."""
+    if not conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'snapshot_metadata'"
+    ).fetchone():
+        return {}
+    return dict(conn.execute(f"SELECT key, value FROM {schema}.snapshot_metadata"))
+
+
+def is_legacy_snapshot(conn: sqlite3.Connection, schema: str = "main") -> bool:
+    """Whether the snapshot predates chunked HNSW segment data.
+
+    Legacy snapshots have no hnsw_segment_files table, each hnsw_segment_data row holds a whole
+    zlib compressed file with the checksum of the uncompressed file and no chunk or codec column.
+    """
+    return (
+        conn.execute(
+            f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'hnsw_segment_files'"
         ).fetchone()
+        is None
+    )
+
+
+def get_snapshot_chain(snapshot_file: str) -> List[str]:
+    """Return the snapshot followed by all of its base snapshots, newest first."""
+    chain = [os.path.abspath(snapshot_file)]
+    while True:
+        if not os.path.exists(chain[-1]):
+            raise ValueError(f"Snapshot file {chain[-1]} does not exist")
+        with get_sqlite_snapshot_connection(chain[-1]) as conn:
+            base = get_snapshot_metadata(conn).get("base_snapshot")
+        if not base:
+            return chain
+        # older snapshots store an absolute path, newer ones a path relative to the snapshot
+        base = os.path.abspath(os.path.join(os.path.dirname(chain[-1]), base))
+        if base in chain:
+            raise ValueError(f"Snapshot {chain[-1]} has a circular base chain")
+        chain.append(base)
+
+
+def _attach_snapshot_db(conn: sqlite3.Connection, output_file: Path) -> None:
+    """Attach the snapshot database for bulk loading.
+
+    The snapshot is deleted if the copy fails, so it does not need a rollback journal or fsyncs.
+    Must be called outside of a transaction.
+    """
+    conn.execute(
+        "ATTACH DATABASE ? AS snapshot",
+        (output_file.absolute().as_posix(),),
+    )
+    conn.execute("PRAGMA snapshot.journal_mode = OFF")
+    conn.execute("PRAGMA snapshot.synchronous = OFF")
+    conn.execute(f"PRAGMA snapshot.cache_size = -{DEFAULT_SNAPSHOT_CACHE_SIZE // 1024}")
+
+
+def _segment_files_agree(segment_dir: str) -> bool:
+    """Whether the HNSW files and the index_metadata.pickle of a segment are from the same persist.
+
+    Chroma writes the index files first and the pickle after, a copy taken in between has a
+    different number of elements in the index than labels handed out in the pickle. The element
+    count is read from header.bin (persistence version, offsetLevel0, max_elements,
+    cur_element_count) rather than by loading the index.
+    """
+    metadata_file = os.path.join(segment_dir, "index_metadata.pickle")
+    header_file = os.path.join(segment_dir, "header.bin")
+    if not os.path.exists(metadata_file) or not os.path.exists(header_file):
+        # never persisted, Chroma rebuilds the segment from the WAL
+        return not os.path.exists(header_file)
+    with open(header_file, "rb") as f:
+        header = f.read(28)
+    if len(header) < 28:
+        return False
+    persistence_version, _, _, element_count = struct.unpack("<iQQQ", header)
+    if persistence_version != 1:
+        # an unknown layout cannot be checked
+        return True
+    metadata = PersistentData.load_from_file(metadata_file)
+    total_elements_added = (
+        metadata["total_elements_added"]
+        if isinstance(metadata, dict)
+        else metadata.total_elements_added
+    )
+    return bool(element_count == total_elements_added)
+
+
+def _pin_collections(
+    conn: sqlite3.Connection,
+    persist_dir: str,
+    vector_segment_ids: Sequence[str],
+    staging_dir: str,
+    output_file: Path,
+) -> Tuple[sqlite3.Connection, float]:
+    """Pin a consistent view of the sysdb and of the collections' HNSW segment files.
+
+    The writer lock on the live database is only held while the segment files are cloned
+    (copy-on-write where the filesystem supports it) and the sysdb view is taken. In WAL mode
+    the view is a read transaction on the live database. Otherwise only the vector segments'
+    max seq ids are read under the lock, the sysdb is then copied to the staging dir with the
+    SQLite backup API after the lock is released. Hardlinks are not used as hnswlib updates
+    segment files in place.
+
+    The lock does not stop Chroma from persisting an index, the pin is retried if a cloned
+    segment was caught half persisted, or when not in WAL mode, if a segment's max seq id moved
+    before the backup was taken.
+
+    Returns the connection to copy rows from, with the snapshot database attached, and the
+    lock hold time. The pinned segment files are in `staging_dir/<segment_id>`.
+    """
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    live_file = os.path.join(persist_dir, DEFAULT_CHROMA_SQLITE_FILE)
+    placeholders = ", ".join("?" for _ in vector_segment_ids)
+    for attempt in range(SNAPSHOT_PIN_RETRIES):
+        source: Optional[sqlite3.Connection] = None
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for vector_segment_id in vector_segment_ids:
+                pinned_segment_dir = os.path.join(staging_dir, vector_segment_id)
+                os.makedirs(pinned_segment_dir)
+                for entry in os.scandir(os.path.join(persist_dir, vector_segment_id)):
+                    if entry.is_file():
+                        clone_file(
+                            entry.path, os.path.join(pinned_segment_dir, entry.name)
+                        )
+            pinned_seq_ids = dict(
+                conn.execute(
+                    f"SELECT segment_id, seq_id FROM max_seq_id WHERE segment_id IN ({placeholders})",
+                    list(vector_segment_ids),
+                ).fetchall()
+            )
+            if journal_mode.lower() == "wal":
+                # the reserved lock taken by BEGIN IMMEDIATE blocks writers but not readers
+                source = sqlite3.connect(f"file:{live_file}?mode=rw", uri=True)
+                _attach_snapshot_db(source, output_file)
+                source.execute("BEGIN")
+                # the read view is established by the first read, not by BEGIN
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        finally:
+            conn.rollback()
+        lock_held = time.perf_counter() - start
+        consistent = all(
+            _segment_files_agree(os.path.join(staging_dir, vector_segment_id))
+            for vector_segment_id in vector_segment_ids
+        )
+        if source is None:
+            # rollback journal, the backup does not need the writer lock
+            source = sqlite3.connect(
+                os.path.join(staging_dir, DEFAULT_CHROMA_SQLITE_FILE)
+            )
+            reader = sqlite3.connect(f"file:{live_file}?mode=ro", uri=True)
+            try:
+                reader.backup(source)
+            finally:
+                reader.close()
+            consistent = consistent and pinned_seq_ids == dict(
+                source.execute(
+                    f"SELECT segment_id, seq_id FROM max_seq_id WHERE segment_id IN ({placeholders})",
+                    list(vector_segment_ids),
+                ).fetchall()
+            )
+            if consistent:
+                _attach_snapshot_db(source, output_file)
+                source.execute("BEGIN")
+        if consistent:
+            return source, lock_held
+        source.rollback()
+        source.close()
+        for vector_segment_id in vector_segment_ids:
+            shutil.rmtree(
+                os.path.join(staging_dir, vector_segment_id), ignore_errors=True
+            )
+        staged_sysdb = os.path.join(staging_dir, DEFAULT_CHROMA_SQLITE_FILE)
+        if os.path.exists(staged_sysdb):
+            os.remove(staged_sysdb)
+        time.sleep(DEFAULT_BUSY_BACKOFF * 2**attempt)
+    raise ValueError(
+        "The HNSW segments kept changing while pinning them, retry the snapshot when Chroma is less busy"
+    )
+
+
+# (collection_id, name, vector_segment_id, metadata_segment_id, topic, base_max_seq_id, base_queue_max_seq_id)
+SnapshotCollection = Tuple[str, str, str, str, str, int, int]
+
+
+def _get_snapshot_collections(
+    conn: sqlite3.Connection, collections: Optional[Sequence[str]]
+) -> List[SnapshotCollection]:
+    """Resolve the collections to snapshot, all collections if `collections` is None."""
+    rows = conn.execute(
+        """
+        SELECT c.id, c.name, v.id, m.id
+        FROM collections c
+        LEFT JOIN segments v ON v.collection = c.id AND v.scope = 'VECTOR'
+        LEFT JOIN segments m ON m.collection = c.id AND m.scope = 'METADATA'
+        ORDER BY c.name
+        """
+    ).fetchall()
+    if collections is not None:
+        missing = set(collections) - {row[1] for row in rows}
+        if missing:
+            raise ValueError(f"Collection {', '.join(sorted(missing))} not found")
+        rows = [row for row in rows if row[1] in collections]
+    result: List[SnapshotCollection] = []
+    for collection_id, name, vector_segment_id, metadata_segment_id in rows:
         if not vector_segment_id:
-            raise ValueError(f"Vector segment for collection {collection} not found")
-        vector_segment_id = vector_segment_id[0]
-        metadata_segment_id = conn.execute(
-            "SELECT id FROM segments WHERE scope = 'METADATA' AND collection = ?",
-            (collection_id,),
-        ).fetchone()
+            raise ValueError(f"Vector segment for collection {name} not found")
         if not metadata_segment_id:
-            raise ValueError(f"Metadata segment for collection {collection} not found")
-        metadata_segment_id = metadata_segment_id[0]
-        segment_dir = os.path.join(persist_dir, vector_segment_id)
+            raise ValueError(f"Metadata segment for collection {name} not found")
         topic = f"persistent://{DEFAULT_TENANT_ID}/{DEFAULT_TOPIC_NAMESPACE}/{collection_id}"
-        table = Table(title="Copying collection to snapshot database...")
-        table.add_column("Table", style="cyan")
-        table.add_column("Count", style="magenta")
-        console.print(
-            f"Copying collection [red]{collection}[/red] to snapshot database..."
+        result.append(
+            (collection_id, name, vector_segment_id, metadata_segment_id, topic, -1, -1)
         )
-        embeddings_queue_count = conn.execute(
-            "SELECT COUNT(*) FROM main.embeddings_queue WHERE topic = ?",
-            (topic,),
-        ).fetchone()
-        table.add_row("Embeddings Queue", f"{embeddings_queue_count[0]:,}")
-        max_seq_id_count = conn.execute(
-            "SELECT COUNT(*) FROM main.max_seq_id WHERE segment_id IN (?, ?)",
-            (vector_segment_id, metadata_segment_id),
-        ).fetchone()
-        table.add_row("Max Seq ID", f"{max_seq_id_count[0]:,}")
-        embeddings_count = conn.execute(
-            "SELECT COUNT(*) FROM main.embeddings WHERE segment_id = ?",
-            (metadata_segment_id,),
-        ).fetchone()
-        table.add_row("Embeddings", f"{embeddings_count[0]:,}")
-        embedding_metadata_count = conn.execute(
-            "SELECT COUNT(*) FROM main.embedding_metadata WHERE id IN (SELECT id FROM main.embeddings WHERE segment_id = ?)",
-            (metadata_segment_id,),
-        ).fetchone()
-        table.add_row("Embedding Metadata", f"{embedding_metadata_count[0]:,}")
-        segments_count = conn.execute(
-            "SELECT COUNT(*) FROM main.segments WHERE collection = ?",
-            (collection_id,),
-        ).fetchone()
-        table.add_row("Segments", f"{segments_count[0]:,}")
-        segment_metadata_count = conn.execute(
-            "SELECT COUNT(*) FROM main.segment_metadata WHERE segment_id IN (SELECT id FROM main.segments WHERE collection = ?)",
-            (collection_id,),
-        ).fetchone()
-        table.add_row("Segment Metadata", f"{segment_metadata_count[0]:,}")
-        collections_count = conn.execute(
-            "SELECT COUNT(*) FROM main.collections WHERE id = ?",
-            (collection_id,),
-        ).fetchone()
-        table.add_row("Collections", f"{collections_count[0]:,}")
-        collection_metadata_count = conn.execute(
-            "SELECT COUNT(*) FROM main.collection_metadata WHERE collection_id = ?",
-            (collection_id,),
+    return result
+
+
+def _create_snapshot_collections_table(
+    conn: sqlite3.Connection, collections: List[SnapshotCollection]
+) -> None:
+    """Stage the collections in a temp table so that every table is copied with a single statement."""
+    conn.execute(
+        """
+        CREATE TEMP TABLE snapshot_collections
+        (
+            collection_id         TEXT primary key,
+            name                  TEXT not null,
+            vector_segment_id     TEXT not null,
+            metadata_segment_id   TEXT not null,
+            topic                 TEXT not null,
+            base_max_seq_id       INTEGER not null,
+            base_queue_max_seq_id INTEGER not null
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO temp.snapshot_collections VALUES (?, ?, ?, ?, ?, ?, ?)",
+        collections,
+    )
+
+
+def _apply_base_snapshot(
+    conn: sqlite3.Connection, collections: List[SnapshotCollection]
+) -> Tuple[List[SnapshotCollection], Dict[Tuple[str, str], Dict[int, str]]]:
+    """Set the seq id thresholds of collections already in the attached base snapshot.
+
+    Returns the updated collections and the base chunk hashes per (segment_id, filename).
+    Collections that are not in the base are copied in full.
+    """
+    in_base = {
+        row[0] for row in conn.execute("SELECT id FROM base.collections").fetchall()
+    }
+    base_max_seq_ids = {
+        segment_id: decode_seq_id(seq_id)
+        for segment_id, seq_id in conn.execute(
+            "SELECT segment_id, seq_id FROM base.max_seq_id"
+        ).fetchall()
+    }
+    base_queue_max_seq_ids = dict(
+        conn.execute(
+            "SELECT topic, MAX(seq_id) FROM base.embeddings_queue GROUP BY topic"
+        ).fetchall()
+    )
+    result: List[SnapshotCollection] = []
+    for collection_id, name, vector_id, metadata_id, topic, _, _ in collections:
+        base_max_seq_id = -1
+        base_queue_max_seq_id = -1
+        if collection_id in in_base:
+            base_max_seq_id = base_max_seq_ids.get(metadata_id, -1)
+            base_queue_max_seq_id = max(
+                base_queue_max_seq_ids.get(topic, -1), base_max_seq_id
+            )
+        result.append(
+            (
+                collection_id,
+                name,
+                vector_id,
+                metadata_id,
+                topic,
+                base_max_seq_id,
+                base_queue_max_seq_id,
+            )
+        )
+    vector_segment_ids = {c[2] for c in collections}
+    base_chunks: Dict[Tuple[str, str], Dict[int, str]] = {}
+    for segment_id, filename, chunk, sha256 in conn.execute(
+        "SELECT segment_id, filename, chunk, sha256 FROM base.hnsw_segment_data"
+    ):
+        if segment_id in vector_segment_ids:
+            base_chunks.setdefault((segment_id, filename), {})[chunk] = sha256
+    return result, base_chunks
+
+
+def _get_table_bytes(conn: sqlite3.Connection, table_name: str) -> Optional[int]:
+    """Size of a table and its indices from the dbstat page counts, None if dbstat is not available."""
+    names = [
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM main.sqlite_master WHERE tbl_name = ? AND type IN ('table', 'index')",
+            (table_name,),
+        ).fetchall()
+    ]
+    try:
+        return sum(
+            int(
+                conn.execute(
+                    "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = ? AND aggregate = TRUE",
+                    (name,),
+                ).fetchone()[0]
+            )
+            for name in names
+        )
+    except sqlite3.OperationalError:
+        return None
+
+
+def _estimate_snapshot(
+    conn: sqlite3.Connection,
+    persist_dir: str,
+    snapshot_collections: List[SnapshotCollection],
+    segment_files: Dict[str, List[str]],
+    embeddings_counts: Dict[str, int],
+    chunk_size: int,
+    workers: int,
+    codec: Codec,
+    level: Optional[int],
+) -> Tuple[Dict[str, int], int, float]:
+    """Estimate a snapshot without scanning embedding_metadata.
+
+    Metadata rows per embedding come from sqlite_stat1 when the database has been analyzed,
+    otherwise from the rowid ranges of the tables. Row sizes come from dbstat page counts.
+    The HNSW output size and time are projected by compressing a sample of the largest file.
+
+    Returns the estimated embedding_metadata rows per metadata segment, the projected
+    output size in bytes and the projected copy time in seconds.
+    """
+    max_embedding_id = conn.execute("SELECT MAX(id) FROM main.embeddings").fetchone()[0]
+    max_metadata_rowid = conn.execute(
+        "SELECT MAX(rowid) FROM main.embedding_metadata"
+    ).fetchone()[0]
+    max_embedding_id = max_embedding_id or 0
+    max_metadata_rowid = max_metadata_rowid or 0
+    metadata_per_embedding = max_metadata_rowid / max(max_embedding_id, 1)
+    if conn.execute(
+        "SELECT 1 FROM main.sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchone():
+        # stat is "<rows> <rows per id> <rows per (id, key)>" for the primary key index
+        row = conn.execute(
+            "SELECT stat FROM main.sqlite_stat1 WHERE tbl = 'embedding_metadata' AND idx = 'sqlite_autoindex_embedding_metadata_1'"
         ).fetchone()
-        table.add_row("Collection Metadata", f"{collection_metadata_count[0]:,}")
-        table.add_row("HNSW Segment Data Files", f"{len(os.listdir(segment_dir)):,}")
+        if row:
+            metadata_per_embedding = float(row[0].split()[1])
+    metadata_counts = {
+        metadata_id: int(count * metadata_per_embedding)
+        for metadata_id, count in embeddings_counts.items()
+    }
+    embedding_rows = sum(embeddings_counts.values())
+    metadata_rows = sum(metadata_counts.values())
+    embeddings_bytes = _get_table_bytes(conn, "embeddings")
+    metadata_bytes = _get_table_bytes(conn, "embedding_metadata")
+    if embeddings_bytes is None or metadata_bytes is None:
+        # without dbstat spread the whole database over the rows
+        page_size = conn.execute("PRAGMA main.page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA main.page_count").fetchone()[0]
+        row_bytes = (
+            page_size * page_count / max(max_embedding_id + max_metadata_rowid, 1)
+        )
+        rows_bytes = int(row_bytes * (embedding_rows + metadata_rows))
+    else:
+        rows_bytes = int(
+            embeddings_bytes * embedding_rows / max(max_embedding_id, 1)
+            + metadata_bytes * metadata_rows / max(max_metadata_rowid, 1)
+        )
+    # time reading a sample of metadata rows to project the row copy time
+    start = time.perf_counter()
+    sampled = len(
+        conn.execute(
+            "SELECT * FROM main.embedding_metadata WHERE rowid > ? LIMIT 10000",
+            (max_metadata_rowid // 2,),
+        ).fetchall()
+    )
+    rows_per_second = sampled / max(time.perf_counter() - start, 1e-9)
+    rows_time = (embedding_rows + metadata_rows) / max(rows_per_second, 1)
+    hnsw_files = [
+        os.path.join(persist_dir, segment_id, filename)
+        for segment_id, filenames in segment_files.items()
+        for filename in filenames
+    ]
+    hnsw_bytes = sum(os.path.getsize(filepath) for filepath in hnsw_files)
+    hnsw_ratio = 1.0
+    hnsw_time = 0.0
+    if hnsw_bytes > 0:
+        with open(max(hnsw_files, key=os.path.getsize), "rb") as file:
+            sample = file.read(min(chunk_size, 4 * 1024 * 1024))
+        start = time.perf_counter()
+        compressed = compress(sample, codec, level)
+        elapsed = time.perf_counter() - start
+        hnsw_ratio = len(compressed) / max(len(sample), 1)
+        bytes_per_second = len(sample) / max(elapsed, 1e-9)
+        hnsw_time = hnsw_bytes / (bytes_per_second * min(workers, os.cpu_count() or 1))
+    return (
+        metadata_counts,
+        rows_bytes + int(hnsw_bytes * hnsw_ratio),
+        rows_time + hnsw_time,
+    )
+
+
+def _copy_collections_to_snapshot_db(
+    persist_dir: str,
+    collections: Optional[Sequence[str]],
+    output_file: Path,
+    yes: Optional[bool] = False,
+    chunk_size: int = DEFAULT_SNAPSHOT_CHUNK_SIZE,
+    workers: int = 1,
+    codec: Codec = Codec.ZLIB,
+    level: Optional[int] = None,
+    base: Optional[Path] = None,
+    online: Optional[bool] = False,
+    estimate: Optional[bool] = False,
+) -> bool:
+    """Copy the collections to the bootstrapped snapshot database. Returns False if cancelled by the user."""
+    console = Console()
+    with get_sqlite_connection(persist_dir, SqliteMode.READ_WRITE) as conn:
+        snapshot_collections = _get_snapshot_collections(conn, collections)
+        if len(snapshot_collections) == 0:
+            raise ValueError("No collections to snapshot")
+        # rows and chunks already present in the base snapshot are not copied again
+        base_chunks: Dict[Tuple[str, str], Dict[int, str]] = {}
+        if base:
+            conn.execute(
+                "ATTACH DATABASE ? AS base",
+                (f"file:{base.absolute().as_posix()}?mode=ro",),
+            )
+            snapshot_collections, base_chunks = _apply_base_snapshot(
+                conn, snapshot_collections
+            )
+            conn.execute("DETACH DATABASE base")
+        _create_snapshot_collections_table(conn, snapshot_collections)
+        conn.commit()
+        table = Table(title="Copying collections to snapshot database...")
+        table.add_column("Collection", style="cyan")
+        table.add_column("Embeddings", style="magenta")
+        table.add_column("Embedding Metadata", style="magenta")
+        table.add_column("Embeddings Queue", style="magenta")
+        table.add_column("HNSW Segment Data Files", style="magenta")
+        if base:
+            table.add_column("Base Max Seq ID", style="magenta")
+        # one grouped scan per table instead of a COUNT per collection and table
+        embeddings_counts = dict(
+            conn.execute(
+                "SELECT segment_id, COUNT(*) FROM main.embeddings WHERE segment_id IN (SELECT metadata_segment_id FROM temp.snapshot_collections) GROUP BY segment_id"
+            ).fetchall()
+        )
+        embeddings_queue_counts = dict(
+            conn.execute(
+                "SELECT topic, COUNT(*) FROM main.embeddings_queue WHERE topic IN (SELECT topic FROM temp.snapshot_collections) GROUP BY topic"
+            ).fetchall()
+        )
+        segment_files = {
+            c[2]: [
+                filename
+                for filename in os.listdir(os.path.join(persist_dir, c[2]))
+                if os.path.isfile(os.path.join(persist_dir, c[2], filename))
+            ]
+            for c in snapshot_collections
+        }
+        if estimate:
+            (
+                embedding_metadata_counts,
+                projected_bytes,
+                projected_time,
+            ) = _estimate_snapshot(
+                conn,
+                persist_dir,
+                snapshot_collections,
+                segment_files,
+                embeddings_counts,
+                chunk_size,
+                workers,
+                codec,
+                level,
+            )
+        else:
+            embedding_metadata_counts = dict(
+                conn.execute(
+                    "SELECT e.segment_id, COUNT(*) FROM main.embedding_metadata em JOIN main.embeddings e ON em.id = e.id WHERE e.segment_id IN (SELECT metadata_segment_id FROM temp.snapshot_collections) GROUP BY e.segment_id"
+                ).fetchall()
+            )
+        for (
+            _,
+            name,
+            vector_id,
+            metadata_id,
+            topic,
+            base_max_seq_id,
+            _,
+        ) in snapshot_collections:
+            row = [
+                name,
+                f"{embeddings_counts.get(metadata_id, 0):,}",
+                f"{'~' if estimate else ''}{embedding_metadata_counts.get(metadata_id, 0):,}",
+                f"{embeddings_queue_counts.get(topic, 0):,}",
+                f"{len(segment_files[vector_id]):,}",
+            ]
+            if base:
+                row.append(f"{base_max_seq_id:,}" if base_max_seq_id >= 0 else "-")
+            table.add_row(*row)
         console.print(table)
+        if estimate:
+            console.print(
+                f"Projected snapshot size: [red]~{sizeof_fmt(projected_bytes)}[/red], projected copy time: [red]~{projected_time:.1f}s[/red]"
+                + (" (before skipping rows and chunks in the base)" if base else "")
+            )
+        if base:
+            console.print(
+                f"Base snapshot: [red]{base.absolute().as_posix()}[/red], collections without a Base Max Seq ID are copied in full"
+            )
         if not yes:
             if not typer.confirm(
-                "\nAre you sure you want to copy this collection to the snapshot database?",
+                f"\nAre you sure you want to copy {len(snapshot_collections)} collection(s) to the snapshot database?",
                 default=False,
                 show_default=True,
             ):
                 console.print("[yellow]Copy cancelled by user[/yellow]")
-                return
-        conn.execute("BEGIN EXCLUSIVE")
+                return False
+        source = conn
+        segment_root = persist_dir
+        staging_dir = None
+        if online:
+            staging_dir = tempfile.mkdtemp(
+                prefix=".chops-snapshot-", dir=output_file.absolute().parent
+            )
+            segment_root = staging_dir
+            try:
+                source, lock_held = _pin_collections(
+                    conn,
+                    persist_dir,
+                    list(segment_files.keys()),
+                    staging_dir,
+                    output_file,
+                )
+            except Exception:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise
+            _create_snapshot_collections_table(source, snapshot_collections)
+            console.print(
+                f"Pinned a consistent view of the collections, writer lock held for [red]{lock_held * 1000:.1f}ms[/red]"
+            )
+        else:
+            _attach_snapshot_db(conn, output_file)
+            conn.execute("BEGIN EXCLUSIVE")
+        copied: Dict[str, int] = {}
+        start_time = time.perf_counter()
         try:
             with Progress(
                 SpinnerColumn(
@@ -117,49 +684,49 @@ def _copy_collection_to_snapshot_db(
                 ],  # Add these columns
                 transient=True,
             ) as progress:
-                conn.execute(
-                    "ATTACH DATABASE ? AS snapshot",
-                    (output_file.absolute().as_posix(),),
-                )
-                # copy the collection to the snapshot db
+                # copy the collections to the snapshot db
                 task = progress.add_task("Copying embedings_queue...", total=0)
-                conn.execute(
-                    "INSERT INTO snapshot.embeddings_queue SELECT * FROM main.embeddings_queue WHERE topic = ?",
-                    (topic,),
-                )
+                copied["embeddings_queue"] = source.execute(
+                    "INSERT INTO snapshot.embeddings_queue SELECT q.* FROM main.embeddings_queue q JOIN temp.snapshot_collections c ON q.topic = c.topic WHERE q.seq_id > c.base_queue_max_seq_id"
+                ).rowcount
                 progress.update(task, advance=1)
                 task = progress.add_task("Copying max_seq_id...", total=0)
-                conn.execute(
-                    "INSERT INTO snapshot.max_seq_id SELECT * FROM main.max_seq_id WHERE segment_id IN (?, ?)",
-                    (vector_segment_id, metadata_segment_id),
-                )
+                copied["max_seq_id"] = source.execute(
+                    "INSERT INTO snapshot.max_seq_id SELECT * FROM main.max_seq_id WHERE segment_id IN (SELECT vector_segment_id FROM temp.snapshot_collections UNION ALL SELECT metadata_segment_id FROM temp.snapshot_collections)"
+                ).rowcount
                 progress.update(task, advance=1)
                 task = progress.add_task("Copying embeddings...", total=0)
-                conn.execute(
-                    "INSERT INTO snapshot.embeddings SELECT * FROM main.embeddings WHERE segment_id = ? ",
-                    (metadata_segment_id,),
-                )
+                copied["embeddings"] = source.execute(
+                    "INSERT INTO snapshot.embeddings SELECT e.* FROM main.embeddings e JOIN temp.snapshot_collections c ON e.segment_id = c.metadata_segment_id WHERE e.seq_id > c.base_max_seq_id"
+                ).rowcount
                 progress.update(task, advance=1)
                 task = progress.add_task("Copying embedding_metadata...", total=0)
-                conn.execute(
-                    "INSERT INTO snapshot.embedding_metadata SELECT * FROM main.embedding_metadata WHERE id IN (SELECT id FROM main.embeddings WHERE segment_id = ?)",
-                    (metadata_segment_id,),
-                )
+                copied["embedding_metadata"] = source.execute(
+                    "INSERT INTO snapshot.embedding_metadata SELECT * FROM main.embedding_metadata WHERE id IN (SELECT id FROM snapshot.embeddings)"
+                ).rowcount
                 progress.update(task, advance=1)
+                if base:
+                    # the live id set lets restore drop rows deleted since the base snapshot
+                    task = progress.add_task("Copying embedding_ids...", total=0)
+                    source.execute(
+                        "INSERT INTO snapshot.embedding_id_segments (segment_id) SELECT metadata_segment_id FROM temp.snapshot_collections"
+                    )
+                    copied["embedding_ids"] = source.execute(
+                        "INSERT INTO snapshot.embedding_ids (id, segment_key) SELECT e.id, s.key FROM main.embeddings e JOIN snapshot.embedding_id_segments s ON e.segment_id = s.segment_id"
+                    ).rowcount
+                    progress.update(task, advance=1)
                 task = progress.add_task("Copying segments...", total=0)
-                conn.execute(
-                    "INSERT INTO snapshot.segments SELECT * FROM main.segments WHERE collection = ?",
-                    (collection_id,),
-                )
+                copied["segments"] = source.execute(
+                    "INSERT INTO snapshot.segments SELECT * FROM main.segments WHERE collection IN (SELECT collection_id FROM temp.snapshot_collections)"
+                ).rowcount
                 progress.update(task, advance=1)
                 task = progress.add_task("Copying segment_metadata...", total=0)
-                conn.execute(
-                    "INSERT INTO snapshot.segment_metadata SELECT * FROM main.segment_metadata WHERE segment_id IN (SELECT id FROM main.segments WHERE collection = ?)",
-                    (collection_id,),
-                )
+                copied["segment_metadata"] = source.execute(
+                    "INSERT INTO snapshot.segment_metadata SELECT * FROM main.segment_metadata WHERE segment_id IN (SELECT id FROM snapshot.segments)"
+                ).rowcount
                 progress.update(task, advance=1)
                 task = progress.add_task("Copying collections...", total=0)
-                conn.execute(
+                copied["collections"] = source.execute(
                     """
                     INSERT INTO snapshot.collections (id, name, dimension, database_id, database_name, tenant_id, config_json_str)
                     SELECT
@@ -177,50 +744,124 @@ def _copy_collection_to_snapshot_db(
                     JOIN
                         tenants AS t ON db.tenant_id = t.id
                     WHERE
-                        src.id = ?;
-                    """,
-                    (collection_id,),
-                )
+                        src.id IN (SELECT collection_id FROM temp.snapshot_collections);
+                    """
+                ).rowcount
                 progress.update(task, advance=1)
                 task = progress.add_task("Copying collection_metadata...", total=0)
-                conn.execute(
-                    "INSERT INTO snapshot.collection_metadata SELECT * FROM main.collection_metadata WHERE collection_id = ?",
-                    (collection_id,),
-                )
+                copied["collection_metadata"] = source.execute(
+                    "INSERT INTO snapshot.collection_metadata SELECT * FROM main.collection_metadata WHERE collection_id IN (SELECT collection_id FROM temp.snapshot_collections)"
+                ).rowcount
                 progress.update(task, advance=1)
 
                 task = progress.add_task(
-                    "Copying hnsw_segment_data...", total=len(os.listdir(segment_dir))
+                    "Copying hnsw_segment_data...",
+                    total=sum(len(files) for files in segment_files.values()),
                 )
-                for filename in os.listdir(segment_dir):
-                    filepath = os.path.join(segment_dir, filename)
-                    if os.path.isfile(filepath):
-                        with open(filepath, "rb") as file:
-                            binary_data = file.read()
-                        compressed_data = zlib.compress(binary_data)
-                        sha256 = hashlib.sha256(binary_data).hexdigest()
-                        # Insert the compressed data into the database
-                        conn.execute(
-                            "INSERT INTO snapshot.hnsw_segment_data (segment_id, filename, data, sha256) VALUES (?, ?, ?, ?)",
-                            (vector_segment_id, filename, compressed_data, sha256),
-                        )
-                        progress.update(task, advance=1)
-            conn.commit()
+                # one pool shared by all collections keeps the workers busy across small segments
+                copied["hnsw_segment_bytes"] = 0
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for vector_segment_id, filenames in segment_files.items():
+                        for filename in filenames:
+                            copied[
+                                "hnsw_segment_bytes"
+                            ] += _copy_hnsw_file_to_snapshot_db(
+                                source,
+                                vector_segment_id,
+                                os.path.join(segment_root, vector_segment_id, filename),
+                                chunk_size,
+                                executor,
+                                max_in_flight=workers * 2,
+                                codec=codec,
+                                level=level,
+                                base_chunks=base_chunks.get(
+                                    (vector_segment_id, filename)
+                                ),
+                            )
+                            progress.update(task, advance=1)
+                task = progress.add_task("Writing snapshot_manifest...", total=0)
+                source.execute(
+                    """
+                    INSERT INTO snapshot.snapshot_manifest
+                    SELECT
+                        col.id,
+                        col.name,
+                        col.database_name,
+                        col.tenant_id,
+                        COALESCE(e.n, 0),
+                        COALESCE(em.n, 0),
+                        COALESCE(q.n, 0),
+                        COALESCE(f.n, 0),
+                        COALESCE(f.size, 0)
+                    FROM temp.snapshot_collections c
+                    JOIN snapshot.collections col ON col.id = c.collection_id
+                    LEFT JOIN (SELECT segment_id, COUNT(*) AS n FROM snapshot.embeddings GROUP BY segment_id) e
+                        ON e.segment_id = c.metadata_segment_id
+                    LEFT JOIN (SELECT e.segment_id, COUNT(*) AS n FROM snapshot.embedding_metadata m JOIN snapshot.embeddings e ON m.id = e.id GROUP BY e.segment_id) em
+                        ON em.segment_id = c.metadata_segment_id
+                    LEFT JOIN (SELECT topic, COUNT(*) AS n FROM snapshot.embeddings_queue GROUP BY topic) q
+                        ON q.topic = c.topic
+                    LEFT JOIN (SELECT segment_id, COUNT(*) AS n, SUM(size) AS size FROM snapshot.hnsw_segment_files GROUP BY segment_id) f
+                        ON f.segment_id = c.vector_segment_id
+                    """
+                )
+                progress.update(task, advance=1)
+            source.commit()
+            copied_table = Table(
+                title=f"Copied in {time.perf_counter() - start_time:.2f}s"
+            )
+            copied_table.add_column("Table", style="cyan")
+            copied_table.add_column("Count", style="magenta")
+            for table_name, count in copied.items():
+                copied_table.add_row(
+                    table_name,
+                    sizeof_fmt(count)
+                    if table_name == "hnsw_segment_bytes"
+                    else f"{count:,}",
+                )
+            console.print(copied_table)
             console.print(
-                f"[green]Collection [red]{collection}[/red] copied to snapshot database in [red]{output_file.absolute().as_posix()}[/red][/green]"
+                f"[green]{len(snapshot_collections)} collection(s) copied to snapshot database in [red]{output_file.absolute().as_posix()}[/red][/green]"
             )
         except Exception as e:
-            conn.rollback()
+            source.rollback()
             raise e
+        finally:
+            if source is not conn:
+                source.close()
+            if staging_dir:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+    return True
 
 
 def collection_snapshot(
     persist_dir: str,
-    collection: str,
+    collections: Optional[Sequence[str]],
     output_file: Path,
     yes: Optional[bool] = False,
+    chunk_size: int = DEFAULT_SNAPSHOT_CHUNK_SIZE,
+    workers: int = 1,
+    codec: Codec = Codec.ZLIB,
+    level: Optional[int] = None,
+    base: Optional[Path] = None,
+    online: Optional[bool] = False,
+    all_collections: Optional[bool] = False,
+    estimate: Optional[bool] = False,
 ) -> None:
+    """Snapshot the given collections, or every collection with `all_collections`, into a single file."""
     console = Console()
+    # a str is a Sequence[str] too, it must not be split into one collection per character
+    if isinstance(collections, str):
+        collections = [collections]
+    if all_collections and collections:
+        raise ValueError("Collections cannot be specified together with all")
+    if not all_collections and not collections:
+        raise ValueError("At least one collection or all must be specified")
+    if chunk_size <= 0:
+        raise ValueError("Chunk size must be a positive number of bytes")
+    if workers <= 0:
+        raise ValueError("Number of workers must be a positive number")
+    validate_codec(codec, level)
     if tuple(int(part) for part in chroma_version.split(".")) < (0, 6, 0):
         console.print(
             "Collection snapshot is not supported for this version of ChromaDB",
@@ -229,6 +870,21 @@ def collection_snapshot(
         sys.exit(1)
     validate_chroma_persist_dir(persist_dir)
     print_chroma_version(console)
+    if base:
+        if not base.exists():
+            raise ValueError(
+                f"Base snapshot {base.absolute().as_posix()} does not exist"
+            )
+        if base.absolute() == output_file.absolute():
+            raise ValueError("The base snapshot cannot be the output file")
+        with get_sqlite_snapshot_connection(base.absolute().as_posix()) as conn:
+            base_metadata = get_snapshot_metadata(conn)
+        if "chunk_size" not in base_metadata:
+            raise ValueError(
+                f"{base.absolute().as_posix()} predates incremental snapshots and cannot be used as a base"
+            )
+        # chunk boundaries must line up with the base for chunk hashes to be comparable
+        chunk_size = int(base_metadata["chunk_size"])
     if output_file.exists():
         if not yes:
             if not typer.confirm(
@@ -245,23 +901,125 @@ def collection_snapshot(
         output_file.absolute().as_posix(), mode=SqliteMode.READ_WRITE
     ) as conn:
         console.print("Bootstrapping snapshot database...")
+        # the page size can only be set before the first table is created
+        conn.execute(f"PRAGMA page_size = {DEFAULT_SNAPSHOT_PAGE_SIZE}")
         script = read_script("scripts/snapshot.sql")
         conn.executescript(script)
+        conn.execute(
+            "INSERT INTO snapshot_metadata (key, value) VALUES ('chunk_size', ?)",
+            (str(chunk_size),),
+        )
+        if base:
+            conn.execute(
+                "INSERT INTO snapshot_metadata (key, value) VALUES ('base_snapshot', ?)",
+                # relative to the snapshot, so the chain survives moving both files together
+                (
+                    Path(
+                        os.path.relpath(base.absolute(), output_file.absolute().parent)
+                    ).as_posix(),
+                ),
+            )
         conn.commit()
         console.print(
             f"[green]Snapshot database bootstrapped in [red]{output_file.absolute().as_posix()}[/red][/green]"
         )
-    _copy_collection_to_snapshot_db(persist_dir, collection, output_file, yes=yes)
+    try:
+        copied = _copy_collections_to_snapshot_db(
+            persist_dir,
+            None if all_collections else collections,
+            output_file,
+            yes=yes,
+            chunk_size=chunk_size,
+            workers=workers,
+            codec=codec,
+            level=level,
+            base=base,
+            online=online,
+            estimate=estimate,
+        )
+    except Exception as e:
+        # the snapshot database is written without a journal, a failed copy leaves it unusable
+        os.remove(output_file.absolute().as_posix())
+        raise e
+    if not copied:
+        return
+    start_time = time.perf_counter()
+    with get_sqlite_snapshot_connection(
+        output_file.absolute().as_posix(), mode=SqliteMode.READ_WRITE
+    ) as conn:
+        console.print("Building snapshot database indices...")
+        conn.execute(f"PRAGMA cache_size = -{DEFAULT_SNAPSHOT_CACHE_SIZE // 1024}")
+        conn.executescript(read_script("scripts/snapshot_indexes.sql"))
+        conn.commit()
+    console.print(
+        f"[green]Snapshot database indices built in {time.perf_counter() - start_time:.2f}s[/green]"
+    )
 
 
 def command(
     persist_dir: str = typer.Argument(..., help="The persist directory"),
-    collection: str = typer.Option(
-        ..., "--collection", "-c", help="The collection to snapshot"
+    collections: Optional[List[str]] = typer.Option(
+        None,
+        "--collection",
+        "-c",
+        help="A collection to snapshot. Can be repeated to snapshot several collections into one file.",
     ),
     output_file: Path = typer.Option(..., "--output", "-o", help="The output file"),
     yes: Optional[bool] = typer.Option(
         False, "--yes", "-y", help="Skip confirmation prompt"
     ),
+    chunk_size: int = typer.Option(
+        DEFAULT_SNAPSHOT_CHUNK_SIZE,
+        "--chunk-size",
+        help="Size in bytes of the chunks HNSW segment files are split into",
+    ),
+    workers: int = typer.Option(
+        1,
+        "--workers",
+        "-w",
+        help="Number of threads used to compress and hash HNSW segment data",
+    ),
+    codec: Codec = typer.Option(
+        Codec.ZLIB,
+        "--codec",
+        help="Compression codec for HNSW segment data. zstd and lz4 require the zstandard and lz4 packages.",
+    ),
+    level: Optional[int] = typer.Option(
+        None,
+        "--level",
+        help="Compression level for the selected codec. Defaults to the codec's default level.",
+    ),
+    base: Optional[Path] = typer.Option(
+        None,
+        "--base",
+        "-b",
+        help="A previous snapshot of the collection. Only changes since the base are copied, everything else is referenced.",
+    ),
+    online: Optional[bool] = typer.Option(
+        False,
+        "--online",
+        help="Only lock the database while pinning a consistent view of the collections instead of for the whole snapshot.",
+    ),
+    all_collections: Optional[bool] = typer.Option(
+        False, "--all", "-a", help="Snapshot all collections in the database"
+    ),
+    estimate: Optional[bool] = typer.Option(
+        False,
+        "--estimate",
+        help="Estimate metadata counts and project the snapshot size and time instead of counting rows before the copy.",
+    ),
 ) -> None:
-    collection_snapshot(persist_dir, collection, output_file, yes=yes)
+    collection_snapshot(
+        persist_dir,
+        collections,
+        output_file,
+        yes=yes,
+        chunk_size=chunk_size,
+        workers=workers,
+        codec=codec,
+        level=level,
+        base=base,
+        online=online,
+        all_collections=all_collections,
+        estimate=estimate,
+    )
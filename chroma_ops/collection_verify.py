@@ -0,0 +1,212 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import sqlite3
+import sys
+import time
+from typing import List
+
+import typer
+from rich.console import Console
+from rich.progress import BarColumn, Progress, SpinnerColumn, TextColumn
+from rich.table import Table
+
+from chroma_ops.collection_restore import (
+    MAX_SNAPSHOT_CHAIN_LENGTH,
+    hnsw_chunk_query,
+    hnsw_codecs_query,
+    hnsw_files_query,
+    stream_hnsw_file,
+)
+from chroma_ops.collection_snapshot import get_snapshot_chain, is_legacy_snapshot
+from chroma_ops.compression import Codec, validate_codec
+from chroma_ops.constants import DEFAULT_TENANT_ID, DEFAULT_TOPIC_NAMESPACE
+from chroma_ops.utils import sizeof_fmt
+
+MANIFEST_COLUMNS = [
+    "collection_id",
+    "collection_name",
+    "embeddings",
+    "embedding_metadata",
+    "embeddings_queue",
+    "hnsw_segment_files",
+    "hnsw_segment_bytes",
+]
+
+
+def _check_manifest(conn: sqlite3.Connection) -> List[str]:
+    """Compare the row counts recorded in the manifest with the rows stored in the snapshot."""
+    errors = []
+    rows = conn.execute(
+        """
+        SELECT
+            m.collection_name,
+            m.embeddings, COALESCE(e.n, 0),
+            m.embedding_metadata, COALESCE(em.n, 0),
+            m.embeddings_queue, COALESCE(q.n, 0),
+            m.hnsw_segment_files, COALESCE(f.n, 0),
+            m.hnsw_segment_bytes, COALESCE(f.size, 0)
+        FROM snapshot_manifest m
+        LEFT JOIN segments ms ON ms.collection = m.collection_id AND ms.scope = 'METADATA'
+        LEFT JOIN segments vs ON vs.collection = m.collection_id AND vs.scope = 'VECTOR'
+        LEFT JOIN (SELECT segment_id, COUNT(*) AS n FROM embeddings GROUP BY segment_id) e
+            ON e.segment_id = ms.id
+        LEFT JOIN (SELECT e.segment_id, COUNT(*) AS n FROM embedding_metadata m JOIN embeddings e ON m.id = e.id GROUP BY e.segment_id) em
+            ON em.segment_id = ms.id
+        LEFT JOIN (SELECT topic, COUNT(*) AS n FROM embeddings_queue GROUP BY topic) q
+            ON q.topic = 'persistent://' || ? || '/' || ? || '/' || m.collection_id
+        LEFT JOIN (SELECT segment_id, COUNT(*) AS n, SUM(size) AS size FROM hnsw_segment_files GROUP BY segment_id) f
+            ON f.segment_id = vs.id
+        """,
+        (DEFAULT_TENANT_ID, DEFAULT_TOPIC_NAMESPACE),
+    ).fetchall()
+    labels = [
+        "embeddings",
+        "embedding_metadata",
+        "embeddings_queue",
+        "hnsw_segment_files",
+        "hnsw_segment_bytes",
+    ]
+    for row in rows:
+        for i, label in enumerate(labels):
+            expected, actual = row[1 + i * 2], row[2 + i * 2]
+            if expected != actual:
+                errors.append(
+                    f"Manifest mismatch for collection {row[0]}: {label} is {expected:,} in the manifest, {actual:,} in the snapshot"
+                )
+    manifest_count = len(rows)
+    collections_count = conn.execute("SELECT COUNT(*) FROM collections").fetchone()[0]
+    if manifest_count != collections_count:
+        errors.append(
+            f"Manifest lists {manifest_count:,} collections, the snapshot has {collections_count:,}"
+        )
+    return errors
+
+
+def collection_verify(snapshot_file: Path, workers: int = 1) -> List[str]:
+    """Verify a snapshot without writing anything to disk.
+
+    Runs a SQLite integrity check, cross-checks the manifest and decompresses and hashes every
+    HNSW chunk (following references into base snapshots). Returns the problems found.
+    """
+    console = Console()
+    if workers <= 0:
+        raise ValueError("Number of workers must be a positive number")
+    if not snapshot_file.exists():
+        raise ValueError(
+            f"Snapshot file {snapshot_file.absolute().as_posix()} does not exist"
+        )
+    chain = get_snapshot_chain(snapshot_file.absolute().as_posix())
+    if len(chain) > MAX_SNAPSHOT_CHAIN_LENGTH:
+        raise ValueError(
+            f"Snapshot chain is {len(chain)} snapshots long, at most {MAX_SNAPSHOT_CHAIN_LENGTH} are supported"
+        )
+    errors: List[str] = []
+    start_time = time.perf_counter()
+    conn = sqlite3.connect(f"file:{chain[0]}?mode=ro", uri=True)
+    try:
+        # newest first, chunks stored as references are looked up in the bases
+        schemas = ["main"]
+        for i, snapshot in enumerate(chain[1:], start=1):
+            conn.execute(
+                f"ATTACH DATABASE ? AS base_{i}", (f"file:{snapshot}?mode=ro",)
+            )
+            schemas.append(f"base_{i}")
+        for (result,) in conn.execute("PRAGMA main.integrity_check").fetchall():
+            if result != "ok":
+                errors.append(f"Integrity check: {result}")
+        legacy = is_legacy_snapshot(conn)
+        manifest_columns = {
+            row[1]
+            for row in conn.execute(
+                "PRAGMA main.table_info(snapshot_manifest)"
+            ).fetchall()
+        }
+        has_manifest = len(manifest_columns) > 0
+        if has_manifest:
+            missing = [c for c in MANIFEST_COLUMNS if c not in manifest_columns]
+            if missing:
+                errors.append(f"Manifest is missing columns {', '.join(missing)}")
+            elif legacy:
+                errors.append("Manifest is present but hnsw_segment_files is missing")
+            else:
+                errors.extend(_check_manifest(conn))
+        codecs_query = hnsw_codecs_query(conn, schemas)
+        if codecs_query is not None:
+            for (codec,) in conn.execute(codecs_query).fetchall():
+                validate_codec(Codec(codec))
+        if not legacy:
+            for segment_id, filename in conn.execute(
+                "SELECT DISTINCT d.segment_id, d.filename FROM hnsw_segment_data d LEFT JOIN hnsw_segment_files f ON f.segment_id = d.segment_id AND f.filename = d.filename WHERE f.filename IS NULL"
+            ).fetchall():
+                errors.append(f"Chunks of {segment_id}/{filename} have no file entry")
+        files = conn.execute(hnsw_files_query(conn, "main")).fetchall()
+        chunk_queries = [hnsw_chunk_query(conn, schema) for schema in schemas]
+        verified = 0
+        with Progress(
+            SpinnerColumn(finished_text="[bold green]:heavy_check_mark:[/bold green]"),
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TextColumn("{task.percentage:>3.0f}%"),
+            transient=True,
+        ) as progress:
+            task = progress.add_task("Verifying hnsw_segment_data...", total=len(files))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for segment_id, filename, size, chunks, sha256 in files:
+                    file_size = 0
+                    try:
+                        for chunk in stream_hnsw_file(
+                            conn,
+                            chunk_queries,
+                            segment_id,
+                            filename,
+                            chunks,
+                            sha256,
+                            executor,
+                            max_in_flight=workers * 2,
+                        ):
+                            file_size += len(chunk)
+                        # legacy snapshots do not record the uncompressed size
+                        if size is not None and file_size != size:
+                            errors.append(
+                                f"Size mismatch for {segment_id}/{filename}, expected {size:,} got {file_size:,}"
+                            )
+                    except Exception as e:
+                        errors.append(f"{segment_id}/{filename}: {e}")
+                    verified += file_size
+                    progress.update(task, advance=1)
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start_time
+    table = Table(title="Snapshot verification")
+    table.add_column("Property", style="cyan")
+    table.add_column("Value", style="magenta")
+    table.add_row("Snapshot", snapshot_file.absolute().as_posix())
+    table.add_row("Snapshot Chain Length", str(len(chain)))
+    table.add_row("Manifest", "checked" if has_manifest else "not present")
+    table.add_row("HNSW Segment Data Files", f"{len(files):,}")
+    table.add_row("HNSW Segment Data Verified", sizeof_fmt(verified))
+    table.add_row("Elapsed", f"{elapsed:.2f}s")
+    table.add_row("Throughput", f"{sizeof_fmt(int(verified / max(elapsed, 1e-9)))}/s")
+    console.print(table)
+    if errors:
+        error_table = Table(title="Problems")
+        error_table.add_column("Problem", style="red")
+        for error in errors:
+            error_table.add_row(error)
+        console.print(error_table)
+    else:
+        console.print("[green]Snapshot verified, no problems found[/green]")
+    return errors
+
+
+def command(
+    snapshot_file: Path = typer.Argument(..., help="The snapshot file to verify"),
+    workers: int = typer.Option(
+        1,
+        "--workers",
+        "-w",
+        help="Number of threads used to decompress and hash HNSW segment data",
+    ),
+) -> None:
+    if collection_verify(snapshot_file, workers=workers):
+        sys.exit(1)
@@ -0,0 +1,89 @@
+from enum import Enum
+from typing import Optional
+import zlib
+
+
+class Codec(str, Enum):
+    NONE = "none"
+    ZLIB = "zlib"
+    ZSTD = "zstd"
+    LZ4 = "lz4"
+
+
+DEFAULT_CODEC_LEVELS = {
+    Codec.NONE: 0,
+    Codec.ZLIB: zlib.Z_DEFAULT_COMPRESSION,
+    Codec.ZSTD: 3,
+    Codec.LZ4: 0,
+}
+
+
+# (min, max) compression level per codec, zstd levels below 1 trade ratio for speed
+CODEC_LEVEL_RANGES = {
+    Codec.NONE: (0, 0),
+    Codec.ZLIB: (zlib.Z_DEFAULT_COMPRESSION, zlib.Z_BEST_COMPRESSION),
+    Codec.ZSTD: (-(1 << 17), 22),
+    Codec.LZ4: (0, 16),
+}
+
+
+def validate_codec(codec: Codec, level: Optional[int] = None) -> None:
+    """Ensure the optional dependency backing the codec is installed and the level is supported."""
+    if codec == Codec.ZSTD:
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise ValueError(
+                "The zstd codec requires the zstandard package. "
+                "Please install it with `pip install zstandard`"
+            )
+    elif codec == Codec.LZ4:
+        try:
+            import lz4.frame  # noqa: F401
+        except ImportError:
+            raise ValueError(
+                "The lz4 codec requires the lz4 package. "
+                "Please install it with `pip install lz4`"
+            )
+    if level is not None:
+        low, high = CODEC_LEVEL_RANGES[codec]
+        if not low <= level <= high:
+            raise ValueError(
+                f"Compression level {level} is not supported by the {codec.value} codec, use a level between {low} and {high}"
+            )
+
+
+def compress(data: bytes, codec: Codec, level: Optional[int] = None) -> bytes:
+    if level is None:
+        level = DEFAULT_CODEC_LEVELS[codec]
+    if codec == Codec.NONE:
+        return data
+    elif codec == Codec.ZLIB:
+        return zlib.compress(data, level)
+    elif codec == Codec.ZSTD:
+        import zstandard
+
+        # compressors are not thread safe, so we create one per call
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    elif codec == Codec.LZ4:
+        import lz4.frame
+
+        return lz4.frame.compress(data, compression_level=level)  # type: ignore
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def decompress(data: bytes, codec: Optional[Codec]) -> bytes:
+    # snapshots created before codecs were introduced are zlib compressed
+    if codec is None or codec == Codec.ZLIB:
+        return zlib.decompress(data)
+    elif codec == Codec.NONE:
+        return data
+    elif codec == Codec.ZSTD:
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec == Codec.LZ4:
+        import lz4.frame
+
+        return lz4.frame.decompress(data)  # type: ignore
+    raise ValueError(f"Unknown codec {codec}")
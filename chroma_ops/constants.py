@@ -14,3 +14,24 @@ DEFAULT_SYNC_THRESHOLD = 1000
 DEFAULT_NUM_THREADS = multiprocessing.cpu_count()
 DEFAULT_RESIZE_FACTOR = 1.2
 DEFAULT_TOKENIZER = "trigram"
+DEFAULT_SNAPSHOT_CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_SNAPSHOT_PAGE_SIZE = 16 * 1024
+DEFAULT_SNAPSHOT_CACHE_SIZE = 256 * 1024 * 1024
+# attempts at pinning segments that are not being persisted at the same time
+SNAPSHOT_PIN_RETRIES = 5
+DEFAULT_WAL_CLEAN_BATCH_SIZE = 10000
+DEFAULT_WAL_CLEAN_MAX_LOCK_MS = 100
+# backoff in seconds while a live database is busy
+DEFAULT_BUSY_BACKOFF = 0.01
+MAX_BUSY_BACKOFF = 2.0
+MAX_BUSY_RETRIES = 50
+DEFAULT_INCREMENTAL_VACUUM_PAGES = 1000
+# below this share of free pages vacuuming is not worth it
+VACUUM_MIN_RECLAIMABLE_RATIO = 0.05
+DEFAULT_WAL_EXPORT_BATCH_SIZE = 10000
+DEFAULT_WAL_EXPORT_BUFFER_SIZE = 8 * 1024 * 1024
+DEFAULT_WAL_APPLY_BATCH_SIZE = 10000
+DEFAULT_WAL_COMPACT_BATCH_SIZE = 10000
+# vectors added to a scratch index to measure the hnswlib add throughput
+DEFAULT_REPLAY_BENCHMARK_SIZE = 2000
+DEFAULT_WAL_ARCHIVE_BATCH_SIZE = 10000
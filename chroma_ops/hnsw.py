@@ -69,13 +69,20 @@ class HnswDetails(TypedDict):
     fragmentation_level_estimated: bool
 
 
-def _get_hnsw_details(
+def get_hnsw_details(
     conn: sqlite3.Connection,
     persist_dir: str,
     collection_name: str,
     database: Optional[str] = "default_database",
     verbose: Optional[bool] = False,
+    load_metadata: Optional[bool] = True,
 ) -> HnswDetails:
+    """Read the HNSW settings and state of a collection's vector segment.
+
+    Without `load_metadata` the index_metadata.pickle is not loaded, the ids, labels and
+    fragmentation are left empty and only the settings and whether the segment has been
+    persisted are reported.
+    """
     import chromadb
 
     collection_details = conn.execute(
@@ -171,10 +178,10 @@ def _get_hnsw_details(
     total_elements = 0
     max_elements = 0
     total_elements_added = 0
-    if os.path.exists(
+    has_metadata = os.path.exists(
         os.path.join(persist_dir, segment_id[0], "index_metadata.pickle")
-    ):
-        has_metadata = True
+    )
+    if has_metadata and load_metadata:
         persistent_data = PersistentData.load_from_file(
             os.path.join(persist_dir, segment_id[0], "index_metadata.pickle")
         )
@@ -216,8 +223,6 @@ def _get_hnsw_details(
                 fragmentation_level = 0.0
                 fragmentation_level_estimated = False
             index.close_file_handles()
-    else:
-        has_metadata = False
 
     return HnswDetails(
         id=collection_details[0],
@@ -532,7 +537,7 @@ def rebuild_hnsw(
         # lock the database to ensure no new data is added while we are rebuilding the index
         conn.execute("BEGIN EXCLUSIVE")
         try:
-            hnsw_details = _get_hnsw_details(
+            hnsw_details = get_hnsw_details(
                 conn, persist_dir, collection_name, database
             )
             (
@@ -652,7 +657,7 @@ def rebuild_hnsw(
                 shutil.copytree(temp_persist_dir, os.path.join(persist_dir, segment_id))
             conn.commit()
             print_hnsw_details(
-                _get_hnsw_details(
+                get_hnsw_details(
                     conn, persist_dir, collection_name, database, verbose=True
                 )
             )
@@ -674,7 +679,7 @@ def info_hnsw(
     print_chroma_version(console)
     with get_sqlite_connection(persist_dir, SqliteMode.READ_ONLY) as conn:
         try:
-            hnsw_details = _get_hnsw_details(
+            hnsw_details = get_hnsw_details(
                 conn, persist_dir, collection_name, database, verbose=verbose
             )
             print_hnsw_details(hnsw_details)
@@ -702,7 +707,7 @@ def modify_runtime_config(
     with get_sqlite_connection(persist_dir, SqliteMode.READ_WRITE) as conn:
         conn.execute("BEGIN EXCLUSIVE")
         try:
-            hnsw_details = _get_hnsw_details(
+            hnsw_details = get_hnsw_details(
                 conn, persist_dir, collection_name, database
             )
             (
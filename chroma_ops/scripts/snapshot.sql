@@ -1,3 +1,23 @@
+create table snapshot_metadata
+(
+    key   TEXT primary key,
+    value TEXT
+);
+
+-- one row per collection in the snapshot, counts are of the rows stored in this snapshot file
+create table snapshot_manifest
+(
+    collection_id      TEXT primary key,
+    collection_name    TEXT    not null,
+    database_name      TEXT    not null,
+    tenant_id          TEXT    not null,
+    embeddings         INTEGER not null,
+    embedding_metadata INTEGER not null,
+    embeddings_queue   INTEGER not null,
+    hnsw_segment_files INTEGER not null,
+    hnsw_segment_bytes INTEGER not null
+);
+
 create table embeddings_queue
 (
     seq_id     INTEGER primary key,
@@ -24,8 +44,7 @@ create table embeddings
     segment_id   TEXT                                not null,
     embedding_id TEXT                                not null,
     seq_id       BLOB                                not null,
-    created_at   TIMESTAMP default CURRENT_TIMESTAMP not null,
-    unique (segment_id, embedding_id)
+    created_at   TIMESTAMP default CURRENT_TIMESTAMP not null
 );
 
 create table embedding_metadata
@@ -40,19 +59,22 @@ create table embedding_metadata
     primary key (id, key)
 );
 
--- we don't necessarily need indices
-create index embedding_metadata_float_value
-    on embedding_metadata (key, float_value)
-    where float_value IS NOT NULL;
-
-create index embedding_metadata_int_value
-    on embedding_metadata (key, int_value)
-    where int_value IS NOT NULL;
+-- ids of all embeddings live at snapshot time, only populated in incremental snapshots
+-- segments are referenced by a small integer key so the UUID is not repeated for every id
+create table embedding_id_segments
+(
+    key        INTEGER primary key,
+    segment_id TEXT not null unique
+);
 
-create index embedding_metadata_string_value
-    on embedding_metadata (key, string_value)
-    where string_value IS NOT NULL;
+create table embedding_ids
+(
+    id          INTEGER primary key,
+    segment_key INTEGER not null
+        references embedding_id_segments (key)
+);
 
+-- indices are created by snapshot_indexes.sql once the data is copied
 
 create table segments
 (
@@ -104,13 +126,29 @@ create table collection_metadata
 );
 
 
+-- one row per fixed-size chunk of an HNSW segment file, sha256 is the hash of the uncompressed chunk
+-- chunks with NULL data are unchanged since, and stored in, the base snapshot
 create table hnsw_segment_data
 (
     id INTEGER primary key,
     segment_id TEXT not null,
     filename TEXT,
+    chunk INTEGER default 0 not null,
+    codec TEXT default 'zlib' not null,
     data BLOB,
     sha256 TEXT,
     created_at TIMESTAMP default CURRENT_TIMESTAMP not null,
-    unique (segment_id, filename)
+    unique (segment_id, filename, chunk)
+);
+
+-- one row per HNSW segment file, sha256 is the hash of the whole uncompressed file
+create table hnsw_segment_files
+(
+    segment_id TEXT not null,
+    filename   TEXT not null,
+    size       INTEGER not null,
+    chunks     INTEGER not null,
+    sha256     TEXT not null,
+    created_at TIMESTAMP default CURRENT_TIMESTAMP not null,
+    primary key (segment_id, filename)
 );
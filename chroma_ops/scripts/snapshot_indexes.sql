@@ -0,0 +1,18 @@
+-- run after the snapshot data is copied, building indices on populated tables is much faster
+-- than updating them on every insert
+create unique index embeddings_segment_id_embedding_id
+    on embeddings (segment_id, embedding_id);
+
+create index embedding_metadata_float_value
+    on embedding_metadata (key, float_value)
+    where float_value IS NOT NULL;
+
+create index embedding_metadata_int_value
+    on embedding_metadata (key, int_value)
+    where int_value IS NOT NULL;
+
+create index embedding_metadata_string_value
+    on embedding_metadata (key, string_value)
+    where string_value IS NOT NULL;
+
+analyze;
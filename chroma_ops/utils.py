@@ -4,13 +4,22 @@ import os
 import pickle
 import shutil
 import sqlite3
-from typing import List, cast, Optional, Dict, Union, Generator, Any
+import time
+from datetime import datetime
+from typing import List, cast, Optional, Dict, Tuple, Union, Generator, Any
 from rich.table import Table
 from rich.console import Console
 from chromadb import Collection
 import chromadb
 from chromadb import __version__ as chroma_version
 import hnswlib
+import numpy as np
+
+from chroma_ops.constants import (
+    DEFAULT_BUSY_BACKOFF,
+    MAX_BUSY_BACKOFF,
+    MAX_BUSY_RETRIES,
+)
 
 
 def validate_chroma_persist_dir(persist_dir: str) -> None:
@@ -85,6 +94,23 @@ def get_dir_size(path: str) -> int:
     return total_size
 
 
+# ioctl request to clone a file (reflink) on Linux copy-on-write filesystems (btrfs, xfs, ...)
+_FICLONE = 0x40049409
+
+
+def clone_file(src: str, dst: str) -> None:
+    """Copy a file as a copy-on-write clone when the filesystem supports it, otherwise do a regular copy."""
+    try:
+        import fcntl
+
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+
+
 def get_file_size(path: str) -> int:
     # ensure it is a file
     if not os.path.isfile(path):
@@ -144,6 +170,124 @@ def decode_seq_id(seq_id_bytes: Union[bytes, int]) -> SeqId:
         raise ValueError(f"Unknown SeqID type with length {len(seq_id_bytes)}")
 
 
+# vectors are stored as packed native (little-endian) arrays, see chromadb.db.base encode_vector
+VECTOR_DTYPES = {"FLOAT32": np.dtype("<f4"), "INT32": np.dtype("<i4")}
+
+
+def decode_vectors(vectors: List[bytes], encodings: List[str], dim: int) -> Any:
+    """Decode a batch of vector blobs into one contiguous float32 matrix."""
+    if all(encoding == "FLOAT32" for encoding in encodings):
+        return np.frombuffer(b"".join(vectors), dtype="<f4").reshape(-1, dim)
+    matrix = np.empty((len(vectors), dim), dtype=np.float32)
+    for i, (vector, encoding) in enumerate(zip(vectors, encodings)):
+        if encoding not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector encoding {encoding}")
+        matrix[i] = np.frombuffer(vector, dtype=VECTOR_DTYPES[encoding])
+    return matrix
+
+
+# Stored size in bytes of an embeddings_queue row aliased as q. LENGTH of a BLOB is read from
+# the record header without loading the value, text is cast to BLOB so it counts bytes, not
+# characters.
+WAL_ENTRY_BYTES = """
+    LENGTH(CAST(q.topic AS BLOB)) + LENGTH(CAST(q.id AS BLOB))
+    + COALESCE(LENGTH(q.vector), 0)
+    + COALESCE(LENGTH(CAST(q.metadata AS BLOB)), 0)
+    + COALESCE(LENGTH(CAST(q.created_at AS BLOB)), 0)
+"""
+
+
+def get_segment_max_seq_id(
+    conn: sqlite3.Connection, segment_id: str, metadata: Any = None
+) -> Tuple[int, bool]:
+    """The max seq id of a segment and whether it is kept in the pickle (Chroma < 0.5.7).
+
+    `metadata` is the segment's loaded index_metadata.pickle, if any.
+    """
+    if metadata is not None:
+        # Chroma < 1.0 pickles a PersistentData object, Chroma 1.x a dict
+        max_seq_id = (
+            metadata.get("max_seq_id")
+            if isinstance(metadata, dict)
+            else getattr(metadata, "max_seq_id", None)
+        )
+        if max_seq_id is not None:
+            return max_seq_id, True
+    row = conn.execute(
+        "SELECT seq_id FROM max_seq_id WHERE segment_id = ?", (segment_id,)
+    ).fetchone()
+    return (decode_seq_id(row[0]) if row else 0), False
+
+
+def run_write_chunk(
+    conn: sqlite3.Connection,
+    statement: str,
+    params: Tuple[Any, ...] = (),
+) -> Tuple[int, float, int]:
+    """Run a statement in its own short write transaction, backing off while the database is busy.
+
+    Returns the affected rows, the time the write lock was held and the number of busy retries.
+    """
+    busy_retries = 0
+    backoff = DEFAULT_BUSY_BACKOFF
+    while True:
+        try:
+            start = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = conn.execute(statement, params)
+                # some pragmas, e.g. incremental_vacuum, do their work one row at a time
+                cursor.fetchall()
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            return cursor.rowcount, time.perf_counter() - start, busy_retries
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise e
+            busy_retries += 1
+            if busy_retries > MAX_BUSY_RETRIES:
+                raise ValueError(
+                    f"Database stayed busy after {MAX_BUSY_RETRIES} retries, giving up"
+                )
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BUSY_BACKOFF)
+
+
+def format_timestamp(value: datetime) -> str:
+    # the format of CURRENT_TIMESTAMP, which fills embeddings_queue.created_at
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def find_seq_id_at(conn: sqlite3.Connection, timestamp: str) -> Optional[int]:
+    """Find the first seq id created at or after the timestamp.
+
+    created_at is assigned on insert, so it grows with seq_id and the boundary can be found with
+    a binary search over the seq_id primary key instead of a scan of the queue.
+    """
+    low, high = conn.execute(
+        "SELECT MIN(seq_id), MAX(seq_id) FROM embeddings_queue"
+    ).fetchone()
+    if low is None:
+        return None
+    found = None
+    while low <= high:
+        mid = (low + high) // 2
+        row = conn.execute(
+            "SELECT seq_id, created_at FROM embeddings_queue WHERE seq_id >= ? ORDER BY seq_id LIMIT 1",
+            (mid,),
+        ).fetchone()
+        if row is None or row[0] > high:
+            high = mid - 1
+        elif row[1] >= timestamp:
+            found = row[0]
+            high = mid - 1
+        else:
+            low = row[0] + 1
+    return found
+
+
 # https://stackoverflow.com/a/1094933
 def sizeof_fmt(num: int, suffix: str = "B") -> str:
     n: float = float(num)
@@ -4,15 +4,45 @@ from chroma_ops.wal_commit import command as commit_command
 from chroma_ops.wal_clean import command as clean_command
 from chroma_ops.wal_config import command as config_command
 from chroma_ops.wal_info import command as info_command
+from chroma_ops.wal_import import command as import_command
+from chroma_ops.wal_apply import command as apply_command
+from chroma_ops.wal_archive import command as archive_command
+from chroma_ops.wal_compact import command as compact_command
+from chroma_ops.wal_replay_estimate import command as replay_estimate_command
 
 wal_commands = typer.Typer(no_args_is_help=True)
 
 wal_commands.command(
     name="export", no_args_is_help=True, help="Exports the WAL to a jsonl file."
 )(export_command)
+wal_commands.command(
+    name="import",
+    no_args_is_help=True,
+    help="Imports an exported WAL into the embeddings queue.",
+)(import_command)
 wal_commands.command(
     name="commit", no_args_is_help=True, help="Commit WAL to HNSW lib binary index."
 )(commit_command)
+wal_commands.command(
+    name="apply",
+    no_args_is_help=True,
+    help="Apply pending WAL entries to the HNSW indices offline.",
+)(apply_command)
+wal_commands.command(
+    name="compact",
+    no_args_is_help=True,
+    help="Delete WAL entries superseded by later operations on the same id.",
+)(compact_command)
+wal_commands.command(
+    name="replay-estimate",
+    no_args_is_help=True,
+    help="Estimate how long Chroma will take to replay the WAL on startup.",
+)(replay_estimate_command)
+wal_commands.command(
+    name="archive",
+    no_args_is_help=True,
+    help="Move old WAL entries into compressed monthly archive files.",
+)(archive_command)
 wal_commands.command(
     name="clean", no_args_is_help=True, help="Cleans up WAL and VACUUM the SQLite DB."
 )(clean_command)
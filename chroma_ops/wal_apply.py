@@ -0,0 +1,518 @@
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, as_completed
+import datetime
+from enum import IntEnum
+import os
+import pickle
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TypedDict
+
+import chromadb
+import hnswlib
+import numpy as np
+from packaging import version
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from chroma_ops.constants import (
+    DEFAULT_NUM_THREADS,
+    DEFAULT_TENANT_ID,
+    DEFAULT_TOPIC_NAMESPACE,
+    DEFAULT_WAL_APPLY_BATCH_SIZE,
+)
+from chroma_ops.hnsw import get_hnsw_details
+from chroma_ops.utils import (
+    get_segment_max_seq_id,
+    PersistentData,
+    SqliteMode,
+    decode_vectors,
+    get_sqlite_connection,
+    print_chroma_version,
+    validate_chroma_persist_dir,
+)
+
+
+class WalOperation(IntEnum):
+    """Operation codes of embeddings_queue, see chromadb.db.mixins.embeddings_queue"""
+
+    ADD = 0
+    UPDATE = 1
+    UPSERT = 2
+    DELETE = 3
+
+
+def _get(metadata: Any, key: str) -> Any:
+    # Chroma < 1.0 pickles a PersistentData object, Chroma 1.x a dict
+    return metadata[key] if isinstance(metadata, dict) else getattr(metadata, key)
+
+
+def _set(metadata: Any, key: str, value: Any) -> None:
+    if isinstance(metadata, dict):
+        metadata[key] = value
+    else:
+        setattr(metadata, key, value)
+
+
+def _new_metadata(dimensionality: int) -> Any:
+    if version.parse(chromadb.__version__) >= version.parse("1.0.0"):
+        return {
+            "dimensionality": None,
+            "total_elements_added": 0,
+            "max_seq_id": None,
+            "id_to_label": {},
+            "label_to_id": {},
+            "id_to_seq_id": {},
+        }
+    # Chroma unpickles its own class, not the copy in chroma_ops.utils
+    from chromadb.segment.impl.vector.local_persistent_hnsw import (
+        PersistentData as ChromaPersistentData,
+    )
+
+    persistent_data: Any = ChromaPersistentData
+    return persistent_data(dimensionality, 0, 0, {}, {}, {})
+
+
+class _SegmentTask(TypedDict):
+    """The work for one segment, only scalars so it is cheap to send to a worker process."""
+
+    name: str
+    segment_id: str
+    path: str
+    has_metadata: bool
+    space: str
+    dimensions: int
+    construction_ef: int
+    search_ef: int
+    m: int
+    resize_factor: float
+    max_seq_id: int
+    in_pickle: bool
+    topic: str
+
+
+class _SegmentApplier:
+    """Applies WAL operations to an HNSW segment, mirroring the bookkeeping of Chroma.
+
+    Labels are assigned in order of addition, deletes mark the label deleted. Vectors are
+    staged per batch and added with one multithreaded `add_items` call.
+    """
+
+    def __init__(
+        self,
+        details: _SegmentTask,
+        metadata: Any,
+        num_threads: int,
+        tracks_seq_ids: bool,
+    ) -> None:
+        self.details = details
+        self.metadata = metadata
+        self.num_threads = num_threads
+        self.tracks_seq_ids = tracks_seq_ids
+        self.id_to_label: Dict[str, int] = _get(metadata, "id_to_label")
+        self.label_to_id: Dict[int, str] = _get(metadata, "label_to_id")
+        self.id_to_seq_id: Dict[str, int] = _get(metadata, "id_to_seq_id")
+        self.total_elements_added: int = _get(metadata, "total_elements_added")
+        self.index: Optional[hnswlib.Index] = None
+        self.counts = {operation: 0 for operation in WalOperation}
+
+    def _open_index(self, dimensions: int) -> hnswlib.Index:
+        index = hnswlib.Index(space=self.details["space"], dim=dimensions)
+        path = self.details["path"]
+        if self.details["has_metadata"]:
+            index.load_index(
+                path,
+                is_persistent_index=True,
+                max_elements=max(self.total_elements_added, 1),
+            )
+        else:
+            os.makedirs(path, exist_ok=True)
+            index.init_index(
+                max_elements=DEFAULT_WAL_APPLY_BATCH_SIZE,
+                ef_construction=self.details["construction_ef"],
+                M=self.details["m"],
+                is_persistent_index=True,
+                persistence_location=path,
+            )
+        index.set_num_threads(self.num_threads)
+        index.set_ef(self.details["search_ef"])
+        return index
+
+    def apply_batch(
+        self, rows: List[Tuple[int, int, str, Optional[bytes], Optional[str]]]
+    ) -> None:
+        dimensions = self.details["dimensions"]
+        pending: Dict[int, Tuple[bytes, str]] = {}
+        added_in_batch = set()
+        deleted: List[int] = []
+        for seq_id, operation, _id, vector, encoding in rows:
+            exists = _id in self.id_to_label
+            if operation == WalOperation.DELETE:
+                if not exists:
+                    continue
+                label = self.id_to_label.pop(_id)
+                del self.label_to_id[label]
+                self.id_to_seq_id.pop(_id, None)
+                pending.pop(label, None)
+                if label not in added_in_batch:
+                    deleted.append(label)
+            elif operation == WalOperation.ADD or (
+                operation == WalOperation.UPSERT and not exists
+            ):
+                if exists or vector is None:
+                    continue
+                self.total_elements_added += 1
+                label = self.total_elements_added
+                self.id_to_label[_id] = label
+                self.label_to_id[label] = _id
+                added_in_batch.add(label)
+                pending[label] = (vector, encoding or "FLOAT32")
+            elif operation in (WalOperation.UPDATE, WalOperation.UPSERT):
+                # updates of missing ids are ignored, metadata only updates carry no vector
+                if not exists or vector is None:
+                    continue
+                pending[self.id_to_label[_id]] = (vector, encoding or "FLOAT32")
+            else:
+                raise ValueError(f"Unknown operation {operation} at seq id {seq_id}")
+            if self.tracks_seq_ids and operation != WalOperation.DELETE:
+                self.id_to_seq_id[_id] = seq_id
+            self.counts[WalOperation(operation)] += 1
+        if not pending and not deleted:
+            return
+        if pending:
+            vectors = [vector for vector, _ in pending.values()]
+            if not dimensions:
+                dimensions = len(vectors[0]) // 4
+                self.details["dimensions"] = dimensions
+            for label, (vector, _) in pending.items():
+                if len(vector) != dimensions * 4:
+                    raise ValueError(
+                        f"Vector of {self.label_to_id.get(label)} has {len(vector) // 4} dimensions, the collection has {dimensions}"
+                    )
+        if self.index is None:
+            self.index = self._open_index(dimensions)
+        if pending:
+            labels = np.fromiter(pending.keys(), dtype=np.uint64, count=len(pending))
+            needed = self.index.get_current_count() + len(
+                added_in_batch.intersection(pending)
+            )
+            if needed > self.index.get_max_elements():
+                self.index.resize_index(
+                    max(needed, int(needed * self.details["resize_factor"]))
+                )
+            self.index.add_items(
+                decode_vectors(
+                    vectors, [encoding for _, encoding in pending.values()], dimensions
+                ),
+                labels,
+                num_threads=self.num_threads,
+            )
+        for label in deleted:
+            self.index.mark_deleted(label)
+
+    def close(self, persist: bool) -> None:
+        """Release the index, writing the applied batches to disk only with `persist`."""
+        if persist:
+            _set(self.metadata, "total_elements_added", self.total_elements_added)
+        if self.index is not None:
+            index, self.index = self.index, None
+            if persist:
+                index.persist_dirty()
+            index.close_file_handles()
+
+
+class _InProcessExecutor(Executor):
+    """Runs the work in the calling process, used when applying one segment at a time."""
+
+    def submit(self, fn: Any, /, *args: Any, **kwargs: Any) -> "Future[Any]":
+        future: "Future[Any]" = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def _apply_segment(
+    persist_dir: str,
+    details: _SegmentTask,
+    batch_size: int,
+    num_threads: int,
+    backup: Optional[bool],
+) -> Tuple[int, int, Dict[str, int], float]:
+    """Apply the pending WAL of one segment, in a worker process when run in parallel.
+
+    Reads the WAL on its own read-only connection. The index and its metadata are only persisted
+    once every entry has been applied, on a failure the segment is restored from the backup, or
+    removed if the apply created it. Returns the entries applied, the new max seq id, which the
+    caller records unless it is kept in the pickle, the operation counts and the elapsed time.
+    """
+    start = time.perf_counter()
+    max_seq_id = details["max_seq_id"]
+    path = details["path"]
+    metadata_file = os.path.join(path, "index_metadata.pickle")
+    created = not os.path.exists(path)
+    backup_path = None
+    if details["has_metadata"]:
+        metadata = PersistentData.load_from_file(metadata_file)
+        if backup:
+            backup_path = os.path.join(
+                persist_dir,
+                f"{details['segment_id']}_backup_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}",
+            )
+            shutil.copytree(path, backup_path)
+    else:
+        metadata = _new_metadata(details["dimensions"])
+    applier = _SegmentApplier(
+        details,
+        metadata,
+        num_threads,
+        tracks_seq_ids=version.parse(chromadb.__version__) < version.parse("1.0.0"),
+    )
+    entries = 0
+    try:
+        with get_sqlite_connection(persist_dir, SqliteMode.READ_ONLY) as conn:
+            cursor = conn.execute(
+                "SELECT seq_id, operation, id, vector, encoding FROM embeddings_queue WHERE topic = ? AND seq_id > ? ORDER BY seq_id",
+                (details["topic"], max_seq_id),
+            )
+            while rows := cursor.fetchmany(batch_size):
+                applier.apply_batch(rows)
+                max_seq_id = rows[-1][0]
+                entries += len(rows)
+        applier.close(persist=True)
+        if details["in_pickle"]:
+            _set(metadata, "max_seq_id", max_seq_id)
+        if _get(metadata, "dimensionality") is None and not isinstance(metadata, dict):
+            _set(metadata, "dimensionality", details["dimensions"])
+        with open(metadata_file, "wb") as f:
+            pickle.dump(metadata, f, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        # a half applied index must not be left behind, Chroma would skip the rest of the WAL
+        applier.close(persist=False)
+        if backup_path is not None:
+            shutil.rmtree(path)
+            shutil.copytree(backup_path, path)
+        elif created:
+            shutil.rmtree(path, ignore_errors=True)
+        raise
+    counts = {
+        operation.name.lower(): count
+        for operation, count in applier.counts.items()
+        if count
+    }
+    return entries, max_seq_id, counts, time.perf_counter() - start
+
+
+def apply_wal(
+    persist_dir: str,
+    *,
+    collections: Optional[Sequence[str]] = None,
+    tenant: Optional[str] = DEFAULT_TENANT_ID,
+    topic_namespace: Optional[str] = DEFAULT_TOPIC_NAMESPACE,
+    batch_size: int = DEFAULT_WAL_APPLY_BATCH_SIZE,
+    num_threads: int = DEFAULT_NUM_THREADS,
+    backup: Optional[bool] = True,
+    yes: Optional[bool] = False,
+    parallel: int = 1,
+) -> Dict[str, int]:
+    """Apply the pending WAL entries to the HNSW segments, without starting Chroma.
+
+    Reads the entries above each vector segment's max seq id in batches, applies adds, updates,
+    upserts and deletes with hnswlib, then persists the index, the index metadata and the new max
+    seq id. With `parallel` segments are applied in that many worker processes, largest first,
+    splitting `num_threads` between them. Returns the number of entries applied per collection.
+    """
+    if parallel <= 0:
+        raise ValueError("Number of parallel workers must be a positive number")
+    if batch_size <= 0:
+        raise ValueError("Batch size must be a positive number")
+    if num_threads <= 0:
+        raise ValueError("Number of threads must be a positive number")
+    validate_chroma_persist_dir(persist_dir)
+    console = Console()
+    print_chroma_version(console)
+    applied: Dict[str, int] = {}
+    with get_sqlite_connection(persist_dir, SqliteMode.READ_WRITE) as conn:
+        names = [
+            row[0] for row in conn.execute("SELECT name FROM collections ORDER BY name")
+        ]
+        if collections:
+            missing = [name for name in collections if name not in names]
+            if missing:
+                raise ValueError(f"Collections {', '.join(missing)} do not exist")
+            names = list(collections)
+        # keep writers out while the segments are updated
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            plan = []
+            table = Table(title="WAL Apply")
+            table.add_column("Collection", style="cyan")
+            table.add_column("Segment Max Seq ID", style="magenta")
+            table.add_column("Pending WAL Entries", style="magenta")
+            # Chroma < 0.5.7 keeps the max seq id in the pickle, later versions in max_seq_id
+            seq_ids_in_pickle = version.parse(chromadb.__version__) < version.parse(
+                "0.5.7"
+            )
+            for name in names:
+                # the labels are not needed here, the worker loads the pickle
+                details = get_hnsw_details(conn, persist_dir, name, load_metadata=False)
+                max_seq_id, in_pickle = get_segment_max_seq_id(
+                    conn,
+                    details["segment_id"],
+                    (
+                        PersistentData.load_from_file(
+                            os.path.join(details["path"], "index_metadata.pickle")
+                        )
+                        if details["has_metadata"] and seq_ids_in_pickle
+                        else None
+                    ),
+                )
+                if not details["has_metadata"]:
+                    in_pickle = seq_ids_in_pickle
+                topic = f"persistent://{tenant}/{topic_namespace}/{details['collection_id']}"
+                pending = conn.execute(
+                    "SELECT COUNT(*) FROM embeddings_queue WHERE topic = ? AND seq_id > ?",
+                    (topic, max_seq_id),
+                ).fetchone()[0]
+                table.add_row(name, str(max_seq_id), f"{pending:,}")
+                if pending > 0:
+                    task: _SegmentTask = {
+                        "name": name,
+                        "segment_id": details["segment_id"],
+                        "path": details["path"],
+                        "has_metadata": details["has_metadata"],
+                        "space": details["space"],
+                        "dimensions": details["dimensions"],
+                        "construction_ef": details["construction_ef"],
+                        "search_ef": details["search_ef"],
+                        "m": details["m"],
+                        "resize_factor": details["resize_factor"],
+                        "max_seq_id": max_seq_id,
+                        "in_pickle": in_pickle,
+                        "topic": topic,
+                    }
+                    plan.append((pending, task))
+            console.print(table)
+            if not plan:
+                console.print("[green]No pending WAL entries, nothing to apply[/green]")
+                conn.rollback()
+                return applied
+            if not yes:
+                if not typer.confirm(
+                    f"\nAre you sure you want to apply the WAL to the HNSW segments in {persist_dir}? Stop Chroma before applying.",
+                    default=False,
+                    show_default=True,
+                ):
+                    console.print("[yellow]WAL apply cancelled by user[/yellow]")
+                    conn.rollback()
+                    return applied
+            # longest first, so the largest segments do not start last and stretch the run
+            plan.sort(key=lambda item: item[0], reverse=True)
+            workers = min(parallel, len(plan))
+            threads = max(num_threads // workers, 1)
+            report = Table(title="WAL Apply Report")
+            report.add_column("Collection", style="cyan")
+            report.add_column("Entries", style="magenta")
+            report.add_column("Operations", style="magenta")
+            report.add_column("Threads", style="magenta")
+            report.add_column("Elapsed", style="green")
+            report.add_column("Entries/s", style="green")
+            errors: List[Tuple[str, BaseException]] = []
+            start = time.perf_counter()
+            with ProcessPoolExecutor(
+                max_workers=workers
+            ) if workers > 1 else _InProcessExecutor() as executor:
+                futures = {
+                    executor.submit(
+                        _apply_segment,
+                        persist_dir,
+                        task,
+                        batch_size,
+                        threads,
+                        backup,
+                    ): task
+                    for _, task in plan
+                }
+                for future in as_completed(futures):
+                    task = futures[future]
+                    name = task["name"]
+                    try:
+                        entries, max_seq_id, counts, elapsed = future.result()
+                    except Exception as e:
+                        console.print(
+                            f"[red]Failed to apply the WAL to {name}: {e}[/red]"
+                        )
+                        errors.append((name, e))
+                        continue
+                    if not task["in_pickle"]:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO max_seq_id (segment_id, seq_id) VALUES (?, ?)",
+                            (task["segment_id"], max_seq_id),
+                        )
+                    applied[name] = entries
+                    report.add_row(
+                        name,
+                        f"{entries:,}",
+                        ", ".join(f"{count:,} {op}" for op, count in counts.items())
+                        or "no changes",
+                        str(threads),
+                        f"{elapsed:.2f}s",
+                        f"{entries / max(elapsed, 1e-9):,.0f}",
+                    )
+            # segments that were applied keep their progress even if another one failed
+            conn.commit()
+            console.print(report)
+            console.print(
+                f"[green]Applied {sum(applied.values()):,} WAL entries to {len(applied)} collections in {time.perf_counter() - start:.2f}s "
+                f"with {workers} workers of {threads} threads[/green]"
+            )
+            if errors:
+                raise errors[0][1]
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
+
+
+def command(
+    persist_dir: str = typer.Argument(..., help="The persist directory"),
+    collections: Optional[List[str]] = typer.Option(
+        None,
+        "--collection",
+        "-c",
+        help="Apply the WAL of this collection only, can be repeated",
+    ),
+    batch_size: int = typer.Option(
+        DEFAULT_WAL_APPLY_BATCH_SIZE,
+        "--batch-size",
+        help="Number of WAL entries read and applied at a time",
+    ),
+    num_threads: int = typer.Option(
+        DEFAULT_NUM_THREADS,
+        "--threads",
+        "-t",
+        help="Number of threads hnswlib uses to add vectors",
+    ),
+    backup: Optional[bool] = typer.Option(
+        True,
+        "--backup/--no-backup",
+        help="Copy each HNSW segment aside before applying the WAL to it",
+    ),
+    parallel: int = typer.Option(
+        1,
+        "--parallel",
+        "-p",
+        help="Number of collections applied in parallel worker processes, the threads are split between them",
+    ),
+    yes: Optional[bool] = typer.Option(False, "--yes", "-y", help="Skip confirmation"),
+) -> None:
+    apply_wal(
+        persist_dir,
+        collections=collections,
+        batch_size=batch_size,
+        num_threads=num_threads,
+        backup=backup,
+        yes=yes,
+        parallel=parallel,
+    )
@@ -0,0 +1,335 @@
+from datetime import datetime, timedelta, timezone
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from chroma_ops.compression import Codec, compress, validate_codec
+from chroma_ops.constants import (
+    DEFAULT_TENANT_ID,
+    DEFAULT_TOPIC_NAMESPACE,
+    DEFAULT_WAL_ARCHIVE_BATCH_SIZE,
+)
+from chroma_ops.utils import (
+    find_seq_id_at,
+    format_timestamp,
+    get_segment_max_seq_id,
+    run_write_chunk,
+    PersistentData,
+    SqliteMode,
+    decode_seq_id,
+    get_sqlite_connection,
+    print_chroma_version,
+    sizeof_fmt,
+    validate_chroma_persist_dir,
+)
+
+# the live schema plus the codec of the vector blob
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive.embeddings_queue (
+    seq_id INTEGER PRIMARY KEY,
+    created_at TIMESTAMP NOT NULL,
+    operation INTEGER NOT NULL,
+    topic TEXT NOT NULL,
+    id TEXT NOT NULL,
+    vector BLOB,
+    encoding TEXT,
+    metadata TEXT,
+    codec TEXT NOT NULL
+)
+"""
+
+# ?1 and ?2 bound the seq ids (exclusive), each topic is archived below the max seq id both of its
+# segments have consumed
+CANDIDATES = """
+FROM embeddings_queue q
+JOIN temp.wal_archive_topics t ON t.topic = q.topic
+WHERE q.seq_id > ?1 AND q.seq_id < ?2 AND q.seq_id < t.max_seq_id
+"""
+
+
+def get_archive_file(archive_dir: str, month: str) -> str:
+    return os.path.join(archive_dir, f"wal-{month}.sqlite3")
+
+
+def _plan_months(conn: sqlite3.Connection, upper: int) -> List[Tuple[str, int, int]]:
+    """Split the seq ids below `upper` by calendar month of created_at.
+
+    Returns (month, first seq id, end seq id) per month, created_at grows with seq_id so the
+    month boundaries are found with a binary search.
+    """
+    months = []
+    row = conn.execute(
+        "SELECT seq_id, created_at FROM embeddings_queue WHERE seq_id < ? ORDER BY seq_id LIMIT 1",
+        (upper,),
+    ).fetchone()
+    while row is not None:
+        first, created_at = row
+        month = str(created_at)[:7]
+        year, number = (int(part) for part in month.split("-"))
+        end = find_seq_id_at(
+            conn, f"{year + number // 12:04d}-{number % 12 + 1:02d}-01 00:00:00"
+        )
+        end = upper if end is None else min(end, upper)
+        months.append((month, first, end))
+        row = conn.execute(
+            "SELECT seq_id, created_at FROM embeddings_queue WHERE seq_id >= ? AND seq_id < ? ORDER BY seq_id LIMIT 1",
+            (end, upper),
+        ).fetchone()
+    return months
+
+
+def _archive_month(
+    conn: sqlite3.Connection,
+    archive_file: str,
+    first: int,
+    end: int,
+    codec: Codec,
+    batch_size: int,
+) -> Tuple[int, int]:
+    """Move the candidate WAL entries of one month into its archive file in batches.
+
+    Every batch is copied into the archive in one transaction and then deleted from the live
+    queue in another, by the seq ids found in the archive. A batch interrupted in between is
+    copied again with INSERT OR IGNORE and deleted on the next run. Returns the entries moved
+    and the archived vector bytes.
+    """
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_file,))
+    try:
+        conn.execute(ARCHIVE_SCHEMA)
+        conn.commit()
+        moved = 0
+        last = first - 1
+        while True:
+            upper = conn.execute(
+                f"SELECT MAX(seq_id) FROM (SELECT q.seq_id {CANDIDATES} ORDER BY q.seq_id LIMIT ?3)",
+                (last, end, batch_size),
+            ).fetchone()[0]
+            if upper is None:
+                break
+            run_write_chunk(
+                conn,
+                f"INSERT OR IGNORE INTO archive.embeddings_queue SELECT q.seq_id, q.created_at, q.operation, q.topic, q.id, wal_archive_compress(q.vector), q.encoding, q.metadata, ?3 {CANDIDATES}",
+                (last, upper + 1, codec.value),
+            )
+            moved += run_write_chunk(
+                conn,
+                "DELETE FROM main.embeddings_queue WHERE seq_id IN (SELECT seq_id FROM archive.embeddings_queue WHERE seq_id > ? AND seq_id <= ?)",
+                (last, upper),
+            )[0]
+            last = upper
+        archived_bytes = conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM archive.embeddings_queue WHERE seq_id >= ? AND seq_id < ?",
+            (first, end),
+        ).fetchone()[0]
+    finally:
+        conn.execute("DETACH DATABASE archive")
+    return moved, archived_bytes
+
+
+def archive_wal(
+    persist_dir: str,
+    archive_dir: str,
+    *,
+    older_than_days: Optional[int] = None,
+    collections: Optional[Sequence[str]] = None,
+    tenant: Optional[str] = DEFAULT_TENANT_ID,
+    topic_namespace: Optional[str] = DEFAULT_TOPIC_NAMESPACE,
+    codec: Codec = Codec.ZLIB,
+    level: Optional[int] = None,
+    batch_size: int = DEFAULT_WAL_ARCHIVE_BATCH_SIZE,
+    yes: Optional[bool] = False,
+    dry_run: Optional[bool] = False,
+) -> Dict[str, int]:
+    """Move old WAL entries out of the live queue into one archive SQLite file per month.
+
+    Entries below the max seq id of both segments of their collection, and with
+    `older_than_days` only those created more than that many days ago, are copied in bulk into
+    `archive_dir/wal-<YYYY-MM>.sqlite3` with compressed vectors, then deleted from the live queue
+    in batches of short transactions. The newest entry of the queue is never archived, seq_id has
+    no AUTOINCREMENT and SQLite would hand its seq id out again to a write the segments then skip.
+    Returns the entries archived per month, or that would be archived with `dry_run`.
+    """
+    if older_than_days is not None and older_than_days < 0:
+        raise ValueError("Age must be a positive number of days")
+    if batch_size <= 0:
+        raise ValueError("Batch size must be a positive number")
+    validate_codec(codec, level)
+    validate_chroma_persist_dir(persist_dir)
+    console = Console()
+    print_chroma_version(console)
+    archived: Dict[str, int] = {}
+    with get_sqlite_connection(
+        persist_dir, SqliteMode.READ_ONLY if dry_run else SqliteMode.READ_WRITE
+    ) as conn:
+        segments = conn.execute(
+            "SELECT s.id, c.id, c.name FROM segments s JOIN collections c ON s.collection = c.id WHERE s.scope = 'VECTOR' ORDER BY c.name"
+        ).fetchall()
+        if collections:
+            names = {name for _, _, name in segments}
+            missing = [name for name in collections if name not in names]
+            if missing:
+                raise ValueError(f"Collections {', '.join(missing)} do not exist")
+            segments = [row for row in segments if row[2] in collections]
+        topics = []
+        for segment_id, collection_id, _ in segments:
+            metadata_file = os.path.join(
+                persist_dir, segment_id, "index_metadata.pickle"
+            )
+            vector_max_seq_id, _ = get_segment_max_seq_id(
+                conn,
+                segment_id,
+                (
+                    PersistentData.load_from_file(metadata_file)
+                    if os.path.exists(metadata_file)
+                    else None
+                ),
+            )
+            # the metadata segment must have consumed the entries as well
+            row = conn.execute(
+                "SELECT m.seq_id FROM segments s JOIN max_seq_id m ON m.segment_id = s.id WHERE s.collection = ? AND s.scope = 'METADATA'",
+                (collection_id,),
+            ).fetchone()
+            max_seq_id = min(vector_max_seq_id, decode_seq_id(row[0]) if row else 0)
+            topics.append(
+                (f"persistent://{tenant}/{topic_namespace}/{collection_id}", max_seq_id)
+            )
+        conn.execute(
+            "CREATE TEMP TABLE wal_archive_topics (topic TEXT PRIMARY KEY, max_seq_id INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO temp.wal_archive_topics (topic, max_seq_id) VALUES (?, ?)",
+            topics,
+        )
+        # only the temp table has been written to, this does not touch the database
+        conn.commit()
+        newest = conn.execute("SELECT MAX(seq_id) FROM embeddings_queue").fetchone()[0]
+        upper = newest if newest is not None else 0
+        if older_than_days is not None:
+            cutoff = find_seq_id_at(
+                conn,
+                format_timestamp(
+                    datetime.now(timezone.utc) - timedelta(days=older_than_days)
+                ),
+            )
+            upper = min(cutoff, upper) if cutoff is not None else upper
+        plan = []
+        table = Table(title="WAL Archive Dry Run" if dry_run else "WAL Archive")
+        table.add_column("Month", style="cyan")
+        table.add_column("Archive", style="cyan")
+        table.add_column("Entries", style="magenta")
+        table.add_column("Vector Bytes", style="magenta")
+        for month, first, end in _plan_months(conn, upper):
+            entries, size = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(LENGTH(q.vector)), 0) {CANDIDATES}",
+                (first - 1, end),
+            ).fetchone()
+            if entries:
+                plan.append((month, first, end, entries, size))
+                archived[month] = entries
+        if dry_run or not plan:
+            for month, _, _, entries, size in plan:
+                table.add_row(
+                    month,
+                    get_archive_file(archive_dir, month),
+                    f"{entries:,}",
+                    sizeof_fmt(size),
+                )
+            console.print(table)
+            if not plan:
+                console.print("[green]No WAL entries to archive[/green]")
+            return archived
+        if not yes:
+            if not typer.confirm(
+                f"\nAre you sure you want to move {sum(archived.values()):,} WAL entries from {persist_dir} to {archive_dir}?",
+                default=False,
+                show_default=True,
+            ):
+                console.print("[yellow]WAL archive cancelled by user[/yellow]")
+                return {}
+        os.makedirs(archive_dir, exist_ok=True)
+        table.add_column("Archived Vector Bytes", style="green")
+        conn.create_function(
+            "wal_archive_compress",
+            1,
+            lambda data: compress(data, codec, level) if data is not None else None,
+            deterministic=True,
+        )
+        # fail fast on a locked database and back off instead of waiting in SQLite
+        conn.execute("PRAGMA busy_timeout = 0")
+        start = time.perf_counter()
+        for month, first, end, _, size in plan:
+            archive_file = get_archive_file(archive_dir, month)
+            moved, archived_bytes = _archive_month(
+                conn, archive_file, first, end, codec, batch_size
+            )
+            archived[month] = moved
+            table.add_row(
+                month,
+                archive_file,
+                f"{moved:,}",
+                sizeof_fmt(size),
+                sizeof_fmt(archived_bytes),
+            )
+        elapsed = time.perf_counter() - start
+    console.print(table)
+    console.print(
+        f"[green]Archived {sum(archived.values()):,} WAL entries in {elapsed:.2f}s. "
+        f"Run `chops wal clean` with --vacuum to return the space to the filesystem[/green]"
+    )
+    return archived
+
+
+def command(
+    persist_dir: str = typer.Argument(..., help="The persist directory"),
+    archive_dir: str = typer.Argument(
+        ..., help="The directory of the monthly archive files"
+    ),
+    older_than_days: Optional[int] = typer.Option(
+        None,
+        "--older-than",
+        help="Archive only the applied WAL entries created more than this many days ago",
+    ),
+    collections: Optional[List[str]] = typer.Option(
+        None,
+        "--collection",
+        "-c",
+        help="Archive the WAL of this collection only, can be repeated",
+    ),
+    codec: Codec = typer.Option(
+        Codec.ZLIB,
+        "--codec",
+        help="Compression codec for the vectors. zstd and lz4 require the zstandard and lz4 packages.",
+    ),
+    level: Optional[int] = typer.Option(
+        None,
+        "--level",
+        help="Compression level for the selected codec. Defaults to the codec's default level.",
+    ),
+    batch_size: int = typer.Option(
+        DEFAULT_WAL_ARCHIVE_BATCH_SIZE,
+        "--batch-size",
+        help="Number of WAL entries moved per transaction",
+    ),
+    dry_run: Optional[bool] = typer.Option(
+        False,
+        "--dry-run",
+        help="Report the WAL entries that would be archived without moving them",
+    ),
+    yes: Optional[bool] = typer.Option(False, "--yes", "-y", help="Skip confirmation"),
+) -> None:
+    archive_wal(
+        persist_dir,
+        archive_dir,
+        older_than_days=older_than_days,
+        collections=collections,
+        codec=codec,
+        level=level,
+        batch_size=batch_size,
+        yes=yes,
+        dry_run=dry_run,
+    )
@@ -1,35 +1,357 @@
 #!/usr/bin/env python3
+from enum import Enum
 import os
-from typing import Optional, Sequence
+import shutil
+import sqlite3
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
 import typer
 from chromadb import __version__ as chroma_version
 from chroma_ops.utils import (
+    run_write_chunk,
     SqliteMode,
     get_sqlite_connection,
     print_chroma_version,
     validate_chroma_persist_dir,
-    get_hnsw_index_ids,
-    get_dir_size,
+    get_file_size,
+    get_segment_max_seq_id,
     PersistentData,
-    decode_seq_id,
+    get_disk_free_space,
+    sizeof_fmt,
+    WAL_ENTRY_BYTES,
+)
+from chroma_ops.constants import (
+    DEFAULT_CHROMA_SQLITE_FILE,
+    DEFAULT_INCREMENTAL_VACUUM_PAGES,
+    DEFAULT_TENANT_ID,
+    DEFAULT_TOPIC_NAMESPACE,
+    DEFAULT_WAL_CLEAN_BATCH_SIZE,
+    DEFAULT_WAL_CLEAN_MAX_LOCK_MS,
+    VACUUM_MIN_RECLAIMABLE_RATIO,
 )
-from chroma_ops.constants import DEFAULT_TENANT_ID, DEFAULT_TOPIC_NAMESPACE
 from rich.console import Console
+from rich.table import Table
 from packaging import version
 
 
+class VacuumMode(str, Enum):
+    FULL = "full"
+    NONE = "none"
+    INCREMENTAL = "incremental"
+    INTO = "into"
+
+
+def parse_vacuum_mode(value: str) -> Tuple[VacuumMode, Optional[str]]:
+    """Parse `full`, `none`, `incremental` or `into=<path>` into the mode and the target path."""
+    if value.startswith(f"{VacuumMode.INTO.value}="):
+        target = value[len(VacuumMode.INTO.value) + 1 :]
+        if not target:
+            raise ValueError("A target path is required, e.g. into=/other/volume")
+        return VacuumMode.INTO, target
+    try:
+        return VacuumMode(value), None
+    except ValueError:
+        raise ValueError(
+            f"Unknown vacuum mode {value}, expected full, none, incremental or into=<path>"
+        )
+
+
+def _stage_max_seq_ids(
+    conn: sqlite3.Connection, max_seq_ids: List[Tuple[int, str]]
+) -> None:
+    """Stage the max seq id of each topic in a temp table, so a statement can bound every topic at once."""
+    conn.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS wal_clean_max_seq_ids (topic TEXT PRIMARY KEY, max_seq_id INTEGER NOT NULL) WITHOUT ROWID"
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO temp.wal_clean_max_seq_ids (max_seq_id, topic) VALUES (?, ?)",
+        max_seq_ids,
+    )
+    # only the temp table has been written to, this does not touch the database
+    conn.commit()
+
+
+def _clean_wal_online(
+    conn: sqlite3.Connection,
+    max_seq_ids: List[Tuple[int, str]],
+    batch_size: int,
+    max_lock_time: float,
+    console: Console,
+) -> None:
+    """Delete the WAL entries in chunks, each in its own short transaction.
+
+    Chunks are ranges of seq ids, the primary key of the queue, and every topic is bounded by
+    its max seq id within the chunk, so neither the boundaries nor the deletes need an index on
+    topic. The chunk size is halved when a chunk holds the write lock for longer than
+    `max_lock_time` and grows back up to `batch_size` when it is well under it. After each
+    chunk the cleanup sleeps for as long as it held the lock, so live writers get at least
+    half of the time.
+    """
+    _stage_max_seq_ids(conn, max_seq_ids)
+    # seq ids at or above the highest bound are never deleted
+    end = max(max_seq_id for max_seq_id, _ in max_seq_ids)
+    size = batch_size
+    deleted = 0
+    transactions = 0
+    busy_retries = 0
+    longest_lock = 0.0
+    start = time.perf_counter()
+    last = -1
+    while True:
+        # the boundary is a primary key lookup read without a lock, seq ids below it are never
+        # reused. Gaps in the seq ids are skipped instead of walked in empty chunks.
+        lower = conn.execute(
+            "SELECT MIN(seq_id) FROM embeddings_queue WHERE seq_id > ?", (last,)
+        ).fetchone()[0]
+        if lower is None or lower >= end:
+            break
+        upper = min(lower + size - 1, end - 1)
+        rows, lock_time, retries = run_write_chunk(
+            conn,
+            "DELETE FROM embeddings_queue WHERE seq_id >= ?1 AND seq_id <= ?2 AND seq_id < (SELECT m.max_seq_id FROM temp.wal_clean_max_seq_ids m WHERE m.topic = embeddings_queue.topic)",
+            (lower, upper),
+        )
+        deleted += rows
+        transactions += 1
+        busy_retries += retries
+        longest_lock = max(longest_lock, lock_time)
+        if lock_time > max_lock_time and size > 1:
+            size = max(1, size // 2)
+        elif lock_time < max_lock_time / 2:
+            size = min(batch_size, size * 2)
+        last = upper
+        time.sleep(lock_time)
+    elapsed = time.perf_counter() - start
+    console.print(
+        f"[green]Deleted {deleted:,} WAL entries in {transactions:,} transactions in {elapsed:.2f}s "
+        f"({deleted / max(elapsed, 1e-9):,.0f} rows/s), longest lock hold {longest_lock * 1000:.1f}ms, "
+        f"{busy_retries:,} busy retries[/green]"
+    )
+
+
+def _recommend_vacuum_mode(conn: sqlite3.Connection, persist_dir: str) -> str:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if freelist_count < page_count * VACUUM_MIN_RECLAIMABLE_RATIO:
+        return VacuumMode.NONE.value
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return VacuumMode.INCREMENTAL.value
+    # VACUUM needs a temporary copy and a rollback journal, up to twice the database size
+    if get_disk_free_space(persist_dir) < 2 * page_count * page_size:
+        return f"{VacuumMode.INTO.value}=<path on another volume>"
+    return VacuumMode.FULL.value
+
+
+def _incremental_vacuum(
+    conn: sqlite3.Connection, online: Optional[bool], console: Console
+) -> None:
+    """Release the free pages of the database in slices, each in its own short transaction."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        if online:
+            raise ValueError(
+                "Switching to incremental auto vacuum requires a one-time full VACUUM, run it once without --online"
+            )
+        console.print(
+            "[yellow]Switching the database to incremental auto vacuum, this runs a full VACUUM once[/yellow]"
+        )
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    released = 0
+    longest_lock = 0.0
+    while free_pages > 0:
+        _, lock_time, _ = run_write_chunk(
+            conn, f"PRAGMA incremental_vacuum({DEFAULT_INCREMENTAL_VACUUM_PAGES})"
+        )
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # concurrent writers may reuse free pages, only count what this slice released
+        released += max(free_pages - remaining, 0)
+        free_pages = remaining
+        longest_lock = max(longest_lock, lock_time)
+        if online:
+            time.sleep(lock_time)
+    console.print(
+        f"[green]Incremental vacuum released {released:,} pages ({sizeof_fmt(released * page_size)}), "
+        f"longest lock hold {longest_lock * 1000:.1f}ms[/green]"
+    )
+
+
+def _vacuum_into(
+    conn: sqlite3.Connection, persist_dir: str, target: str, console: Console
+) -> None:
+    """VACUUM INTO a file on another volume and atomically swap it in place of the database.
+
+    Writers are locked out from the start of the VACUUM until the swap, so that no write can be
+    lost. The swap is a rename next to the database, the vacuumed file is copied back first if it
+    was written to another filesystem. A process that still has the database open would keep
+    using the replaced file, so Chroma must be stopped; the command refuses to run while another
+    connection is using the database.
+    """
+    sql_file = os.path.join(persist_dir, DEFAULT_CHROMA_SQLITE_FILE)
+    if os.path.isdir(target):
+        target = os.path.join(target, DEFAULT_CHROMA_SQLITE_FILE)
+    if os.path.exists(target):
+        raise ValueError(f"Vacuum target {target} already exists")
+    if conn.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal":
+        raise ValueError("VACUUM INTO is not supported for databases in WAL mode")
+    lock_conn = sqlite3.connect(f"file:{sql_file}?mode=rw", uri=True)
+    try:
+        # an exclusive lock is only granted if no other connection is reading or writing
+        try:
+            lock_conn.execute("BEGIN EXCLUSIVE")
+        except sqlite3.OperationalError as e:
+            raise ValueError(
+                f"{sql_file} is in use by another process, stop Chroma before vacuuming into another file"
+            ) from e
+        lock_conn.rollback()
+        # a reserved lock blocks writers but lets the VACUUM INTO read the database
+        lock_conn.execute("BEGIN IMMEDIATE")
+        start = time.perf_counter()
+        conn.execute("VACUUM INTO ?", (target,))
+        console.print(
+            f"[green]Vacuumed into {target} in {time.perf_counter() - start:.2f}s[/green]"
+        )
+        staged = target
+        if os.stat(target).st_dev != os.stat(persist_dir).st_dev:
+            staged = f"{sql_file}.vacuum"
+            shutil.copyfile(target, staged)
+        with open(staged, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(staged, sql_file)
+        if os.path.exists(target):
+            os.remove(target)
+    finally:
+        lock_conn.close()
+
+
+def _vacuum(
+    conn: sqlite3.Connection,
+    persist_dir: str,
+    vacuum: VacuumMode,
+    target: Optional[str],
+    online: Optional[bool],
+    console: Console,
+) -> None:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    console.print(
+        f"Reclaimable space: [red]{sizeof_fmt(freelist_count * page_size)}[/red] in {freelist_count:,} free pages "
+        f"({freelist_count / max(page_count, 1):.1%} of the database), recommended --vacuum mode: "
+        f"[red]{_recommend_vacuum_mode(conn, persist_dir)}[/red]"
+    )
+    if vacuum == VacuumMode.NONE:
+        return
+    if freelist_count == 0 and not (
+        vacuum == VacuumMode.INCREMENTAL
+        and conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
+    ):
+        console.print("[green]Nothing to reclaim, skipping vacuum[/green]")
+        return
+    if vacuum == VacuumMode.FULL:
+        conn.execute("VACUUM")
+    elif vacuum == VacuumMode.INCREMENTAL:
+        _incremental_vacuum(conn, online, console)
+    elif vacuum == VacuumMode.INTO and target:
+        _vacuum_into(conn, persist_dir, target, console)
+
+
+def _estimate_wal_clean(
+    conn: sqlite3.Connection, max_seq_ids: List[Tuple[int, str]]
+) -> List[Tuple[str, int, int]]:
+    """Count the WAL entries a clean would delete per topic, without writing to the database.
+
+    The freed bytes are the sums of the stored value lengths (see WAL_ENTRY_BYTES), the vectors
+    themselves are not loaded. Only the persisted seq id bounds are used, the HNSW indices are
+    never loaded.
+    """
+    _stage_max_seq_ids(conn, max_seq_ids)
+    rows = conn.execute(
+        f"""
+        SELECT
+            q.topic,
+            COUNT(*),
+            SUM({WAL_ENTRY_BYTES})
+        FROM embeddings_queue q
+        JOIN temp.wal_clean_max_seq_ids m ON m.topic = q.topic
+        WHERE q.seq_id < m.max_seq_id
+        GROUP BY q.topic
+        ORDER BY q.topic
+        """
+    ).fetchall()
+    return [(topic, count, size or 0) for topic, count, size in rows]
+
+
+def _print_wal_clean_estimate(
+    estimate: List[Tuple[str, int, int]],
+    collection_names: Dict[str, str],
+    console: Console,
+) -> None:
+    table = Table(title="WAL Cleanup Dry Run")
+    table.add_column("Collection", style="cyan")
+    table.add_column("Topic", style="cyan")
+    table.add_column("Entries To Delete", style="magenta")
+    table.add_column("Reclaimable", style="green")
+    for topic, count, size in estimate:
+        table.add_row(
+            collection_names.get(topic, "-"), topic, f"{count:,}", sizeof_fmt(size)
+        )
+    table.add_row(
+        "Total",
+        "",
+        f"{sum(row[1] for row in estimate):,}",
+        sizeof_fmt(sum(row[2] for row in estimate)),
+    )
+    console.print(table)
+
+
+def _get_database_size(persist_dir: str) -> int:
+    sql_file = os.path.join(persist_dir, DEFAULT_CHROMA_SQLITE_FILE)
+    size = get_file_size(sql_file)
+    if os.path.exists(f"{sql_file}-wal"):
+        size += get_file_size(f"{sql_file}-wal")
+    return size
+
+
 def clean_wal(
     persist_dir: str,
     skip_collection_names: Optional[Sequence[str]] = None,
     tenant: Optional[str] = DEFAULT_TENANT_ID,
     topic_namespace: Optional[str] = DEFAULT_TOPIC_NAMESPACE,
     yes: Optional[bool] = False,
-) -> None:
+    online: Optional[bool] = False,
+    batch_size: int = DEFAULT_WAL_CLEAN_BATCH_SIZE,
+    max_lock_ms: int = DEFAULT_WAL_CLEAN_MAX_LOCK_MS,
+    vacuum: Optional[str] = None,
+    dry_run: Optional[bool] = False,
+) -> Optional[List[Tuple[str, int, int]]]:
+    """Delete the WAL entries already persisted to the HNSW index.
+
+    With `dry_run` nothing is written to the database, the entries that would be deleted are
+    returned per topic as (topic, entries, bytes).
+    """
+    if vacuum is None:
+        vacuum = VacuumMode.NONE.value if online else VacuumMode.FULL.value
+    vacuum_mode, vacuum_target = parse_vacuum_mode(vacuum)
+    if online and vacuum_mode in (VacuumMode.FULL, VacuumMode.INTO):
+        raise ValueError(
+            f"--vacuum {vacuum_mode.value} locks the database for the whole vacuum and cannot be used with --online"
+        )
+    if batch_size <= 0:
+        raise ValueError("Batch size must be a positive number")
+    if max_lock_ms <= 0:
+        raise ValueError("Max lock time must be a positive number of milliseconds")
     validate_chroma_persist_dir(persist_dir)
     console = Console()
     print_chroma_version(console)
-    console.print(f"[green]Size before: {get_dir_size(persist_dir)}[/green]")
-    with get_sqlite_connection(persist_dir, SqliteMode.READ_WRITE) as conn:
+    if not dry_run:
+        console.print(f"[green]Size before: {_get_database_size(persist_dir)}[/green]")
+    with get_sqlite_connection(
+        persist_dir, SqliteMode.READ_ONLY if dry_run else SqliteMode.READ_WRITE
+    ) as conn:
         cursor = conn.cursor()
         import chromadb
 
@@ -40,25 +362,26 @@ def clean_wal(
             collection_name_index = 3
             query = "SELECT s.id as 'segment', c.id as 'collection' , c.dimension as 'dimension', c.name FROM segments s LEFT JOIN collections c ON s.collection = c.id WHERE s.scope = 'VECTOR';"
         results = cursor.execute(query).fetchall()
-        wal_cleanup_queries = []
         if len(results) == 0:
             console.print("[green]No WAL entries found. Nothing to clean up.[/green]")
-            return
-        if not yes:
+            return [] if dry_run else None
+        if not yes and not dry_run:
             if not typer.confirm(
                 f"\nAre you sure you want to clean up the WAL in {persist_dir}? This action will delete all WAL entries that are not committed to the HNSW index.",
                 default=False,
                 show_default=True,
             ):
                 console.print("[yellow]WAL cleanup cancelled by user[/yellow]")
-                return
+                return None
+        max_seq_ids = []
+        collection_names = {}
         for row in results:
             if (
                 skip_collection_names
                 and row[collection_name_index] in skip_collection_names
             ):
                 continue
-            if int(chroma_version.split(".")[1]) <= 4:
+            if version.parse(chroma_version) < version.parse("0.5.0"):
                 segment_id = row[0]
                 topic = row[1]
                 collection_id = row[2]
@@ -66,53 +389,51 @@ def clean_wal(
                 segment_id = row[0]
                 collection_id = row[1]
                 topic = f"persistent://{tenant}/{topic_namespace}/{collection_id}"
+            collection_names[topic] = row[collection_name_index]
             metadata_pickle = os.path.join(
                 persist_dir, segment_id, "index_metadata.pickle"
             )
-            if os.path.exists(metadata_pickle):
-                metadata = PersistentData.load_from_file(metadata_pickle)
-                if hasattr(metadata, "max_seq_id"):
-                    max_seq_id = metadata.max_seq_id
-                else:
-                    max_seq_id_query_hnsw_057 = (
-                        "SELECT seq_id FROM max_seq_id WHERE segment_id = ?"
-                    )
-                    cursor.execute(max_seq_id_query_hnsw_057, [row[0]])
-                    results = cursor.fetchall()
-                    max_seq_id = decode_seq_id(results[0][0]) if len(results) > 0 else 0
-                wal_cleanup_queries.append(
-                    f"DELETE FROM embeddings_queue WHERE seq_id < {max_seq_id} AND topic='{topic}';"
-                )
-            else:
-                # TODO this way of getting the hnsw space might be wrong going forward with 0.6.x
-                hnsw_space = cursor.execute(
-                    "select str_value from collection_metadata where collection_id=? and key='hnsw:space'",
-                    (collection_id,),
-                ).fetchone()
-                if not hnsw_space:
-                    continue
-                hnsw_space = "l2" if hnsw_space is None else hnsw_space[0]
-                list_of_ids = get_hnsw_index_ids(
-                    f"{os.path.join(persist_dir, segment_id)}", hnsw_space, row[3]
-                )
-                batch_size = 100
-                for batch in range(0, len(list_of_ids), batch_size):
-                    wal_cleanup_queries.append(
-                        f"DELETE FROM embeddings_queue WHERE seq_id IN ({','.join([str(i) for i in list_of_ids[batch:batch + batch_size]])});"
-                    )
-        if len(wal_cleanup_queries) > 0:
+            metadata = (
+                PersistentData.load_from_file(metadata_pickle)
+                if os.path.exists(metadata_pickle)
+                else None
+            )
+            # the persisted seq id bound is enough, the index itself is never loaded.
+            # Segments that were never persisted have no bound and keep their entries.
+            max_seq_id, _ = get_segment_max_seq_id(conn, segment_id, metadata)
+            if max_seq_id > 0:
+                max_seq_ids.append((max_seq_id, topic))
+        if dry_run:
+            estimate = _estimate_wal_clean(conn, max_seq_ids)
+            _print_wal_clean_estimate(estimate, collection_names, console)
+            return estimate
+        if online and len(max_seq_ids) > 0:
+            console.print("[green]Cleaning up WAL online[/green]")
+            # fail fast on a locked database and back off instead of waiting in SQLite
+            cursor.execute("PRAGMA busy_timeout = 0")
+            _clean_wal_online(
+                conn, max_seq_ids, batch_size, max_lock_ms / 1000, console
+            )
+        elif len(max_seq_ids) > 0:
             console.print("[green]Cleaning up WAL[/green]")
-            wal_cleanup_queries.insert(
-                0, "BEGIN EXCLUSIVE;"
-            )  # locking the DB exclusively to prevent other processes from accessing it
-            wal_cleanup_queries.append("COMMIT;")
-            wal_cleanup_queries.append("VACUUM;")
-            cursor.executescript("\n".join(wal_cleanup_queries))
+            # locking the DB exclusively to prevent other processes from accessing it
+            cursor.execute("BEGIN EXCLUSIVE")
+            try:
+                cursor.executemany(
+                    "DELETE FROM embeddings_queue WHERE seq_id < ? AND topic = ?",
+                    max_seq_ids,
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
+        _vacuum(conn, persist_dir, vacuum_mode, vacuum_target, online, console)
         # Close the cursor and connection
         cursor.close()
     console.print(
-        f"[green]WAL cleaned up. Size after: {get_dir_size(persist_dir)}[/green]"
+        f"[green]WAL cleaned up. Size after: {_get_database_size(persist_dir)}[/green]"
     )
+    return None
 
 
 def command(
@@ -126,5 +447,39 @@ def command(
     yes: Optional[bool] = typer.Option(
         False, "--yes", "-y", help="Skip confirmation prompt"
     ),
+    online: Optional[bool] = typer.Option(
+        False,
+        "--online",
+        help="Delete in short, throttled transactions so that a live Chroma server can keep writing.",
+    ),
+    batch_size: int = typer.Option(
+        DEFAULT_WAL_CLEAN_BATCH_SIZE,
+        "--batch-size",
+        help="Maximum number of WAL entries deleted per transaction in online mode",
+    ),
+    max_lock_ms: int = typer.Option(
+        DEFAULT_WAL_CLEAN_MAX_LOCK_MS,
+        "--max-lock-ms",
+        help="Target maximum time in milliseconds a transaction holds the write lock in online mode",
+    ),
+    vacuum: Optional[str] = typer.Option(
+        None,
+        "--vacuum",
+        help="How to reclaim the freed space: full, none, incremental or into=<path>. Defaults to full, none with --online. into=<path> replaces the database file, stop Chroma first.",
+    ),
+    dry_run: Optional[bool] = typer.Option(
+        False,
+        "--dry-run",
+        help="Report the WAL entries and bytes each collection would free without changing the database",
+    ),
 ) -> None:
-    clean_wal(persist_dir, skip_collection_names=skip_collection_names, yes=yes)
+    clean_wal(
+        persist_dir,
+        skip_collection_names=skip_collection_names,
+        yes=yes,
+        online=online,
+        batch_size=batch_size,
+        max_lock_ms=max_lock_ms,
+        vacuum=vacuum,
+        dry_run=dry_run,
+    )
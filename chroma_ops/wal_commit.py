@@ -31,7 +31,9 @@ def commit_wal(
     skip_collection_names = skip_collection_names or []
     console = Console()
     if version.parse(chromadb.__version__) > version.parse("1.0.0"):
-        console.print("[red]This command is deprecated in ChromaDB 1.0.0+.[/red]")
+        console.print(
+            "[red]This command is deprecated in ChromaDB 1.0.0+, use `chops wal apply` instead.[/red]"
+        )
         return
     print_chroma_version(console)
     collections_to_commit = []
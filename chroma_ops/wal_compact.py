@@ -0,0 +1,267 @@
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from chroma_ops.constants import (
+    DEFAULT_TENANT_ID,
+    DEFAULT_TOPIC_NAMESPACE,
+    DEFAULT_WAL_COMPACT_BATCH_SIZE,
+)
+from chroma_ops.utils import (
+    get_segment_max_seq_id,
+    run_write_chunk,
+    PersistentData,
+    SqliteMode,
+    get_sqlite_connection,
+    print_chroma_version,
+    sizeof_fmt,
+    validate_chroma_persist_dir,
+    WAL_ENTRY_BYTES,
+)
+from chroma_ops.wal_apply import WalOperation
+
+# Rows of one (topic, id) that replaying can skip without changing the result, whatever state
+# the segment replaying them starts from:
+# - everything before the last DELETE, the delete drops whatever those rows left behind
+# - an ADD after an earlier ADD or UPSERT with no DELETE in between, the id exists and Chroma
+#   ignores the add
+# Updates are kept, they merge metadata rather than replace it. The last DELETE is kept as well,
+# whether the id existed before the oldest entry in the queue is not known. The newest entry of the
+# queue is never deleted, seq_id has no AUTOINCREMENT and SQLite would hand its seq id out again.
+SUPERSEDED_QUERY = f"""
+INSERT INTO temp.wal_compact_seq_ids (seq_id)
+SELECT seq_id FROM (
+    SELECT
+        seq_id,
+        operation,
+        last_delete,
+        SUM(CASE WHEN operation IN ({WalOperation.ADD:d}, {WalOperation.UPSERT:d}) AND seq_id > last_delete THEN 1 ELSE 0 END)
+            OVER (PARTITION BY topic, id ORDER BY seq_id ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS live_adds
+    FROM (
+        SELECT
+            seq_id,
+            topic,
+            id,
+            operation,
+            COALESCE(MAX(CASE WHEN operation = {WalOperation.DELETE:d} THEN seq_id END) OVER (PARTITION BY topic, id), -1) AS last_delete
+        FROM embeddings_queue
+        WHERE topic IN (SELECT topic FROM temp.wal_compact_topics)
+    )
+)
+WHERE (seq_id < last_delete OR (operation = {WalOperation.ADD:d} AND live_adds > 0))
+    AND seq_id < (SELECT MAX(seq_id) FROM embeddings_queue)
+"""
+
+
+def _stage_superseded(
+    conn: sqlite3.Connection, topics: List[Tuple[str, int]]
+) -> List[Tuple[str, int, int, int, int]]:
+    """Stage the seq ids of the superseded WAL entries in a temp table.
+
+    Returns (topic, entries, superseded, superseded pending replay, bytes) per topic, pending are
+    the entries above the max seq id of the vector segment.
+    """
+    conn.execute(
+        "CREATE TEMP TABLE wal_compact_topics (topic TEXT PRIMARY KEY, max_seq_id INTEGER NOT NULL) WITHOUT ROWID"
+    )
+    conn.execute("CREATE TEMP TABLE wal_compact_seq_ids (seq_id INTEGER PRIMARY KEY)")
+    conn.executemany(
+        "INSERT OR REPLACE INTO temp.wal_compact_topics (topic, max_seq_id) VALUES (?, ?)",
+        topics,
+    )
+    conn.execute(SUPERSEDED_QUERY)
+    # only the temp tables have been written to, this does not touch the database
+    conn.commit()
+    superseded = {
+        topic: (count, pending, size or 0)
+        for topic, count, pending, size in conn.execute(
+            f"""
+            SELECT
+                q.topic,
+                COUNT(*),
+                SUM(q.seq_id > t.max_seq_id),
+                SUM({WAL_ENTRY_BYTES})
+            FROM temp.wal_compact_seq_ids s
+            JOIN embeddings_queue q ON q.seq_id = s.seq_id
+            JOIN temp.wal_compact_topics t ON t.topic = q.topic
+            GROUP BY q.topic
+            """
+        ).fetchall()
+    }
+    # a single grouped scan of the queue, there is no index on topic to serve a count per topic
+    return [
+        (topic, entries, *superseded.get(topic, (0, 0, 0)))
+        for topic, entries in conn.execute(
+            """
+            SELECT t.topic, COALESCE(c.entries, 0)
+            FROM temp.wal_compact_topics t
+            LEFT JOIN (SELECT topic, COUNT(*) AS entries FROM embeddings_queue GROUP BY topic) c
+                ON c.topic = t.topic
+            ORDER BY t.topic
+            """
+        ).fetchall()
+    ]
+
+
+def _delete_superseded(
+    conn: sqlite3.Connection, batch_size: int
+) -> Tuple[int, int, int]:
+    """Delete the staged WAL entries in batches, each in its own short transaction.
+
+    Returns the entries deleted, the transactions used and the busy retries.
+    """
+    deleted = 0
+    transactions = 0
+    busy_retries = 0
+    last = -1
+    while True:
+        upper = conn.execute(
+            "SELECT MAX(seq_id) FROM (SELECT seq_id FROM temp.wal_compact_seq_ids WHERE seq_id > ? ORDER BY seq_id LIMIT ?)",
+            (last, batch_size),
+        ).fetchone()[0]
+        if upper is None:
+            break
+        rows, _, retries = run_write_chunk(
+            conn,
+            "DELETE FROM embeddings_queue WHERE seq_id IN (SELECT seq_id FROM temp.wal_compact_seq_ids WHERE seq_id > ? AND seq_id <= ?)",
+            (last, upper),
+        )
+        deleted += rows
+        transactions += 1
+        busy_retries += retries
+        last = upper
+    return deleted, transactions, busy_retries
+
+
+def compact_wal(
+    persist_dir: str,
+    *,
+    collections: Optional[Sequence[str]] = None,
+    tenant: Optional[str] = DEFAULT_TENANT_ID,
+    topic_namespace: Optional[str] = DEFAULT_TOPIC_NAMESPACE,
+    batch_size: int = DEFAULT_WAL_COMPACT_BATCH_SIZE,
+    yes: Optional[bool] = False,
+    dry_run: Optional[bool] = False,
+) -> Dict[str, int]:
+    """Delete the WAL entries superseded by a later operation on the same id.
+
+    The net operation per (topic, id) is computed with window queries, the superseded entries
+    are deleted in batches of `batch_size`, each in its own short transaction. The rules do not
+    depend on how far a segment has consumed the WAL, so Chroma can keep running. Returns the
+    entries deleted per collection, or that would be deleted with `dry_run`.
+    """
+    if batch_size <= 0:
+        raise ValueError("Batch size must be a positive number")
+    validate_chroma_persist_dir(persist_dir)
+    console = Console()
+    print_chroma_version(console)
+    compacted: Dict[str, int] = {}
+    with get_sqlite_connection(
+        persist_dir, SqliteMode.READ_ONLY if dry_run else SqliteMode.READ_WRITE
+    ) as conn:
+        segments = conn.execute(
+            "SELECT s.id, c.id, c.name FROM segments s JOIN collections c ON s.collection = c.id WHERE s.scope = 'VECTOR' ORDER BY c.name"
+        ).fetchall()
+        if collections:
+            names = {name for _, _, name in segments}
+            missing = [name for name in collections if name not in names]
+            if missing:
+                raise ValueError(f"Collections {', '.join(missing)} do not exist")
+            segments = [row for row in segments if row[2] in collections]
+        topics = []
+        collection_names = {}
+        for segment_id, collection_id, name in segments:
+            topic = f"persistent://{tenant}/{topic_namespace}/{collection_id}"
+            metadata_file = os.path.join(
+                persist_dir, segment_id, "index_metadata.pickle"
+            )
+            metadata = (
+                PersistentData.load_from_file(metadata_file)
+                if os.path.exists(metadata_file)
+                else None
+            )
+            max_seq_id, _ = get_segment_max_seq_id(conn, segment_id, metadata)
+            topics.append((topic, max_seq_id))
+            collection_names[topic] = name
+        start = time.perf_counter()
+        stats = _stage_superseded(conn, topics)
+        table = Table(title="WAL Compaction Dry Run" if dry_run else "WAL Compaction")
+        table.add_column("Collection", style="cyan")
+        table.add_column("WAL Entries", style="magenta")
+        table.add_column("Superseded", style="magenta")
+        table.add_column("Replay Entries Saved", style="green")
+        table.add_column("Reclaimable", style="green")
+        for topic, entries, superseded, pending, size in stats:
+            table.add_row(
+                collection_names[topic],
+                f"{entries:,}",
+                f"{superseded:,} ({superseded / max(entries, 1):.0%})",
+                f"{pending:,}",
+                sizeof_fmt(size),
+            )
+            if superseded:
+                compacted[collection_names[topic]] = superseded
+        console.print(table)
+        console.print(
+            f"Computed the net operations in {time.perf_counter() - start:.2f}s"
+        )
+        if dry_run:
+            return compacted
+        if not compacted:
+            console.print(
+                "[green]No superseded WAL entries, nothing to compact[/green]"
+            )
+            return compacted
+        if not yes:
+            if not typer.confirm(
+                f"\nAre you sure you want to delete {sum(compacted.values()):,} superseded WAL entries from {persist_dir}?",
+                default=False,
+                show_default=True,
+            ):
+                console.print("[yellow]WAL compaction cancelled by user[/yellow]")
+                return {}
+        # fail fast on a locked database and back off instead of waiting in SQLite
+        conn.execute("PRAGMA busy_timeout = 0")
+        start = time.perf_counter()
+        deleted, transactions, busy_retries = _delete_superseded(conn, batch_size)
+        elapsed = time.perf_counter() - start
+    console.print(
+        f"[green]Deleted {deleted:,} superseded WAL entries in {transactions:,} transactions in {elapsed:.2f}s "
+        f"({deleted / max(elapsed, 1e-9):,.0f} rows/s), {busy_retries:,} busy retries. "
+        f"Run `chops wal clean` with --vacuum to return the space to the filesystem[/green]"
+    )
+    return compacted
+
+
+def command(
+    persist_dir: str = typer.Argument(..., help="The persist directory"),
+    collections: Optional[List[str]] = typer.Option(
+        None,
+        "--collection",
+        "-c",
+        help="Compact the WAL of this collection only, can be repeated",
+    ),
+    batch_size: int = typer.Option(
+        DEFAULT_WAL_COMPACT_BATCH_SIZE,
+        "--batch-size",
+        help="Number of WAL entries deleted per transaction",
+    ),
+    dry_run: Optional[bool] = typer.Option(
+        False,
+        "--dry-run",
+        help="Report the superseded WAL entries without deleting them",
+    ),
+    yes: Optional[bool] = typer.Option(False, "--yes", "-y", help="Skip confirmation"),
+) -> None:
+    compact_wal(
+        persist_dir,
+        collections=collections,
+        batch_size=batch_size,
+        yes=yes,
+        dry_run=dry_run,
+    )
@@ -1,18 +1,45 @@
 import base64
+import gzip
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import json
+import os
+import sqlite3
 import sys
 from contextlib import contextmanager
-from typing import Optional, Generator, IO, Union, Any, TextIO
+from datetime import datetime
+from enum import Enum
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    IO,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
 
-from packaging import version
-import chromadb
 import typer
 
-from chroma_ops.constants import DEFAULT_TENANT_ID, DEFAULT_TOPIC_NAMESPACE
+from chroma_ops.compression import Codec, validate_codec
+from chroma_ops.constants import (
+    DEFAULT_TENANT_ID,
+    DEFAULT_TOPIC_NAMESPACE,
+    DEFAULT_WAL_EXPORT_BATCH_SIZE,
+    DEFAULT_WAL_EXPORT_BUFFER_SIZE,
+)
 from chroma_ops.utils import (
+    find_seq_id_at,
+    format_timestamp,
     SqliteMode,
+    decode_vectors,
+    get_file_size,
     get_sqlite_connection,
     print_chroma_version,
+    sizeof_fmt,
     validate_chroma_persist_dir,
 )
 
@@ -20,19 +47,431 @@ from rich.console import Console
 from rich.table import Table
 
 
+class ExportCompression(str, Enum):
+    NONE = "none"
+    GZIP = "gzip"
+    ZSTD = "zstd"
+
+
+COMPRESSION_EXTENSIONS = {".gz": ExportCompression.GZIP, ".zst": ExportCompression.ZSTD}
+
+
+def get_export_compression(
+    output_file: Optional[str], compression: Optional[ExportCompression] = None
+) -> ExportCompression:
+    """Use the given compression, or pick it from the output file extension."""
+    if compression is None:
+        extension = os.path.splitext(output_file or "")[1]
+        compression = COMPRESSION_EXTENSIONS.get(extension, ExportCompression.NONE)
+    if compression == ExportCompression.ZSTD:
+        validate_codec(Codec.ZSTD)
+    return compression
+
+
+class _HashingWriter:
+    """Hashes the bytes on their way to the file, so shards are checksummed as they are written."""
+
+    def __init__(self, fileobj: IO[bytes], digest: "hashlib._Hash") -> None:
+        self._fileobj = fileobj
+        self._digest = digest
+
+    def write(self, data: bytes) -> int:
+        self._digest.update(data)
+        return self._fileobj.write(data)
+
+    def flush(self) -> None:
+        self._fileobj.flush()
+
+
 @contextmanager
 def smart_open(
     filename: Optional[str] = None,
-) -> Generator[Union[IO[Any], TextIO], None, None]:
-    fh: Union[IO[Any], TextIO] = sys.stdout
+    mode: str = "w",
+    compression: ExportCompression = ExportCompression.NONE,
+    digest: Optional["hashlib._Hash"] = None,
+) -> Generator[IO[bytes], None, None]:
+    """Open a binary output stream, stdout without a filename, compressed on the fly."""
     if filename:
-        fh = open(filename, "w")
+        raw: IO[bytes] = open(
+            filename, f"{mode}b", buffering=DEFAULT_WAL_EXPORT_BUFFER_SIZE
+        )
+    else:
+        sys.stdout.flush()
+        raw = sys.stdout.buffer
+    sink: Any = raw if digest is None else _HashingWriter(raw, digest)
+    fh = sink
+    if compression == ExportCompression.GZIP:
+        fh = gzip.GzipFile(fileobj=sink, mode="wb")
+    elif compression == ExportCompression.ZSTD:
+        import zstandard
 
+        fh = zstandard.ZstdCompressor().stream_writer(sink, closefd=False)
     try:
         yield fh
     finally:
-        if filename:
+        # closing the compressor writes its trailer, the file is closed separately
+        if fh is not sink:
             fh.close()
+        if filename:
+            raw.close()
+        else:
+            raw.flush()
+
+
+class ExportFormat(str, Enum):
+    JSONL = "jsonl"
+    NPY = "npy"
+
+
+def _build_filter(
+    conn: sqlite3.Connection,
+    topics: Optional[Sequence[str]] = None,
+    from_seq: Optional[int] = None,
+    to_seq: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Tuple[str, List[Any]]:
+    """Build the WHERE clause selecting the WAL entries to export.
+
+    Time bounds are narrowed to a seq_id range, so every filter is answered from the primary key.
+    """
+    clauses = []
+    params: List[Any] = []
+    if since is not None:
+        timestamp = format_timestamp(since)
+        since_seq = find_seq_id_at(conn, timestamp)
+        # nothing was written since, an empty range
+        since_seq = since_seq if since_seq is not None else sys.maxsize
+        from_seq = since_seq if from_seq is None else max(from_seq, since_seq)
+        clauses.append("created_at >= ?")
+        params.append(timestamp)
+    if until is not None:
+        timestamp = format_timestamp(until)
+        until_seq = find_seq_id_at(conn, timestamp)
+        if until_seq is not None:
+            to_seq = until_seq - 1 if to_seq is None else min(to_seq, until_seq - 1)
+        clauses.append("created_at < ?")
+        params.append(timestamp)
+    if from_seq is not None:
+        clauses.insert(0, "seq_id >= ?")
+        params.insert(0, from_seq)
+    if to_seq is not None:
+        clauses.insert(0, "seq_id <= ?")
+        params.insert(0, to_seq)
+    if topics is not None:
+        clauses.append(f"topic IN ({', '.join('?' for _ in topics)})")
+        params.extend(topics)
+    return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+
+def _read_checkpoint(
+    checkpoint_file: str, output_file: str, filters: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file) as f:
+        checkpoint: Dict[str, Any] = json.load(f)
+    if checkpoint["output"] != os.path.abspath(output_file) or (
+        checkpoint["filters"] != filters
+    ):
+        raise ValueError(
+            f"Checkpoint {checkpoint_file} belongs to a different export, remove it to start over"
+        )
+    return checkpoint
+
+
+def _write_checkpoint(checkpoint_file: str, checkpoint: Dict[str, Any]) -> None:
+    # written aside and renamed, an interrupted write leaves the previous checkpoint intact
+    with open(f"{checkpoint_file}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{checkpoint_file}.tmp", checkpoint_file)
+
+
+def _export_wal_jsonl(
+    conn: sqlite3.Connection,
+    output_file: Optional[str],
+    where: str = "",
+    params: Sequence[Any] = (),
+    checkpoint_file: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    batch_size: int = DEFAULT_WAL_EXPORT_BATCH_SIZE,
+    digest: Optional["hashlib._Hash"] = None,
+    compression: ExportCompression = ExportCompression.NONE,
+) -> int:
+    """Export the WAL entries as json lines, with the vectors base64 encoded.
+
+    Rows are fetched and written in batches. With a checkpoint file the seq id and output offset
+    of the last written batch are recorded, and a rerun continues after it, truncating anything
+    written after the checkpoint.
+    """
+    checkpoint = None
+    if checkpoint_file:
+        if not output_file:
+            raise ValueError("A checkpoint requires an output file")
+        if compression != ExportCompression.NONE:
+            raise ValueError("Checkpoints are not supported for compressed exports")
+        checkpoint = _read_checkpoint(checkpoint_file, output_file, filters or {})
+    if checkpoint is not None:
+        where = f"{where} AND seq_id > ?" if where else "WHERE seq_id > ?"
+        params = [*params, checkpoint["last_seq_id"]]
+        os.truncate(output_file, checkpoint["offset"])  # type: ignore[arg-type]
+    cursor = conn.execute(
+        f"SELECT * FROM embeddings_queue {where} ORDER BY seq_id ASC", params
+    )
+    column_names = [description[0] for description in cursor.description]
+    seq_id_index = column_names.index("seq_id")
+    vector_index = column_names.index("vector")
+    exported_rows = 0 if checkpoint is None else checkpoint["exported_rows"]
+    with smart_open(
+        output_file, "a" if checkpoint else "w", compression, digest
+    ) as json_file:
+        while rows := cursor.fetchmany(batch_size):
+            lines = []
+            for row in rows:
+                row_data = dict(zip(column_names, row))
+                if row[vector_index] is not None:
+                    row_data["vector"] = base64.b64encode(row[vector_index]).decode()
+                lines.append(json.dumps(row_data))
+            json_file.write(("\n".join(lines) + "\n").encode())
+            exported_rows += len(rows)
+            if checkpoint_file and output_file:
+                json_file.flush()
+                os.fsync(json_file.fileno())
+                _write_checkpoint(
+                    checkpoint_file,
+                    {
+                        "output": os.path.abspath(output_file),
+                        "filters": filters or {},
+                        "last_seq_id": rows[-1][seq_id_index],
+                        "offset": json_file.tell(),
+                        "exported_rows": exported_rows,
+                    },
+                )
+    return exported_rows
+
+
+def _split_output_file(output_file: str) -> Tuple[str, str]:
+    """Split e.g. out.jsonl.gz into out and .jsonl.gz"""
+    root, compression_ext = os.path.splitext(output_file)
+    if compression_ext not in COMPRESSION_EXTENSIONS:
+        root, compression_ext = output_file, ""
+    root, ext = os.path.splitext(root)
+    return root, f"{ext or '.jsonl'}{compression_ext}"
+
+
+def _shard_file(output_file: str, shard: int) -> str:
+    root, ext = _split_output_file(output_file)
+    return f"{root}.{shard:05d}{ext}"
+
+
+def _export_shard(
+    persist_dir: str,
+    output_file: str,
+    where: str,
+    params: Sequence[Any],
+    compression: ExportCompression,
+) -> Tuple[int, int, str]:
+    """Export one seq id range of the WAL on its own read-only connection, in a worker process."""
+    digest = hashlib.sha256()
+    with get_sqlite_connection(persist_dir, SqliteMode.READ_ONLY) as conn:
+        rows = _export_wal_jsonl(
+            conn, output_file, where, params, digest=digest, compression=compression
+        )
+    return rows, get_file_size(output_file), digest.hexdigest()
+
+
+def _export_wal_sharded(
+    conn: sqlite3.Connection,
+    persist_dir: str,
+    output_file: str,
+    shards: int,
+    where: str = "",
+    params: Sequence[Any] = (),
+    compression: ExportCompression = ExportCompression.NONE,
+) -> Tuple[int, Table]:
+    """Export the WAL as jsonl shards written in parallel, each shard a contiguous seq id range.
+
+    The seq id range of the selected entries is split in equal parts, the WAL seq ids are dense
+    so the shards are close in size. `<out>.manifest.json` lists the shards with their seq id
+    ranges, row counts, sizes and sha256 checksums of the (compressed) shard files, and the topics.
+    """
+    low, high = conn.execute(
+        f"SELECT MIN(seq_id), MAX(seq_id) FROM embeddings_queue {where}", params
+    ).fetchone()
+    if low is None:
+        low, high = 0, -1
+    step = max((high - low + 1 + shards - 1) // shards, 1)
+    ranges = [
+        (low + i * step, min(low + (i + 1) * step - 1, high)) for i in range(shards)
+    ]
+    manifest = []
+    table = Table(title="WAL Export Shards")
+    table.add_column("Shard", style="cyan")
+    table.add_column("Seq IDs", style="cyan")
+    table.add_column("Rows", style="magenta")
+    table.add_column("Size", style="magenta")
+    table.add_column("SHA256", style="green")
+    with ProcessPoolExecutor(max_workers=shards) as executor:
+        futures = []
+        for i, (first_seq_id, last_seq_id) in enumerate(ranges):
+            shard_where = f"{where} AND " if where else "WHERE "
+            futures.append(
+                executor.submit(
+                    _export_shard,
+                    persist_dir,
+                    _shard_file(output_file, i),
+                    f"{shard_where}seq_id >= ? AND seq_id <= ?",
+                    [*params, first_seq_id, last_seq_id],
+                    compression,
+                )
+            )
+        for i, ((first_seq_id, last_seq_id), future) in enumerate(zip(ranges, futures)):
+            rows, size, sha256 = future.result()
+            manifest.append(
+                {
+                    "file": os.path.basename(_shard_file(output_file, i)),
+                    "first_seq_id": first_seq_id,
+                    "last_seq_id": last_seq_id,
+                    "rows": rows,
+                    "size": size,
+                    "sha256": sha256,
+                }
+            )
+            table.add_row(
+                str(i),
+                f"{first_seq_id}-{last_seq_id}",
+                str(rows),
+                sizeof_fmt(size),
+                sha256[:16],
+            )
+    exported_rows = sum(shard["rows"] for shard in manifest)
+    # lets an import map the topics up front without reading the shards
+    topics = [
+        row[0]
+        for row in conn.execute(
+            f"SELECT DISTINCT topic FROM embeddings_queue {where} ORDER BY topic",
+            params,
+        )
+    ]
+    with open(f"{_split_output_file(output_file)[0]}.manifest.json", "w") as f:
+        json.dump(
+            {
+                "format": ExportFormat.JSONL.value,
+                "rows": exported_rows,
+                "topics": topics,
+                "shards": manifest,
+            },
+            f,
+            indent=2,
+        )
+    return exported_rows, table
+
+
+def _export_wal_npy(
+    conn: sqlite3.Connection,
+    output_dir: str,
+    collection_names: Dict[str, str],
+    where: str = "",
+    params: Sequence[Any] = (),
+    batch_size: int = DEFAULT_WAL_EXPORT_BATCH_SIZE,
+) -> int:
+    """Export the WAL in a columnar layout, one set of files per topic.
+
+    `<collection_id>.npy` holds the vectors as a float32 matrix and `<collection_id>.jsonl` every
+    WAL entry without its vector, pointing to its row in the matrix with `vector_row`.
+    `manifest.json` lists the topics and their files.
+    """
+    if os.path.exists(output_dir) and os.listdir(output_dir):
+        raise ValueError(f"Output directory {output_dir} is not empty")
+    os.makedirs(output_dir, exist_ok=True)
+    # sizing pass, the matrices are preallocated on disk and filled in batches
+    topics = conn.execute(
+        f"SELECT topic, COUNT(vector), MIN(LENGTH(vector)), MAX(LENGTH(vector)) FROM embeddings_queue {where} GROUP BY topic",
+        params,
+    ).fetchall()
+    manifest = []
+    matrices = {}
+    sidecars: Dict[str, IO[Any]] = {}
+    written: Dict[str, int] = {}
+    exported_rows = 0
+    try:
+        for topic, vectors, min_length, max_length in topics:
+            name = topic.rsplit("/", 1)[-1]
+            if min_length != max_length:
+                raise ValueError(
+                    f"Vectors of topic {topic} have different dimensions, cannot export them as a matrix"
+                )
+            # both supported encodings use 4 bytes per dimension
+            dim = (max_length or 0) // 4
+            matrices[topic] = np.lib.format.open_memmap(
+                os.path.join(output_dir, f"{name}.npy"),
+                mode="w+",
+                dtype=np.float32,
+                shape=(vectors, dim),
+            )
+            sidecars[topic] = open(os.path.join(output_dir, f"{name}.jsonl"), "w")
+            written[topic] = 0
+            manifest.append(
+                {
+                    "topic": topic,
+                    "collection": collection_names.get(topic),
+                    "vectors": vectors,
+                    "dimension": dim,
+                    "vectors_file": f"{name}.npy",
+                    "entries_file": f"{name}.jsonl",
+                }
+            )
+        cursor = conn.execute(
+            f"SELECT seq_id, created_at, operation, topic, id, vector, encoding, metadata FROM embeddings_queue {where} ORDER BY seq_id ASC",
+            params,
+        )
+        while rows := cursor.fetchmany(batch_size):
+            by_topic: Dict[str, List[Any]] = {}
+            for row in rows:
+                by_topic.setdefault(row[3], []).append(row)
+            for topic, topic_rows in by_topic.items():
+                with_vectors = [row for row in topic_rows if row[5] is not None]
+                start = written[topic]
+                if with_vectors:
+                    matrix = matrices[topic]
+                    matrix[start : start + len(with_vectors)] = decode_vectors(
+                        [row[5] for row in with_vectors],
+                        [row[6] for row in with_vectors],
+                        matrix.shape[1],
+                    )
+                    written[topic] += len(with_vectors)
+                lines = []
+                for row in topic_rows:
+                    vector_row = None
+                    if row[5] is not None:
+                        vector_row = start
+                        start += 1
+                    lines.append(
+                        json.dumps(
+                            {
+                                "seq_id": row[0],
+                                "created_at": row[1],
+                                "operation": row[2],
+                                "topic": row[3],
+                                "id": row[4],
+                                "vector_row": vector_row,
+                                "encoding": row[6],
+                                "metadata": row[7],
+                            }
+                        )
+                    )
+                sidecars[topic].write("\n".join(lines) + "\n")
+            exported_rows += len(rows)
+    finally:
+        for matrix in matrices.values():
+            matrix.flush()
+        for sidecar in sidecars.values():
+            sidecar.close()
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump({"format": ExportFormat.NPY.value, "topics": manifest}, f, indent=2)
+    return exported_rows
 
 
 def export_wal(
@@ -42,30 +481,72 @@ def export_wal(
     tenant: Optional[str] = DEFAULT_TENANT_ID,
     topic_namespace: Optional[str] = DEFAULT_TOPIC_NAMESPACE,
     yes: Optional[bool] = False,
+    format: ExportFormat = ExportFormat.JSONL,
+    collections: Optional[Sequence[str]] = None,
+    from_seq: Optional[int] = None,
+    to_seq: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    checkpoint_file: Optional[str] = None,
+    shards: int = 1,
+    compression: Optional[ExportCompression] = None,
 ) -> None:
+    if shards <= 0:
+        raise ValueError("Number of shards must be a positive number")
+    if shards > 1 and (format != ExportFormat.JSONL or not output_file):
+        raise ValueError("Sharded exports require the jsonl format and --out")
+    if shards > 1 and checkpoint_file:
+        raise ValueError("Checkpoints are not supported for sharded exports")
+    if format == ExportFormat.NPY and compression not in (
+        None,
+        ExportCompression.NONE,
+    ):
+        raise ValueError("The npy format does not support compression")
+    if format == ExportFormat.JSONL:
+        compression = get_export_compression(output_file, compression)
+        if checkpoint_file and compression != ExportCompression.NONE:
+            raise ValueError("Checkpoints are not supported for compressed exports")
+    if format == ExportFormat.NPY and not output_file:
+        raise ValueError("The npy format writes a directory, --out is required")
+    if format == ExportFormat.NPY and checkpoint_file:
+        raise ValueError("Checkpoints are only supported for the jsonl format")
+    if checkpoint_file and not output_file:
+        raise ValueError("A checkpoint requires --out")
+    if from_seq is not None and to_seq is not None and from_seq > to_seq:
+        raise ValueError("--from-seq must not be greater than --to-seq")
+    if since is not None and until is not None and since >= until:
+        raise ValueError("--since must be before --until")
     validate_chroma_persist_dir(persist_dir)
     console = Console(stderr=True)
-    if version.parse(chromadb.__version__) > version.parse("1.0.0"):
-        console.print("[red]This command is deprecated in ChromaDB 1.0.0+.[/red]")
-        return
     print_chroma_version(console)
     table = Table(title="Exporting WAL")
     table.add_column("Collection", style="cyan")
     table.add_column("WAL Entries", style="magenta")
     with get_sqlite_connection(persist_dir, SqliteMode.READ_ONLY) as conn:
-        collections = conn.execute(
+        collection_rows = conn.execute(
             "SELECT c.name,c.id, s.id FROM collections c left join segments s on c.id=s.collection where s.scope='VECTOR'"
         ).fetchall()
-        wal_topic_groups = conn.execute(
-            "SELECT topic, count(*) FROM embeddings_queue group by topic"
-        ).fetchall()
-        for collection in collections:
+        collection_names = {}
+        for collection in collection_rows:
             topic = f"persistent://{tenant}/{topic_namespace}/{collection[1]}"
-            if len([s[1] for s in wal_topic_groups if s[0] == topic]) > 0:
-                table.add_row(
-                    collection[0],
-                    str([s[1] for s in wal_topic_groups if s[0] == topic][0]),
-                )
+            collection_names[topic] = collection[0]
+        topics = None
+        if collections:
+            topics_by_name = {name: topic for topic, name in collection_names.items()}
+            missing = [name for name in collections if name not in topics_by_name]
+            if missing:
+                raise ValueError(f"Collections {', '.join(missing)} do not exist")
+            topics = [topics_by_name[name] for name in collections]
+        where, params = _build_filter(conn, topics, from_seq, to_seq, since, until)
+        wal_topic_groups = dict(
+            conn.execute(
+                f"SELECT topic, count(*) FROM embeddings_queue {where} group by topic",
+                params,
+            ).fetchall()
+        )
+        for topic, name in collection_names.items():
+            if topic in wal_topic_groups:
+                table.add_row(name, str(wal_topic_groups[topic]))
 
         console.print(table)
         if not yes:
@@ -77,28 +558,104 @@ def export_wal(
                 console.print("[yellow]WAL export cancelled by user[/yellow]")
                 return
 
-        cursor = conn.cursor()
-        query = "SELECT * FROM embeddings_queue ORDER BY seq_id ASC;"
-        cursor.execute(query)
-        exported_rows = 0
-        with smart_open(output_file) as json_file:
-            column_names = [description[0] for description in cursor.description]
-            for row in cursor:
-                row_data = {}
-                for i, column_name in enumerate(column_names):
-                    if column_name == "vector":
-                        row_data[column_name] = base64.b64encode(row[i]).decode()
-                    else:
-                        row_data[column_name] = row[i]
-                json_file.write(json.dumps(row_data) + "\n")
-                exported_rows += 1
+        if shards > 1:
+            exported_rows, shards_table = _export_wal_sharded(
+                conn,
+                persist_dir,
+                output_file,
+                shards,
+                where,
+                params,
+                compression or ExportCompression.NONE,
+            )
+            console.print(shards_table)
+        elif format == ExportFormat.NPY:
+            exported_rows = _export_wal_npy(
+                conn, output_file, collection_names, where, params
+            )
+        else:
+            filters = {
+                "collections": list(collections) if collections else None,
+                "from_seq": from_seq,
+                "to_seq": to_seq,
+                "since": format_timestamp(since) if since else None,
+                "until": format_timestamp(until) if until else None,
+            }
+            exported_rows = _export_wal_jsonl(
+                conn,
+                output_file,
+                where,
+                params,
+                checkpoint_file,
+                filters,
+                compression=compression or ExportCompression.NONE,
+            )
 
     console.print(f"[green]Exported {exported_rows} rows[/green]")
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
 
 
 def command(
     persist_dir: str = typer.Argument(..., help="The persist directory"),
-    out: str = typer.Option(None, "--out", "-o", help="The output jsonl file"),
+    out: str = typer.Option(
+        None,
+        "--out",
+        "-o",
+        help="The output jsonl file, or the output directory for the npy format",
+    ),
     yes: Optional[bool] = typer.Option(False, "--yes", "-y", help="Skip confirmation"),
+    format: ExportFormat = typer.Option(
+        ExportFormat.JSONL,
+        "--format",
+        "-f",
+        help="Output format, jsonl or npy (a float32 matrix per collection with a jsonl sidecar)",
+    ),
+    collections: Optional[List[str]] = typer.Option(
+        None,
+        "--collection",
+        "-c",
+        help="Export only the WAL of this collection, can be repeated",
+    ),
+    from_seq: Optional[int] = typer.Option(
+        None, "--from-seq", help="Export WAL entries with a seq id of at least this"
+    ),
+    to_seq: Optional[int] = typer.Option(
+        None, "--to-seq", help="Export WAL entries with a seq id of at most this"
+    ),
+    since: Optional[datetime] = typer.Option(
+        None, "--since", help="Export WAL entries created at or after this time (UTC)"
+    ),
+    until: Optional[datetime] = typer.Option(
+        None, "--until", help="Export WAL entries created before this time (UTC)"
+    ),
+    checkpoint: Optional[str] = typer.Option(
+        None,
+        "--checkpoint",
+        help="Checkpoint file to resume an interrupted jsonl export from",
+    ),
+    shards: int = typer.Option(
+        1,
+        "--shards",
+        help="Write the jsonl export as this many shards in parallel, out.00000.jsonl and so on, with a manifest",
+    ),
+    compression: Optional[ExportCompression] = typer.Option(
+        None,
+        "--compression",
+        help="Compress the jsonl output with gzip or zstd. Defaults to the --out extension, .gz or .zst",
+    ),
 ) -> None:
-    export_wal(persist_dir, out, yes=yes)
+    export_wal(
+        persist_dir,
+        out,
+        yes=yes,
+        format=format,
+        collections=collections,
+        from_seq=from_seq,
+        to_seq=to_seq,
+        since=since,
+        until=until,
+        checkpoint_file=checkpoint,
+        shards=shards,
+        compression=compression,
+    )
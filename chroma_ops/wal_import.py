@@ -0,0 +1,346 @@
+import base64
+import gzip
+import heapq
+import io
+import json
+import os
+import sqlite3
+import time
+from typing import IO, Any, Dict, Iterator, List, Optional, Sequence, Tuple, cast
+
+import numpy as np
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from chroma_ops.compression import Codec, decompress, validate_codec
+from chroma_ops.constants import DEFAULT_TENANT_ID, DEFAULT_TOPIC_NAMESPACE
+from chroma_ops.utils import (
+    VECTOR_DTYPES,
+    SqliteMode,
+    decode_seq_id,
+    get_sqlite_connection,
+    print_chroma_version,
+    validate_chroma_persist_dir,
+)
+from chroma_ops.wal_export import COMPRESSION_EXTENSIONS, ExportCompression
+
+# seq_id, created_at, operation, topic, id, vector, encoding, metadata
+WalEntry = Tuple[int, str, int, str, str, Optional[bytes], Optional[str], Optional[str]]
+
+
+def _open_input(path: str) -> IO[bytes]:
+    compression = COMPRESSION_EXTENSIONS.get(
+        os.path.splitext(path)[1], ExportCompression.NONE
+    )
+    if compression == ExportCompression.GZIP:
+        return cast(IO[bytes], gzip.open(path, "rb"))
+    if compression == ExportCompression.ZSTD:
+        validate_codec(Codec.ZSTD)
+        import zstandard
+
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        )
+    return open(path, "rb")
+
+
+def _read_jsonl(path: str) -> Iterator[WalEntry]:
+    with _open_input(path) as f:
+        for line in f:
+            row = json.loads(line)
+            vector = row.get("vector")
+            yield (
+                row["seq_id"],
+                row["created_at"],
+                row["operation"],
+                row["topic"],
+                row["id"],
+                base64.b64decode(vector) if vector is not None else None,
+                row.get("encoding"),
+                row.get("metadata"),
+            )
+
+
+def _read_npy_topic(export_dir: str, topic: Dict[str, Any]) -> Iterator[WalEntry]:
+    matrix = np.load(os.path.join(export_dir, topic["vectors_file"]), mmap_mode="r")
+    with open(os.path.join(export_dir, topic["entries_file"])) as f:
+        for line in f:
+            row = json.loads(line)
+            vector = None
+            if row["vector_row"] is not None:
+                dtype = "<i4" if row["encoding"] == "INT32" else "<f4"
+                vector = matrix[row["vector_row"]].astype(dtype).tobytes()
+            yield (
+                row["seq_id"],
+                row["created_at"],
+                row["operation"],
+                row["topic"],
+                row["id"],
+                vector,
+                row["encoding"],
+                row["metadata"],
+            )
+
+
+def _read_archive(path: str) -> Iterator[WalEntry]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        for (
+            seq_id,
+            created_at,
+            operation,
+            topic,
+            _id,
+            vector,
+            encoding,
+            metadata,
+            codec,
+        ) in conn.execute(
+            "SELECT seq_id, created_at, operation, topic, id, vector, encoding, metadata, codec FROM embeddings_queue ORDER BY seq_id"
+        ):
+            yield (
+                seq_id,
+                created_at,
+                operation,
+                topic,
+                _id,
+                decompress(vector, Codec(codec)) if vector is not None else None,
+                encoding,
+                metadata,
+            )
+    finally:
+        conn.close()
+
+
+def read_wal_export(path: str) -> Iterator[WalEntry]:
+    """Read the WAL entries of an export in seq id order.
+
+    Accepts a jsonl file (optionally .gz or .zst), the manifest of a sharded export, the
+    directory of an npy export or a `wal archive` file.
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        # every topic file is in seq id order, merge them back into one stream
+        yield from heapq.merge(
+            *(_read_npy_topic(path, topic) for topic in manifest["topics"]),
+            key=lambda entry: entry[0],
+        )
+    elif path.endswith(".sqlite3"):
+        yield from _read_archive(path)
+    elif path.endswith(".manifest.json"):
+        with open(path) as f:
+            manifest = json.load(f)
+        # shards are contiguous seq id ranges
+        for shard in sorted(manifest["shards"], key=lambda s: s["first_seq_id"]):
+            yield from _read_jsonl(os.path.join(os.path.dirname(path), shard["file"]))
+    else:
+        yield from _read_jsonl(path)
+
+
+def _peek_topics(path: str) -> Optional[List[str]]:
+    """List the topics of an export without reading its entries.
+
+    npy and sharded exports list them in their manifest, archives are queried. Returns None for
+    plain jsonl (and shards written before the manifest had topics), their topics are only known
+    once read.
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, "manifest.json")) as f:
+            return [topic["topic"] for topic in json.load(f)["topics"]]
+    if path.endswith(".sqlite3"):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return [
+                row[0]
+                for row in conn.execute(
+                    "SELECT DISTINCT topic FROM embeddings_queue ORDER BY topic"
+                )
+            ]
+        finally:
+            conn.close()
+    if path.endswith(".manifest.json"):
+        with open(path) as f:
+            topics = json.load(f).get("topics")
+        return list(topics) if topics is not None else None
+    return None
+
+
+def _parse_mappings(mappings: Optional[Sequence[str]]) -> Dict[str, str]:
+    result = {}
+    for mapping in mappings or []:
+        source, sep, target = mapping.partition("=")
+        if not sep or not source or not target:
+            raise ValueError(
+                f"Invalid mapping {mapping}, expected <source collection id>=<target collection>"
+            )
+        result[source] = target
+    return result
+
+
+def import_wal(
+    persist_dir: str,
+    input_path: str,
+    *,
+    mappings: Optional[Sequence[str]] = None,
+    tenant: Optional[str] = DEFAULT_TENANT_ID,
+    topic_namespace: Optional[str] = DEFAULT_TOPIC_NAMESPACE,
+    yes: Optional[bool] = False,
+) -> int:
+    """Bulk load an exported WAL into the embeddings queue of a persist dir.
+
+    The source topics are remapped to the target collections, by default the collection with the
+    same id. Topics listed by the export are mapped up front, those of plain jsonl as they are
+    first read. Entries get new seq ids after everything already in the target, in their original
+    order, so Chroma applies them as pending writes. A target collection that has never been
+    written to gets its dimension from the imported vectors, Chroma does not replay the WAL of a
+    collection without one. Everything is inserted in one transaction.
+    """
+    validate_chroma_persist_dir(persist_dir)
+    if not os.path.exists(input_path):
+        raise ValueError(f"WAL export {input_path} does not exist")
+    console = Console()
+    print_chroma_version(console)
+    collection_mappings = _parse_mappings(mappings)
+    with get_sqlite_connection(persist_dir, SqliteMode.READ_WRITE) as conn:
+        collections = conn.execute(
+            "SELECT id, name, dimension FROM collections"
+        ).fetchall()
+        by_name = {name: _id for _id, name, _ in collections}
+        names = {_id: name for _id, name, _ in collections}
+        dimensions: Dict[str, Optional[int]] = {
+            _id: dimension for _id, _, dimension in collections
+        }
+        topic_map: Dict[str, Tuple[str, str]] = {}
+        table = Table(title="WAL Import")
+        table.add_column("Source Topic", style="cyan")
+        table.add_column("Target Collection", style="magenta")
+
+        def _map_topic(topic: str) -> Tuple[str, str]:
+            source_id = topic.rsplit("/", 1)[-1]
+            target = collection_mappings.get(source_id, source_id)
+            target_id = target if target in names else by_name.get(target)
+            if target_id is None:
+                raise ValueError(
+                    f"No target collection for {topic}, create it or map it with --map {source_id}=<collection>"
+                )
+            topic_map[topic] = (
+                target_id,
+                f"persistent://{tenant}/{topic_namespace}/{target_id}",
+            )
+            table.add_row(topic, names[target_id])
+            return topic_map[topic]
+
+        topics = _peek_topics(input_path)
+        if topics is not None:
+            for topic in topics:
+                _map_topic(topic)
+            console.print(table)
+        else:
+            console.print(
+                "[yellow]The topics of a jsonl export are mapped as they are read[/yellow]"
+            )
+        if not yes:
+            if not typer.confirm(
+                f"\nAre you sure you want to import the WAL into {persist_dir}? Stop Chroma before importing.",
+                default=False,
+                show_default=True,
+            ):
+                console.print("[yellow]WAL import cancelled by user[/yellow]")
+                return 0
+        # new entries must sort after everything the segments have already consumed
+        max_seq_ids = [
+            decode_seq_id(row[0])
+            for row in conn.execute(
+                "SELECT seq_id FROM max_seq_id UNION ALL SELECT MAX(seq_id) FROM embeddings_queue"
+            ).fetchall()
+            if row[0] is not None
+        ]
+        next_seq_id = max(max_seq_ids, default=0) + 1
+        new_dimensions: Dict[str, int] = {}
+
+        def _entries() -> Iterator[Tuple[Any, ...]]:
+            for i, entry in enumerate(read_wal_export(input_path)):
+                (
+                    seq_id,
+                    created_at,
+                    operation,
+                    topic,
+                    _id,
+                    vector,
+                    encoding,
+                    metadata,
+                ) = entry
+                if topic in topic_map:
+                    target_id, target_topic = topic_map[topic]
+                elif topics is None:
+                    target_id, target_topic = _map_topic(topic)
+                else:
+                    raise ValueError(f"Unexpected topic {topic} in the WAL export")
+                if vector is not None:
+                    dtype = VECTOR_DTYPES.get(encoding or "FLOAT32")
+                    if dtype is None:
+                        raise ValueError(
+                            f"Vector of {_id} (seq id {seq_id}) has an unsupported encoding {encoding}"
+                        )
+                    vector_dimension = len(vector) // dtype.itemsize
+                    dimension = dimensions[target_id]
+                    if dimension is None:
+                        dimensions[target_id] = new_dimensions[
+                            target_id
+                        ] = vector_dimension
+                    elif vector_dimension != dimension:
+                        raise ValueError(
+                            f"Vector of {_id} (seq id {seq_id}) has {vector_dimension} dimensions, the target collection has {dimension}"
+                        )
+                yield (
+                    next_seq_id + i,
+                    created_at,
+                    operation,
+                    target_topic,
+                    _id,
+                    vector,
+                    encoding,
+                    metadata,
+                )
+
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            imported_rows = conn.executemany(
+                "INSERT INTO embeddings_queue (seq_id, created_at, operation, topic, id, vector, encoding, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                _entries(),
+            ).rowcount
+            conn.executemany(
+                "UPDATE collections SET dimension = ? WHERE id = ? AND dimension IS NULL",
+                [(dimension, _id) for _id, dimension in new_dimensions.items()],
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        elapsed = time.perf_counter() - start
+    if topics is None:
+        console.print(table)
+    console.print(
+        f"[green]Imported {imported_rows:,} WAL entries in {elapsed:.2f}s ({imported_rows / max(elapsed, 1e-9):,.0f} rows/s)[/green]"
+    )
+    return imported_rows
+
+
+def command(
+    persist_dir: str = typer.Argument(..., help="The persist directory"),
+    input_path: str = typer.Argument(
+        ...,
+        help="The WAL export, a jsonl file (.gz/.zst), a sharded export manifest, an npy export directory or a WAL archive file",
+    ),
+    mappings: Optional[List[str]] = typer.Option(
+        None,
+        "--map",
+        "-m",
+        help="Import the WAL of a source collection id into a target collection (name or id), <source id>=<target>. Can be repeated",
+    ),
+    yes: Optional[bool] = typer.Option(False, "--yes", "-y", help="Skip confirmation"),
+) -> None:
+    import_wal(persist_dir, input_path, mappings=mappings, yes=yes)
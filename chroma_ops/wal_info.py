@@ -1,29 +1,109 @@
-from typing import List, Tuple
+import os
+import sqlite3
+from typing import List, Optional, Tuple
 import typer
-import chromadb
 from chroma_ops.constants import DEFAULT_TENANT_ID, DEFAULT_TOPIC_NAMESPACE
 from chroma_ops.utils import (
+    get_segment_max_seq_id,
+    PersistentData,
     SqliteMode,
+    decode_seq_id,
     get_sqlite_connection,
-    list_collections,
     print_chroma_version,
+    sizeof_fmt,
     validate_chroma_persist_dir,
+    WAL_ENTRY_BYTES,
 )
 from rich.console import Console
 from rich.table import Table
 import json
 
+# collection name, topic, entries, bytes, oldest and newest created_at and the entries above the
+# max seq id of the vector and the metadata segment
+WalInfo = Tuple[str, str, int, int, str, str, int, int]
 
-def info_wal(persist_dir: str) -> List[Tuple[str, str, int]]:
+
+def _load_topics(
+    conn: sqlite3.Connection, persist_dir: str, tenant: str, topic_namespace: str
+) -> None:
+    """Map topics to collections and their segments' max seq ids in a temp table.
+
+    A single join over collections, segments and max_seq_id, without starting a client.
+    """
+    conn.execute(
+        "CREATE TEMP TABLE wal_info_topics (topic TEXT PRIMARY KEY, name TEXT NOT NULL, vector_max_seq_id INTEGER NOT NULL, metadata_max_seq_id INTEGER NOT NULL) WITHOUT ROWID"
+    )
+    topics = []
+    for (
+        collection_id,
+        name,
+        vector_segment_id,
+        vector_max_seq_id,
+        metadata_max_seq_id,
+    ) in conn.execute(
+        """
+        SELECT
+            c.id,
+            c.name,
+            MAX(CASE WHEN s.scope = 'VECTOR' THEN s.id END),
+            MAX(CASE WHEN s.scope = 'VECTOR' THEN m.seq_id END),
+            MAX(CASE WHEN s.scope = 'METADATA' THEN m.seq_id END)
+        FROM collections c
+        LEFT JOIN segments s ON s.collection = c.id
+        LEFT JOIN max_seq_id m ON m.segment_id = s.id
+        GROUP BY c.id, c.name
+        """
+    ).fetchall():
+        if vector_max_seq_id is None and vector_segment_id is not None:
+            # Chroma < 0.5.7 keeps the max seq id of the vector segment in the pickle
+            metadata_file = os.path.join(
+                persist_dir, vector_segment_id, "index_metadata.pickle"
+            )
+            if os.path.exists(metadata_file):
+                vector_max_seq_id, _ = get_segment_max_seq_id(
+                    conn,
+                    vector_segment_id,
+                    PersistentData.load_from_file(metadata_file),
+                )
+        topics.append(
+            (
+                f"persistent://{tenant}/{topic_namespace}/{collection_id}",
+                name,
+                decode_seq_id(vector_max_seq_id or 0),
+                decode_seq_id(metadata_max_seq_id or 0),
+            )
+        )
+    conn.executemany(
+        "INSERT OR REPLACE INTO temp.wal_info_topics (topic, name, vector_max_seq_id, metadata_max_seq_id) VALUES (?, ?, ?, ?)",
+        topics,
+    )
+    # only the temp table has been written to, this does not touch the database
+    conn.commit()
+
+
+def info_wal(
+    persist_dir: str,
+    tenant: str = DEFAULT_TENANT_ID,
+    topic_namespace: str = DEFAULT_TOPIC_NAMESPACE,
+    sizes: bool = True,
+) -> List[WalInfo]:
+    """Report the WAL of each topic: entries, bytes, age and the gap to its segments.
+
+    Counts, bytes and gaps come from one grouped scan of the queue, the stored value lengths are
+    read from the record headers so the vectors are not loaded. created_at grows with seq_id, so
+    the oldest and newest entries are primary key lookups of the first and last seq id rather
+    than part of the scan. Topics of deleted collections are reported without a name.
+
+    Without `sizes` the scan only reads the columns stored before the vector, so rows whose
+    vectors spill to overflow pages are counted from their first page, and the size is 0. An
+    empty queue is detected with a primary key lookup and not scanned at all.
+    """
     validate_chroma_persist_dir(persist_dir)
     console = Console()
     print_chroma_version(console)
     with get_sqlite_connection(persist_dir, SqliteMode.READ_ONLY) as conn:
-        client = chromadb.PersistentClient(path=persist_dir)
         cursor = conn.cursor()
-        all_collections = list_collections(client)
-        collection_topics = {}
-        stats = []
+        stats: List[WalInfo] = []
         current_config = cursor.execute(
             """SELECT config_json_str FROM embeddings_queue_config"""
         ).fetchone()
@@ -37,24 +117,101 @@ def info_wal(persist_dir: str) -> List[Tuple[str, str, int]]:
             console.print(
                 "[yellow]WAL config is set to: [bold red]not auto purge[/bold red].[/yellow]"
             )
-        for col in all_collections:
-            collection_topics[
-                f"persistent://{DEFAULT_TENANT_ID}/{DEFAULT_TOPIC_NAMESPACE}/{col.id}"
-            ] = col.name
-        query = "SELECT topic, COUNT(*) FROM embeddings_queue GROUP BY topic ORDER BY seq_id ASC;"
-        res = cursor.execute(query).fetchall()
+        _load_topics(conn, persist_dir, tenant, topic_namespace)
+        if sizes:
+            # the same byte count as the wal clean estimate
+            size_column = f"SUM({WAL_ENTRY_BYTES})"
+        else:
+            size_column = "0"
+        query = f"""
+        SELECT
+            q.topic,
+            COALESCE(t.name, '-'),
+            COUNT(*),
+            {size_column},
+            MIN(q.seq_id),
+            MAX(q.seq_id),
+            SUM(q.seq_id > COALESCE(t.vector_max_seq_id, 0)),
+            SUM(q.seq_id > COALESCE(t.metadata_max_seq_id, 0))
+        FROM embeddings_queue q
+        LEFT JOIN temp.wal_info_topics t ON t.topic = q.topic
+        GROUP BY q.topic
+        ORDER BY MIN(q.seq_id) ASC;
+        """
+        if cursor.execute("SELECT MAX(seq_id) FROM embeddings_queue").fetchone()[0]:
+            res = cursor.execute(query).fetchall()
+        else:
+            res = []
         table = Table(title="WAL Info")
         table.add_column("Collection")
         table.add_column("Topic")
         table.add_column("Count")
-        for row in res:
-            table.add_row(collection_topics[str(row[0])], str(row[0]), str(row[1]))
-            stats.append((collection_topics[str(row[0])], str(row[0]), row[1]))
+        table.add_column("Size")
+        table.add_column("Oldest")
+        table.add_column("Newest")
+        table.add_column("Vector Gap")
+        table.add_column("Metadata Gap")
+
+        def created_at(seq_id: int) -> Optional[str]:
+            row = cursor.execute(
+                "SELECT created_at FROM embeddings_queue WHERE seq_id = ?", (seq_id,)
+            ).fetchone()
+            return str(row[0]) if row else None
+
+        for (
+            topic,
+            name,
+            count,
+            size,
+            first_seq_id,
+            last_seq_id,
+            vector_gap,
+            metadata_gap,
+        ) in res:
+            oldest = created_at(first_seq_id) or "-"
+            newest = created_at(last_seq_id) or "-"
+            table.add_row(
+                name,
+                topic,
+                str(count),
+                sizeof_fmt(size or 0) if sizes else "-",
+                oldest,
+                newest,
+                str(vector_gap),
+                str(metadata_gap),
+            )
+            stats.append(
+                (
+                    name,
+                    topic,
+                    count,
+                    size or 0,
+                    oldest,
+                    newest,
+                    vector_gap,
+                    metadata_gap,
+                )
+            )
         console.print(table)
         return stats
 
 
 def command(
     persist_dir: str = typer.Argument(..., help="The persist directory"),
+    tenant: str = typer.Option(
+        DEFAULT_TENANT_ID,
+        "--tenant",
+        help="The tenant of the collections, used to map topics to collections",
+    ),
+    topic_namespace: str = typer.Option(
+        DEFAULT_TOPIC_NAMESPACE,
+        "--topic-namespace",
+        help="The topic namespace of the collections, used to map topics to collections",
+    ),
+    sizes: bool = typer.Option(
+        True,
+        "--sizes/--no-sizes",
+        help="Sum the size of the WAL entries. Skipping it avoids reading the vectors and metadata of large WALs.",
+    ),
 ) -> None:
-    info_wal(persist_dir)
+    info_wal(persist_dir, tenant=tenant, topic_namespace=topic_namespace, sizes=sizes)
@@ -0,0 +1,333 @@
+import math
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TypedDict
+
+import hnswlib
+import numpy as np
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from chroma_ops.constants import (
+    DEFAULT_REPLAY_BENCHMARK_SIZE,
+    DEFAULT_TENANT_ID,
+    DEFAULT_TOPIC_NAMESPACE,
+)
+from chroma_ops.hnsw import get_hnsw_details, HnswDetails
+from chroma_ops.utils import (
+    get_segment_max_seq_id,
+    PersistentData,
+    SqliteMode,
+    decode_seq_id,
+    decode_vectors,
+    VECTOR_DTYPES,
+    get_sqlite_connection,
+    print_chroma_version,
+    sizeof_fmt,
+    validate_chroma_persist_dir,
+)
+from chroma_ops.wal_apply import WalOperation
+
+
+class ReplayEstimate(TypedDict):
+    vector_max_seq_id: int
+    vector_gap: int
+    metadata_max_seq_id: int
+    metadata_gap: int
+    operations: Dict[str, int]
+    vector_bytes: int
+    estimated_seconds: float
+
+
+class ReplayBenchmark(TypedDict):
+    sample_size: int
+    dimensions: int
+    reads_per_second: float
+    adds_per_second: float
+    deletes_per_second: float
+
+
+def _get_gap(
+    conn: sqlite3.Connection,
+    topic: str,
+    vector_max_seq_id: int,
+    metadata_max_seq_id: int,
+) -> Tuple[Dict[WalOperation, Tuple[int, int, int]], int, int]:
+    """The WAL entries above the vector segment's max seq id as (entries, entries with a vector,
+    vector bytes) per operation, the total number of those entries and the number of entries above
+    the metadata segment's max seq id, read in a single pass over the topic."""
+    gap: Dict[WalOperation, Tuple[int, int, int]] = {}
+    metadata_gap = 0
+    # LENGTH of a BLOB is its size in bytes
+    for operation, count, vectors, size, metadata_count in conn.execute(
+        """
+        SELECT
+            operation,
+            SUM(seq_id > ?1),
+            SUM(seq_id > ?1 AND vector IS NOT NULL),
+            SUM(CASE WHEN seq_id > ?1 THEN LENGTH(vector) END),
+            SUM(seq_id > ?2)
+        FROM embeddings_queue
+        WHERE topic = ?3 AND seq_id > MIN(?1, ?2)
+        GROUP BY operation
+        """,
+        (vector_max_seq_id, metadata_max_seq_id, topic),
+    ).fetchall():
+        if count:
+            gap[WalOperation(operation)] = (count, vectors, size or 0)
+        metadata_gap += metadata_count
+    return gap, sum(count for count, _, _ in gap.values()), metadata_gap
+
+
+def _benchmark(
+    conn: sqlite3.Connection,
+    details: HnswDetails,
+    topic: str,
+    max_seq_id: int,
+    sample_size: int,
+) -> Optional[ReplayBenchmark]:
+    """Measure how fast this machine reads the WAL and applies it with hnswlib.
+
+    The first `sample_size` entries of the gap are read and their vectors added to a scratch index
+    with the collection's HNSW settings, in batches of its batch size, then marked deleted.
+    Random vectors stand in when the gap holds none. Collections without a dimension take it
+    from the first vector of the gap.
+    """
+    start = time.perf_counter()
+    rows = conn.execute(
+        "SELECT vector, encoding FROM embeddings_queue WHERE topic = ? AND seq_id > ? ORDER BY seq_id LIMIT ?",
+        (topic, max_seq_id, sample_size),
+    ).fetchall()
+    read_elapsed = time.perf_counter() - start
+    vectors = [(vector, encoding or "FLOAT32") for vector, encoding in rows if vector]
+    dimensions = details["dimensions"]
+    if not dimensions and vectors:
+        vector, encoding = vectors[0]
+        dtype = VECTOR_DTYPES.get(encoding)
+        if dtype is None:
+            raise ValueError(f"Unsupported vector encoding {encoding}")
+        dimensions = len(vector) // dtype.itemsize
+    if not dimensions:
+        return None
+    if vectors:
+        sample = decode_vectors(
+            [vector for vector, _ in vectors],
+            [encoding for _, encoding in vectors],
+            dimensions,
+        )
+    else:
+        sample = np.random.uniform(-1, 1, (sample_size, dimensions)).astype(np.float32)
+    labels = np.arange(1, len(sample) + 1, dtype=np.uint64)
+    index = hnswlib.Index(space=details["space"], dim=dimensions)
+    index.init_index(
+        max_elements=len(sample),
+        ef_construction=details["construction_ef"],
+        M=details["m"],
+    )
+    index.set_num_threads(details["num_threads"])
+    batch_size = details["batch_size"]
+    start = time.perf_counter()
+    for i in range(0, len(sample), batch_size):
+        index.add_items(
+            sample[i : i + batch_size],
+            labels[i : i + batch_size],
+            num_threads=details["num_threads"],
+        )
+    add_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    for label in labels:
+        index.mark_deleted(int(label))
+    delete_elapsed = time.perf_counter() - start
+    return {
+        "sample_size": len(sample),
+        "dimensions": dimensions,
+        "reads_per_second": len(rows) / max(read_elapsed, 1e-9),
+        "adds_per_second": len(sample) / max(add_elapsed, 1e-9),
+        "deletes_per_second": len(sample) / max(delete_elapsed, 1e-9),
+    }
+
+
+def _estimate_seconds(
+    gap: Dict[WalOperation, Tuple[int, int, int]],
+    entries: int,
+    index_size: int,
+    benchmark: ReplayBenchmark,
+) -> float:
+    """Turn a gap into a replay time using the benchmarked rates.
+
+    HNSW inserts cost about log(n) in the size of the index, the add rate of the small scratch
+    index is scaled down to the size the segment has half way through the replay.
+    """
+    vector_ops = sum(
+        vectors
+        for operation, (_, vectors, _) in gap.items()
+        if operation != WalOperation.DELETE
+    )
+    deletes = gap.get(WalOperation.DELETE, (0, 0, 0))[0]
+    scale = max(
+        1.0,
+        math.log(max(index_size + vector_ops / 2, 2))
+        / math.log(max(benchmark["sample_size"], 2)),
+    )
+    return (
+        entries / benchmark["reads_per_second"]
+        + vector_ops * scale / benchmark["adds_per_second"]
+        + deletes / benchmark["deletes_per_second"]
+    )
+
+
+def estimate_wal_replay(
+    persist_dir: str,
+    *,
+    collections: Optional[Sequence[str]] = None,
+    tenant: Optional[str] = DEFAULT_TENANT_ID,
+    topic_namespace: Optional[str] = DEFAULT_TOPIC_NAMESPACE,
+    sample_size: int = DEFAULT_REPLAY_BENCHMARK_SIZE,
+) -> Dict[str, ReplayEstimate]:
+    """Estimate how long Chroma will take to replay the WAL of each collection on startup.
+
+    The gap of a segment is the WAL entries above its max seq id. The vector segment's gap is
+    turned into a time with the read, hnswlib add and delete throughput measured on this machine,
+    see `_benchmark`. The metadata segment is normally up to date, its gap is reported but not
+    timed. Nothing is written to the persist dir.
+    """
+    if sample_size <= 0:
+        raise ValueError("Benchmark sample size must be a positive number")
+    validate_chroma_persist_dir(persist_dir)
+    console = Console()
+    print_chroma_version(console)
+    estimates: Dict[str, ReplayEstimate] = {}
+    with get_sqlite_connection(persist_dir, SqliteMode.READ_ONLY) as conn:
+        names = [
+            row[0] for row in conn.execute("SELECT name FROM collections ORDER BY name")
+        ]
+        if collections:
+            missing = [name for name in collections if name not in names]
+            if missing:
+                raise ValueError(f"Collections {', '.join(missing)} do not exist")
+            names = list(dict.fromkeys(collections))
+        table = Table(title="WAL Replay Estimate")
+        table.add_column("Collection", style="cyan")
+        table.add_column("Segment", style="cyan")
+        table.add_column("Max Seq ID", style="magenta")
+        table.add_column("Gap", style="magenta")
+        table.add_column("Operations", style="magenta")
+        table.add_column("Vector Bytes", style="magenta")
+        table.add_column("Estimated Replay", style="green")
+        benchmarks = Table(title="Replay Benchmark")
+        benchmarks.add_column("Collection", style="cyan")
+        benchmarks.add_column("Sample", style="magenta")
+        benchmarks.add_column("Dimensions", style="magenta")
+        benchmarks.add_column("Threads", style="magenta")
+        benchmarks.add_column("Reads/s", style="green")
+        benchmarks.add_column("Adds/s", style="green")
+        benchmarks.add_column("Deletes/s", style="green")
+        for name in names:
+            # the pickle is loaded once here instead of by get_hnsw_details as well
+            details = get_hnsw_details(conn, persist_dir, name, load_metadata=False)
+            topic = (
+                f"persistent://{tenant}/{topic_namespace}/{details['collection_id']}"
+            )
+            metadata_file = os.path.join(details["path"], "index_metadata.pickle")
+            metadata: Any = (
+                PersistentData.load_from_file(metadata_file)
+                if details["has_metadata"]
+                else None
+            )
+            vector_max_seq_id, _ = get_segment_max_seq_id(
+                conn, details["segment_id"], metadata
+            )
+            total_elements_added = (
+                0
+                if metadata is None
+                else (
+                    metadata["total_elements_added"]
+                    if isinstance(metadata, dict)
+                    else metadata.total_elements_added
+                )
+            )
+            row = conn.execute(
+                "SELECT m.seq_id FROM segments s JOIN max_seq_id m ON m.segment_id = s.id WHERE s.collection = ? AND s.scope = 'METADATA'",
+                (details["collection_id"],),
+            ).fetchone()
+            metadata_max_seq_id = decode_seq_id(row[0]) if row else 0
+            gap, vector_gap, metadata_gap = _get_gap(
+                conn, topic, vector_max_seq_id, metadata_max_seq_id
+            )
+            estimated_seconds = 0.0
+            if vector_gap:
+                benchmark = _benchmark(
+                    conn, details, topic, vector_max_seq_id, sample_size
+                )
+                if benchmark is not None:
+                    estimated_seconds = _estimate_seconds(
+                        gap, vector_gap, total_elements_added, benchmark
+                    )
+                    benchmarks.add_row(
+                        name,
+                        f"{benchmark['sample_size']:,}",
+                        str(benchmark["dimensions"]),
+                        str(details["num_threads"]),
+                        f"{benchmark['reads_per_second']:,.0f}",
+                        f"{benchmark['adds_per_second']:,.0f}",
+                        f"{benchmark['deletes_per_second']:,.0f}",
+                    )
+            operations = {
+                operation.name.lower(): count
+                for operation, (count, _, _) in sorted(gap.items())
+            }
+            vector_bytes = sum(size for _, _, size in gap.values())
+            estimates[name] = {
+                "vector_max_seq_id": vector_max_seq_id,
+                "vector_gap": vector_gap,
+                "metadata_max_seq_id": metadata_max_seq_id,
+                "metadata_gap": metadata_gap,
+                "operations": operations,
+                "vector_bytes": vector_bytes,
+                "estimated_seconds": estimated_seconds,
+            }
+            table.add_row(
+                name,
+                "Vector",
+                f"{vector_max_seq_id:,}",
+                f"{vector_gap:,}",
+                ", ".join(f"{count:,} {op}" for op, count in operations.items()) or "-",
+                sizeof_fmt(vector_bytes),
+                f"{estimated_seconds:.2f}s",
+            )
+            table.add_row(
+                "",
+                "Metadata",
+                f"{metadata_max_seq_id:,}",
+                f"{metadata_gap:,}",
+                "",
+                "",
+                "",
+            )
+    console.print(table)
+    if benchmarks.row_count:
+        console.print(benchmarks)
+    total = sum(estimate["estimated_seconds"] for estimate in estimates.values())
+    console.print(
+        f"[green]Estimated WAL replay time for {len(estimates)} collections: {total:.2f}s[/green]"
+    )
+    return estimates
+
+
+def command(
+    persist_dir: str = typer.Argument(..., help="The persist directory"),
+    collections: Optional[List[str]] = typer.Option(
+        None,
+        "--collection",
+        "-c",
+        help="Estimate the replay of this collection only, can be repeated",
+    ),
+    sample_size: int = typer.Option(
+        DEFAULT_REPLAY_BENCHMARK_SIZE,
+        "--sample-size",
+        help="Number of WAL vectors added to a scratch HNSW index to measure the add throughput",
+    ),
+) -> None:
+    estimate_wal_replay(persist_dir, collections=collections, sample_size=sample_size)
@@ -0,0 +1,91 @@
+"""Compare snapshot codecs on real HNSW segment files.
+
+Usage:
+
+    poetry run python experiments/snapshot_codec_benchmark.py /path/to/persist_dir/<segment_id> [...]
+
+Every file in the given segment dirs is split into snapshot-sized chunks, and each chunk is
+compressed and decompressed with every codec/level combination. Throughput is reported
+against the uncompressed size, single threaded (the snapshot --workers option scales it).
+"""
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+from rich.console import Console
+from rich.table import Table
+
+from chroma_ops.compression import Codec, compress, decompress
+from chroma_ops.constants import DEFAULT_SNAPSHOT_CHUNK_SIZE
+
+CANDIDATES: List[Tuple[Codec, Optional[int]]] = [
+    (Codec.NONE, None),
+    (Codec.ZLIB, 1),
+    (Codec.ZLIB, 6),
+    (Codec.ZLIB, 9),
+    (Codec.LZ4, 0),
+    (Codec.LZ4, 9),
+    (Codec.ZSTD, 1),
+    (Codec.ZSTD, 3),
+    (Codec.ZSTD, 9),
+    (Codec.ZSTD, 19),
+]
+
+
+def _segment_files(segment_dirs: List[str]) -> List[str]:
+    files = []
+    for segment_dir in segment_dirs:
+        for filename in sorted(os.listdir(segment_dir)):
+            filepath = os.path.join(segment_dir, filename)
+            if os.path.isfile(filepath):
+                files.append(filepath)
+    return files
+
+
+def benchmark(segment_dirs: List[str], chunk_size: int) -> None:
+    console = Console()
+    files = _segment_files(segment_dirs)
+    table = Table(title=f"Snapshot codec benchmark ({len(files)} files)")
+    table.add_column("Codec", style="cyan")
+    table.add_column("Level", style="cyan")
+    table.add_column("Ratio", style="magenta")
+    table.add_column("Compress MiB/s", style="green")
+    table.add_column("Decompress MiB/s", style="green")
+    for codec, level in CANDIDATES:
+        try:
+            compress(b"", codec, level)
+        except ImportError:
+            console.print(f"[yellow]Skipping {codec.value}, not installed[/yellow]")
+            continue
+        raw_bytes = 0
+        compressed_bytes = 0
+        compress_time = 0.0
+        decompress_time = 0.0
+        for filepath in files:
+            with open(filepath, "rb") as file:
+                while chunk := file.read(chunk_size):
+                    start = time.perf_counter()
+                    compressed = compress(chunk, codec, level)
+                    compress_time += time.perf_counter() - start
+                    start = time.perf_counter()
+                    decompress(compressed, codec)
+                    decompress_time += time.perf_counter() - start
+                    raw_bytes += len(chunk)
+                    compressed_bytes += len(compressed)
+        mib = raw_bytes / 1024 / 1024
+        table.add_row(
+            codec.value,
+            "-" if level is None else str(level),
+            f"{raw_bytes / max(compressed_bytes, 1):.2f}",
+            f"{mib / max(compress_time, 1e-9):,.1f}",
+            f"{mib / max(decompress_time, 1e-9):,.1f}",
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    benchmark(sys.argv[1:], DEFAULT_SNAPSHOT_CHUNK_SIZE)
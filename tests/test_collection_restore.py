@@ -0,0 +1,237 @@
+import hashlib
+import os
+from pathlib import Path
+import sqlite3
+import tempfile
+from typing import Any, Dict, List, Tuple
+import uuid
+import zlib
+
+import chromadb
+import numpy as np
+import pytest
+
+from chroma_ops.collection_restore import collection_restore
+from chroma_ops.collection_snapshot import collection_snapshot
+from chroma_ops.utils import get_sqlite_connection
+
+
+def make_legacy_snapshot(snapshot_file: Path) -> None:
+    """Rewrite a snapshot into the format used before HNSW segment data was chunked."""
+    conn = sqlite3.connect(snapshot_file)
+    try:
+        files: Dict[Tuple[str, str], bytes] = {}
+        for segment_id, filename, data in conn.execute(
+            "SELECT segment_id, filename, data FROM hnsw_segment_data ORDER BY segment_id, filename, chunk"
+        ).fetchall():
+            files[(segment_id, filename)] = files.get(
+                (segment_id, filename), b""
+            ) + zlib.decompress(data)
+        for table in [
+            "hnsw_segment_data",
+            "hnsw_segment_files",
+            "snapshot_manifest",
+            "snapshot_metadata",
+            "embedding_ids",
+            "embedding_id_segments",
+        ]:
+            conn.execute(f"DROP TABLE {table}")
+        conn.execute(
+            """
+            CREATE TABLE hnsw_segment_data
+            (
+                id         INTEGER primary key autoincrement,
+                segment_id TEXT not null,
+                filename   TEXT not null,
+                data       BLOB not null,
+                sha256     TEXT not null,
+                created_at TIMESTAMP default CURRENT_TIMESTAMP not null,
+                unique (segment_id, filename)
+            )
+            """
+        )
+        conn.executemany(
+            "INSERT INTO hnsw_segment_data (segment_id, filename, data, sha256) VALUES (?, ?, ?, ?)",
+            [
+                (
+                    segment_id,
+                    filename,
+                    zlib.compress(data),
+                    hashlib.sha256(data).hexdigest(),
+                )
+                for (segment_id, filename), data in files.items()
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _assert_restored(
+    restore_dir: str, ids: List[str], embeddings: Any, documents: List[str]
+) -> None:
+    client = chromadb.PersistentClient(path=restore_dir)
+    col = client.get_collection("test_collection")
+    assert col.count() == len(ids)
+    res = col.get(ids=ids[:50], include=["embeddings", "documents"])
+    restored_embeddings = res["embeddings"]
+    restored_documents = res["documents"]
+    assert restored_embeddings is not None and restored_documents is not None
+    by_id = dict(zip(ids, range(len(ids))))
+    for i, _id in enumerate(res["ids"]):
+        assert np.allclose(restored_embeddings[i], embeddings[by_id[_id]])
+        assert restored_documents[i] == documents[by_id[_id]]
+    assert (
+        len(col.get(where_document={"$contains": documents[0]})["ids"]) > 0
+    )  # FTS index is restored
+    query = col.query(query_embeddings=[embeddings[0].tolist()], n_results=1)
+    assert query["ids"][0][0] == ids[0]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_collection_restore(workers: int) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        records_to_add = 1500
+        ids = [str(uuid.uuid4()) for _ in range(records_to_add)]
+        embeddings = np.random.uniform(0, 1, (records_to_add, 384))
+        documents = [f"document {uuid.uuid4()}" for _ in range(records_to_add)]
+        col.add(ids=ids, embeddings=embeddings.tolist(), documents=documents)
+        snapshot_file = Path(temp_dir, "snapshot.sqlite3")
+        collection_snapshot(
+            chroma_dir,
+            ["test_collection"],
+            snapshot_file,
+            yes=True,
+            chunk_size=64 * 1024,
+        )
+        restore_dir = os.path.join(temp_dir, "restored")
+        collection_restore(restore_dir, snapshot_file, yes=True, workers=workers)
+        _assert_restored(restore_dir, ids, embeddings, documents)
+        with pytest.raises(ValueError, match="already exists"):
+            collection_restore(restore_dir, snapshot_file, yes=True)
+
+
+def test_collection_restore_incremental_into_non_empty_db() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        ids = [str(uuid.uuid4()) for _ in range(3000)]
+        embeddings = np.random.uniform(0, 1, (3000, 384))
+        documents = [f"document {uuid.uuid4()}" for _ in range(3000)]
+        col.add(
+            ids=ids[:2000],
+            embeddings=embeddings[:2000].tolist(),
+            documents=documents[:2000],
+        )
+        base_file = Path(temp_dir, "base.sqlite3")
+        collection_snapshot(
+            chroma_dir, ["test_collection"], base_file, yes=True, chunk_size=64 * 1024
+        )
+        col.add(
+            ids=ids[2000:],
+            embeddings=embeddings[2000:].tolist(),
+            documents=documents[2000:],
+        )
+        col.delete(ids=ids[-10:])
+        incremental_file = Path(temp_dir, "incremental.sqlite3")
+        collection_snapshot(
+            chroma_dir, ["test_collection"], incremental_file, yes=True, base=base_file
+        )
+        restore_dir = os.path.join(temp_dir, "restored")
+        other = chromadb.PersistentClient(path=restore_dir).create_collection("other")
+        other.add(
+            ids=[str(i) for i in range(100)],
+            embeddings=np.random.uniform(0, 1, (100, 3)).tolist(),
+            documents=[f"other {i}" for i in range(100)],
+        )
+        collection_restore(restore_dir, incremental_file, yes=True, workers=2)
+        _assert_restored(restore_dir, ids[:-10], embeddings[:-10], documents[:-10])
+        assert other.count() == 100
+
+
+def test_collection_restore_incremental_collection_dropped_from_chain() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        dropped = client.get_or_create_collection("dropped_collection")
+        ids = [str(uuid.uuid4()) for _ in range(1500)]
+        embeddings = np.random.uniform(0, 1, (1500, 384))
+        documents = [f"document {uuid.uuid4()}" for _ in range(1500)]
+        col.add(
+            ids=ids[:1000],
+            embeddings=embeddings[:1000].tolist(),
+            documents=documents[:1000],
+        )
+        dropped.add(
+            ids=[str(i) for i in range(1200)],
+            embeddings=np.random.uniform(0, 1, (1200, 384)).tolist(),
+            documents=[f"dropped {i}" for i in range(1200)],
+        )
+        base_file = Path(temp_dir, "base.sqlite3")
+        collection_snapshot(
+            chroma_dir,
+            ["test_collection", "dropped_collection"],
+            base_file,
+            yes=True,
+            chunk_size=64 * 1024,
+        )
+        client.delete_collection("dropped_collection")
+        col.add(
+            ids=ids[1000:],
+            embeddings=embeddings[1000:].tolist(),
+            documents=documents[1000:],
+        )
+        incremental_file = Path(temp_dir, "incremental.sqlite3")
+        collection_snapshot(
+            chroma_dir, ["test_collection"], incremental_file, yes=True, base=base_file
+        )
+        restore_dir = os.path.join(temp_dir, "restored")
+        collection_restore(restore_dir, incremental_file, yes=True)
+        _assert_restored(restore_dir, ids, embeddings, documents)
+        with get_sqlite_connection(restore_dir) as conn:
+            assert (
+                conn.execute(
+                    "SELECT count(*) FROM embeddings WHERE segment_id NOT IN (SELECT id FROM segments)"
+                ).fetchone()[0]
+                == 0
+            )
+            assert (
+                conn.execute(
+                    "SELECT count(*) FROM embedding_metadata WHERE id NOT IN (SELECT id FROM embeddings)"
+                ).fetchone()[0]
+                == 0
+            )
+            assert (
+                conn.execute(
+                    "SELECT count(*) FROM embeddings_queue WHERE topic NOT LIKE '%' || (SELECT id FROM collections)"
+                ).fetchone()[0]
+                == 0
+            )
+
+
+def test_collection_restore_legacy_snapshot() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        ids = [str(uuid.uuid4()) for _ in range(1500)]
+        embeddings = np.random.uniform(0, 1, (1500, 384))
+        documents = [f"document {uuid.uuid4()}" for _ in range(1500)]
+        col.add(ids=ids, embeddings=embeddings.tolist(), documents=documents)
+        snapshot_file = Path(temp_dir, "snapshot.sqlite3")
+        collection_snapshot(
+            chroma_dir,
+            ["test_collection"],
+            snapshot_file,
+            yes=True,
+            chunk_size=64 * 1024,
+        )
+        make_legacy_snapshot(snapshot_file)
+        restore_dir = os.path.join(temp_dir, "restored")
+        collection_restore(restore_dir, snapshot_file, yes=True, workers=2)
+        _assert_restored(restore_dir, ids, embeddings, documents)
@@ -1,16 +1,27 @@
+import hashlib
 import os
 from pathlib import Path
+import pickle
+import shutil
 import tempfile
 from typing import Any, Dict
 
 import chromadb
 
-from chroma_ops.collection_snapshot import collection_snapshot
+from chroma_ops import collection_snapshot as collection_snapshot_module
+from chroma_ops.collection_snapshot import (
+    _segment_files_agree,
+    collection_snapshot,
+    get_snapshot_chain,
+    get_snapshot_metadata,
+)
+from chroma_ops.compression import Codec, decompress
 from chroma_ops.utils import get_sqlite_snapshot_connection
 
 from hypothesis import given, settings
 import hypothesis.strategies as st
 import numpy as np
+import pytest
 import uuid
 
 
@@ -59,7 +70,7 @@ def test_collection_snapshot(records_to_add: int, metadata: Dict[str, Any]) -> N
         )
         collection_snapshot(
             chroma_dir,
-            "test_collection",
+            ["test_collection"],
             Path(temp_dir, "snapshot", "snapshot.sqlite3"),
             yes=True,
         )
@@ -72,10 +83,14 @@ def test_collection_snapshot(records_to_add: int, metadata: Dict[str, Any]) -> N
             assert cursor.fetchone()[0] == 1
             cursor.execute("SELECT count(*) FROM collection_metadata")
             assert cursor.fetchone()[0] == len(metadata)
-            cursor.execute("SELECT count(*) FROM hnsw_segment_data")
+            cursor.execute("SELECT count(*) FROM hnsw_segment_files")
             assert (
                 cursor.fetchone()[0] == 4 if records_to_add < 1000 else 5
             )  # 5 if pickle metadata is included e.g. if added records > threshold
+            cursor.execute(
+                "SELECT count(*) FROM hnsw_segment_files f WHERE f.chunks <> (SELECT count(*) FROM hnsw_segment_data d WHERE d.segment_id = f.segment_id AND d.filename = f.filename)"
+            )
+            assert cursor.fetchone()[0] == 0
             cursor.execute("SELECT count(*) FROM segments")
             assert cursor.fetchone()[0] == 2
             cursor.execute("SELECT count(*) FROM segment_metadata")
@@ -92,3 +107,320 @@ def test_collection_snapshot(records_to_add: int, metadata: Dict[str, Any]) -> N
             assert (
                 cursor.fetchone()[0] == records_to_add * 2
             )  # 1 for the document and 1 for the metadata
+
+
+@pytest.mark.parametrize(
+    "workers,codec",
+    [
+        (1, Codec.ZLIB),
+        (4, Codec.ZLIB),
+        (4, Codec.ZSTD),
+        (4, Codec.LZ4),
+        (1, Codec.NONE),
+    ],
+)
+def test_collection_snapshot_chunked_files(workers: int, codec: Codec) -> None:
+    if codec == Codec.ZSTD:
+        pytest.importorskip("zstandard")
+    elif codec == Codec.LZ4:
+        pytest.importorskip("lz4")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        os.makedirs(chroma_dir, exist_ok=True)
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        records_to_add = 1500
+        col.add(
+            ids=[str(uuid.uuid4()) for _ in range(records_to_add)],
+            embeddings=np.random.uniform(0, 1, (records_to_add, 384)).tolist(),
+        )
+        snapshot_file = Path(temp_dir, "snapshot", "snapshot.sqlite3")
+        chunk_size = 64 * 1024
+        collection_snapshot(
+            chroma_dir,
+            ["test_collection"],
+            snapshot_file,
+            yes=True,
+            chunk_size=chunk_size,
+            workers=workers,
+            codec=codec,
+        )
+        with get_sqlite_snapshot_connection(
+            snapshot_file.absolute().as_posix()
+        ) as conn:
+            files = conn.execute(
+                "SELECT segment_id, filename, size, chunks, sha256 FROM hnsw_segment_files"
+            ).fetchall()
+            assert len(files) > 0
+            for segment_id, filename, size, chunks, sha256 in files:
+                with open(os.path.join(chroma_dir, segment_id, filename), "rb") as f:
+                    original = f.read()
+                assert size == len(original)
+                assert chunks == max(1, -(-len(original) // chunk_size))
+                file_hash = hashlib.sha256()
+                for chunk_codec, data, chunk_sha256 in conn.execute(
+                    "SELECT codec, data, sha256 FROM hnsw_segment_data WHERE segment_id = ? AND filename = ? ORDER BY chunk",
+                    (segment_id, filename),
+                ):
+                    assert chunk_codec == codec.value
+                    chunk = decompress(data, Codec(chunk_codec))
+                    assert len(chunk) <= chunk_size
+                    assert hashlib.sha256(chunk).hexdigest() == chunk_sha256
+                    file_hash.update(chunk)
+                assert file_hash.hexdigest() == sha256
+                assert sha256 == hashlib.sha256(original).hexdigest()
+
+
+def test_collection_snapshot_incremental() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        os.makedirs(chroma_dir, exist_ok=True)
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        ids = [str(uuid.uuid4()) for _ in range(3000)]
+        col.add(
+            ids=ids[:2000],
+            embeddings=np.random.uniform(0, 1, (2000, 384)).tolist(),
+            metadatas=[{"batch": 1} for _ in range(2000)],
+        )
+        base_file = Path(temp_dir, "snapshot", "base.sqlite3")
+        collection_snapshot(
+            chroma_dir, ["test_collection"], base_file, yes=True, chunk_size=64 * 1024
+        )
+        col.add(
+            ids=ids[2000:],
+            embeddings=np.random.uniform(0, 1, (1000, 384)).tolist(),
+            metadatas=[{"batch": 2} for _ in range(1000)],
+        )
+        col.update(ids=ids[:10], metadatas=[{"batch": 3} for _ in range(10)])
+        col.delete(ids=ids[10:20])
+        incremental_file = Path(temp_dir, "snapshot", "incremental.sqlite3")
+        collection_snapshot(
+            chroma_dir, ["test_collection"], incremental_file, yes=True, base=base_file
+        )
+        with get_sqlite_snapshot_connection(
+            incremental_file.absolute().as_posix()
+        ) as conn:
+            assert get_snapshot_metadata(conn) == {
+                "chunk_size": str(64 * 1024),
+                "base_snapshot": "base.sqlite3",
+            }
+            assert conn.execute("SELECT count(*) FROM embeddings").fetchone()[0] == 1010
+            assert (
+                conn.execute("SELECT count(*) FROM embedding_ids").fetchone()[0] == 2990
+            )
+            assert (
+                conn.execute("SELECT count(*) FROM embedding_id_segments").fetchone()[0]
+                == 1
+            )
+            assert (
+                conn.execute(
+                    "SELECT count(*) FROM hnsw_segment_data WHERE data IS NULL"
+                ).fetchone()[0]
+                > 0
+            )
+            for segment_id, filename, sha256 in conn.execute(
+                "SELECT segment_id, filename, sha256 FROM hnsw_segment_files"
+            ).fetchall():
+                with open(os.path.join(chroma_dir, segment_id, filename), "rb") as f:
+                    assert sha256 == hashlib.sha256(f.read()).hexdigest()
+        assert get_snapshot_chain(incremental_file.as_posix()) == [
+            incremental_file.absolute().as_posix(),
+            base_file.absolute().as_posix(),
+        ]
+        # the chain follows the snapshots when they are moved together
+        moved_dir = Path(temp_dir, "moved")
+        shutil.move(Path(temp_dir, "snapshot").as_posix(), moved_dir.as_posix())
+        assert get_snapshot_chain(
+            Path(moved_dir, "incremental.sqlite3").as_posix()
+        ) == [
+            Path(moved_dir, "incremental.sqlite3").absolute().as_posix(),
+            Path(moved_dir, "base.sqlite3").absolute().as_posix(),
+        ]
+
+
+def test_collection_snapshot_online() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        col.add(
+            ids=[str(uuid.uuid4()) for _ in range(1500)],
+            embeddings=np.random.uniform(0, 1, (1500, 384)).tolist(),
+        )
+        snapshot_dir = Path(temp_dir, "snapshot")
+        os.makedirs(snapshot_dir)
+        snapshot_file = Path(snapshot_dir, "snapshot.sqlite3")
+        collection_snapshot(
+            chroma_dir, ["test_collection"], snapshot_file, yes=True, online=True
+        )
+        assert os.listdir(snapshot_dir) == ["snapshot.sqlite3"]  # staging is removed
+        with get_sqlite_snapshot_connection(
+            snapshot_file.absolute().as_posix()
+        ) as conn:
+            assert conn.execute("SELECT count(*) FROM embeddings").fetchone()[0] == 1500
+            for segment_id, filename, sha256 in conn.execute(
+                "SELECT segment_id, filename, sha256 FROM hnsw_segment_files"
+            ).fetchall():
+                with open(os.path.join(chroma_dir, segment_id, filename), "rb") as f:
+                    assert sha256 == hashlib.sha256(f.read()).hexdigest()
+        col.add(
+            ids=[str(uuid.uuid4()) for _ in range(10)],
+            embeddings=np.random.uniform(0, 1, (10, 384)).tolist(),
+        )  # the database is not left locked
+
+
+def test_collection_snapshot_online_half_persisted(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        col.add(
+            ids=[str(uuid.uuid4()) for _ in range(1500)],
+            embeddings=np.random.uniform(0, 1, (1500, 16)).tolist(),
+        )
+        with get_sqlite_snapshot_connection(
+            os.path.join(chroma_dir, "chroma.sqlite3")
+        ) as conn:
+            segment_id = conn.execute(
+                "SELECT id FROM segments WHERE scope = 'VECTOR'"
+            ).fetchone()[0]
+        assert _segment_files_agree(os.path.join(chroma_dir, segment_id))
+        # the index files of a persist are written, its pickle not yet
+        torn_dir = os.path.join(temp_dir, "torn")
+        shutil.copytree(os.path.join(chroma_dir, segment_id), torn_dir)
+        metadata_file = os.path.join(torn_dir, "index_metadata.pickle")
+        with open(metadata_file, "rb") as f:
+            metadata = pickle.load(f)
+        metadata["total_elements_added"] -= 100
+        with open(metadata_file, "wb") as out:
+            pickle.dump(metadata, out)
+        assert not _segment_files_agree(torn_dir)
+
+        checks = []
+
+        def torn_once(segment_dir: str) -> bool:
+            checks.append(segment_dir)
+            return len(checks) > 1
+
+        snapshot_file = Path(temp_dir, "snapshot", "snapshot.sqlite3")
+        monkeypatch.setattr(
+            collection_snapshot_module, "_segment_files_agree", torn_once
+        )
+        collection_snapshot(
+            chroma_dir, ["test_collection"], snapshot_file, yes=True, online=True
+        )
+        assert len(checks) == 2
+        with get_sqlite_snapshot_connection(
+            snapshot_file.absolute().as_posix()
+        ) as conn:
+            assert conn.execute("SELECT count(*) FROM embeddings").fetchone()[0] == 1500
+
+        monkeypatch.setattr(
+            collection_snapshot_module, "_segment_files_agree", lambda _: False
+        )
+        with pytest.raises(ValueError, match="kept changing"):
+            collection_snapshot(
+                chroma_dir, ["test_collection"], snapshot_file, yes=True, online=True
+            )
+        assert not snapshot_file.exists()
+        assert os.listdir(snapshot_file.parent) == []
+
+
+def test_collection_snapshot_all_collections() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        counts = {"col_a": 10, "col_b": 200, "col_c": 1500}
+        for name, count in counts.items():
+            client.create_collection(name).add(
+                ids=[str(uuid.uuid4()) for _ in range(count)],
+                embeddings=np.random.uniform(0, 1, (count, 16)).tolist(),
+                documents=[f"document {i}" for i in range(count)],
+            )
+        snapshot_file = Path(temp_dir, "snapshot", "snapshot.sqlite3")
+        with pytest.raises(ValueError, match="not found"):
+            collection_snapshot(
+                chroma_dir, ["col_a", "missing"], snapshot_file, yes=True
+            )
+        assert not snapshot_file.exists()  # a failed snapshot is removed
+        with pytest.raises(ValueError, match="cannot be specified together"):
+            collection_snapshot(
+                chroma_dir, ["col_a"], snapshot_file, yes=True, all_collections=True
+            )
+        collection_snapshot(
+            chroma_dir, None, snapshot_file, yes=True, workers=2, all_collections=True
+        )
+        with get_sqlite_snapshot_connection(
+            snapshot_file.absolute().as_posix()
+        ) as conn:
+            manifest = {
+                row[0]: row[1:]
+                for row in conn.execute(
+                    "SELECT collection_name, embeddings, embedding_metadata, hnsw_segment_files FROM snapshot_manifest"
+                ).fetchall()
+            }
+            assert {name: row[0] for name, row in manifest.items()} == counts
+            assert {name: row[1] for name, row in manifest.items()} == counts
+            assert all(row[2] >= 4 for row in manifest.values())
+            assert conn.execute("SELECT count(*) FROM segments").fetchone()[0] == 6
+            assert conn.execute("PRAGMA page_size").fetchone()[0] == 16 * 1024
+            assert {
+                row[0]
+                for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_autoindex%'"
+                ).fetchall()
+            } == {
+                "embeddings_segment_id_embedding_id",
+                "embedding_metadata_float_value",
+                "embedding_metadata_int_value",
+                "embedding_metadata_string_value",
+            }
+            assert conn.execute("SELECT count(*) FROM sqlite_stat1").fetchone()[0] > 0
+        collection_snapshot(
+            chroma_dir, ["col_a", "col_c"], snapshot_file, yes=True, workers=2
+        )
+        with get_sqlite_snapshot_connection(
+            snapshot_file.absolute().as_posix()
+        ) as conn:
+            assert conn.execute(
+                "SELECT collection_name FROM snapshot_manifest ORDER BY collection_name"
+            ).fetchall() == [("col_a",), ("col_c",)]
+            assert conn.execute("SELECT count(*) FROM embeddings").fetchone()[0] == 1510
+        # a single collection name is not split into characters
+        collection_snapshot(chroma_dir, "col_b", snapshot_file, yes=True)
+        with get_sqlite_snapshot_connection(
+            snapshot_file.absolute().as_posix()
+        ) as conn:
+            assert conn.execute(
+                "SELECT collection_name FROM snapshot_manifest"
+            ).fetchall() == [("col_b",)]
+
+
+def test_collection_snapshot_estimate(capsys: pytest.CaptureFixture[str]) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        col.add(
+            ids=[str(uuid.uuid4()) for _ in range(2000)],
+            embeddings=np.random.uniform(0, 1, (2000, 384)).tolist(),
+            metadatas=[{"batch": 1} for _ in range(2000)],
+        )
+        snapshot_file = Path(temp_dir, "snapshot", "snapshot.sqlite3")
+        collection_snapshot(
+            chroma_dir, ["test_collection"], snapshot_file, yes=True, estimate=True
+        )
+        output = capsys.readouterr().out
+        assert "Projected snapshot size" in output
+        assert "~2,000" in output  # one metadata row per embedding
+        with get_sqlite_snapshot_connection(
+            snapshot_file.absolute().as_posix()
+        ) as conn:
+            assert conn.execute("SELECT count(*) FROM embeddings").fetchone()[0] == 2000
+            assert (
+                conn.execute("SELECT count(*) FROM embedding_metadata").fetchone()[0]
+                == 2000
+            )
@@ -0,0 +1,120 @@
+import os
+from pathlib import Path
+import sqlite3
+import tempfile
+import uuid
+import zlib
+
+import chromadb
+import numpy as np
+import pytest
+from typer.testing import CliRunner
+
+from chroma_ops.collection_snapshot import collection_snapshot
+from chroma_ops.collection_verify import collection_verify
+from chroma_ops.main import app
+from tests.test_collection_restore import make_legacy_snapshot
+
+
+def test_collection_verify() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        ids = [str(uuid.uuid4()) for _ in range(2000)]
+        col.add(
+            ids=ids[:1500],
+            embeddings=np.random.uniform(0, 1, (1500, 384)).tolist(),
+        )
+        base_file = Path(temp_dir, "base.sqlite3")
+        collection_snapshot(
+            chroma_dir, ["test_collection"], base_file, yes=True, chunk_size=64 * 1024
+        )
+        col.add(
+            ids=ids[1500:],
+            embeddings=np.random.uniform(0, 1, (500, 384)).tolist(),
+        )
+        incremental_file = Path(temp_dir, "incremental.sqlite3")
+        collection_snapshot(
+            chroma_dir, ["test_collection"], incremental_file, yes=True, base=base_file
+        )
+        assert collection_verify(base_file, workers=4) == []
+        assert collection_verify(incremental_file, workers=4) == []
+
+        # corrupting a chunk of the base is detected through the incremental snapshot's references
+        conn = sqlite3.connect(base_file)
+        segment_id, filename = conn.execute(
+            "SELECT segment_id, filename FROM hnsw_segment_data WHERE chunk = 1"
+        ).fetchone()
+        conn.execute(
+            "UPDATE hnsw_segment_data SET data = ? WHERE segment_id = ? AND filename = ? AND chunk = 1",
+            (zlib.compress(b"corrupted"), segment_id, filename),
+        )
+        conn.execute("UPDATE snapshot_manifest SET embeddings = embeddings + 1")
+        conn.commit()
+        conn.close()
+        errors = collection_verify(base_file, workers=2)
+        assert len(errors) == 2
+        assert any("Manifest mismatch" in error for error in errors)
+        assert any(
+            f"{segment_id}/{filename}" in error and "checksum mismatch" in error
+            for error in errors
+        )
+        if (
+            sqlite3.connect(incremental_file)
+            .execute(
+                "SELECT data IS NULL FROM hnsw_segment_data WHERE segment_id = ? AND filename = ? AND chunk = 1",
+                (segment_id, filename),
+            )
+            .fetchone()[0]
+        ):
+            assert len(collection_verify(incremental_file)) == 1
+
+
+def test_collection_verify_rejects_invalid_workers() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        snapshot_file = Path(temp_dir, "snapshot.sqlite3")
+        with pytest.raises(ValueError, match="positive"):
+            collection_verify(snapshot_file, workers=0)
+        result = CliRunner().invoke(
+            app, ["collection", "verify", snapshot_file.as_posix(), "--workers", "0"]
+        )
+        assert result.exit_code != 0
+        assert isinstance(result.exception, ValueError)
+
+
+def test_collection_verify_legacy_snapshot() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        col.add(
+            ids=[str(uuid.uuid4()) for _ in range(1500)],
+            embeddings=np.random.uniform(0, 1, (1500, 384)).tolist(),
+        )
+        snapshot_file = Path(temp_dir, "snapshot.sqlite3")
+        collection_snapshot(
+            chroma_dir,
+            ["test_collection"],
+            snapshot_file,
+            yes=True,
+            chunk_size=64 * 1024,
+        )
+        make_legacy_snapshot(snapshot_file)
+        assert collection_verify(snapshot_file, workers=2) == []
+
+
+def test_collection_verify_manifest_missing_columns() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chroma_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=chroma_dir)
+        col = client.get_or_create_collection("test_collection")
+        col.add(ids=["1"], embeddings=np.full((1, 3), 0.1, dtype=np.float32))
+        snapshot_file = Path(temp_dir, "snapshot.sqlite3")
+        collection_snapshot(chroma_dir, ["test_collection"], snapshot_file, yes=True)
+        conn = sqlite3.connect(snapshot_file)
+        conn.execute("ALTER TABLE snapshot_manifest DROP COLUMN hnsw_segment_bytes")
+        conn.commit()
+        conn.close()
+        errors = collection_verify(snapshot_file)
+        assert errors == ["Manifest is missing columns hnsw_segment_bytes"]
@@ -22,7 +22,7 @@ from chroma_ops.hnsw import (
     info_hnsw,
     modify_runtime_config,
     rebuild_hnsw,
-    _get_hnsw_details,
+    get_hnsw_details,
 )
 from hypothesis import given, settings
 import hypothesis.strategies as st
@@ -146,7 +146,7 @@ def test_hnsw_rebuild(records_to_add: int, records_to_delete: int) -> None:
         col.add(ids=ids, documents=documents, embeddings=embeddings)
         col.delete(ids=random_ids_to_delete.tolist())
         with sqlite3.connect(sql_file) as conn:
-            details = _get_hnsw_details(conn, temp_dir, "test_collection", verbose=True)
+            details = get_hnsw_details(conn, temp_dir, "test_collection", verbose=True)
         total_elements_before_rebuild = details["total_elements_added"]
         should_have_fragmentation = False
         if (
@@ -173,7 +173,7 @@ def test_hnsw_rebuild(records_to_add: int, records_to_delete: int) -> None:
             yes=True,
         )
         with sqlite3.connect(sql_file) as conn:
-            details = _get_hnsw_details(conn, temp_dir, "test_collection", verbose=True)
+            details = get_hnsw_details(conn, temp_dir, "test_collection", verbose=True)
             total_elements_after_rebuild = details["total_elements_added"]
             if should_have_fragmentation:
                 assert (
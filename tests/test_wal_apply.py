@@ -0,0 +1,211 @@
+import json
+import os
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import uuid
+from typing import Dict
+
+import chromadb
+import numpy as np
+import pytest
+
+from chroma_ops.wal_apply import WalOperation, apply_wal
+
+
+def test_apply_wal() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        col = client.create_collection("test")
+        ids = [str(uuid.uuid4()) for _ in range(2500)]
+        embeddings = np.random.uniform(0, 1, (2500, 16)).astype(np.float32)
+        col.add(ids=ids, embeddings=embeddings.tolist())
+        sql_file = os.path.join(temp_dir, "chroma.sqlite3")
+        conn = sqlite3.connect(sql_file)
+        topic = f"persistent://default/default/{col.id}"
+        vector_segment = conn.execute(
+            "SELECT id FROM segments WHERE scope = 'VECTOR' AND collection = ?",
+            (str(col.id),),
+        ).fetchone()[0]
+        next_seq_id = (
+            conn.execute("SELECT MAX(seq_id) FROM max_seq_id").fetchone()[0] + 1
+        )
+        new_ids = [str(uuid.uuid4()) for _ in range(510)]
+        new_embeddings = np.random.uniform(0, 1, (510, 16)).astype(np.float32)
+        updated = np.random.uniform(0, 1, (50, 16)).astype(np.float32)
+        # pending writes the HNSW segment has not seen yet
+        entries = (
+            [
+                (WalOperation.ADD, _id, v)
+                for _id, v in zip(new_ids[:500], new_embeddings)
+            ]
+            + [(WalOperation.DELETE, _id, None) for _id in ids[:100]]
+            + [(WalOperation.UPDATE, _id, v) for _id, v in zip(ids[100:150], updated)]
+            + [
+                (WalOperation.UPSERT, _id, v)
+                for _id, v in zip(new_ids[500:], new_embeddings[500:])
+            ]
+        )
+        conn.executemany(
+            "INSERT INTO embeddings_queue (seq_id, operation, topic, id, vector, encoding, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    next_seq_id + i,
+                    int(operation),
+                    topic,
+                    _id,
+                    struct.pack("%sf" % 16, *vector) if vector is not None else None,
+                    "FLOAT32" if vector is not None else None,
+                    json.dumps({}) if operation != WalOperation.DELETE else None,
+                )
+                for i, (operation, _id, vector) in enumerate(entries)
+            ],
+        )
+        conn.commit()
+        del client, col
+
+        assert apply_wal(temp_dir, yes=True, num_threads=4, batch_size=128) == {
+            "test": len(entries)
+        }
+        assert (
+            conn.execute(
+                "SELECT seq_id FROM max_seq_id WHERE segment_id = ?", (vector_segment,)
+            ).fetchone()[0]
+            == next_seq_id + len(entries) - 1
+        )
+        assert apply_wal(temp_dir, yes=True) == {}
+        conn.close()
+
+        queries = {
+            "added": new_embeddings[7].tolist(),
+            "upserted": new_embeddings[505].tolist(),
+            "updated": updated[3].tolist(),
+            "deleted": embeddings[5].tolist(),
+        }
+        # a fresh process loads the HNSW segment written by the apply
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                "import json, sys, chromadb\n"
+                f"col = chromadb.PersistentClient(path={temp_dir!r}).get_collection('test')\n"
+                f"queries = json.loads({json.dumps(json.dumps(queries))})\n"
+                "print(json.dumps({'count': col.count(), **{k: col.query(query_embeddings=[v], n_results=1)['ids'][0][0] for k, v in queries.items()}}))\n",
+            ]
+        )
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        assert result["count"] == 2500 + 510 - 100
+        assert result["added"] == new_ids[7]
+        assert result["upserted"] == new_ids[505]
+        assert result["updated"] == ids[103]
+        assert result["deleted"] != ids[5]
+        assert any(
+            name.startswith(f"{vector_segment}_backup_")
+            for name in os.listdir(temp_dir)
+        )
+
+
+def test_apply_wal_parallel() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        pending = {"small": 50, "medium": 300, "large": 1200}
+        collections = {}
+        for name in pending:
+            col = client.create_collection(name)
+            col.add(
+                ids=[f"{name}-{i}" for i in range(100)],
+                embeddings=np.random.uniform(0, 1, (100, 8)).tolist(),
+            )
+            collections[name] = col
+        conn = sqlite3.connect(os.path.join(temp_dir, "chroma.sqlite3"))
+        next_seq_id = (
+            conn.execute("SELECT MAX(seq_id) FROM embeddings_queue").fetchone()[0] + 1
+        )
+        for name, count in pending.items():
+            conn.executemany(
+                "INSERT INTO embeddings_queue (seq_id, operation, topic, id, vector, encoding, metadata) VALUES (?, 0, ?, ?, ?, 'FLOAT32', '{}')",
+                [
+                    (
+                        next_seq_id + i,
+                        f"persistent://default/default/{collections[name].id}",
+                        f"{name}-new-{i}",
+                        struct.pack("%sf" % 8, *np.random.uniform(0, 1, 8)),
+                    )
+                    for i in range(count)
+                ],
+            )
+            next_seq_id += count
+        conn.commit()
+        conn.close()
+        del client, collections
+        # the first 100 entries are below the sync threshold, the segments were never persisted
+        assert apply_wal(
+            temp_dir, yes=True, parallel=3, num_threads=3, backup=False
+        ) == {name: 100 + count for name, count in pending.items()}
+        assert not any("_backup_" in name for name in os.listdir(temp_dir))
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                "import json, chromadb\n"
+                f"client = chromadb.PersistentClient(path={temp_dir!r})\n"
+                f"print(json.dumps({{name: client.get_collection(name).count() for name in {list(pending)!r}}}))\n",
+            ]
+        )
+        counts = json.loads(output.decode().strip().splitlines()[-1])
+        assert counts == {name: 100 + count for name, count in pending.items()}
+
+
+def test_apply_wal_failure_restores_segment() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        col = client.create_collection("test")
+        col.add(
+            ids=[str(uuid.uuid4()) for _ in range(1500)],
+            embeddings=np.random.uniform(0, 1, (1500, 16)).tolist(),
+        )
+        col.add(
+            ids=[str(uuid.uuid4()) for _ in range(300)],
+            embeddings=np.random.uniform(0, 1, (300, 16)).tolist(),
+        )
+        topic = f"persistent://default/default/{col.id}"
+        del client, col
+        conn = sqlite3.connect(os.path.join(temp_dir, "chroma.sqlite3"))
+        vector_segment, max_seq_id = conn.execute(
+            "SELECT s.id, m.seq_id FROM segments s JOIN max_seq_id m ON m.segment_id = s.id WHERE s.scope = 'VECTOR'"
+        ).fetchone()
+        # applied after several batches of valid entries
+        conn.execute(
+            "INSERT INTO embeddings_queue (operation, topic, id, vector, encoding, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                int(WalOperation.ADD),
+                topic,
+                "bad",
+                struct.pack("%sf" % 8, *np.random.uniform(0, 1, 8)),
+                "FLOAT32",
+                json.dumps({}),
+            ),
+        )
+        conn.commit()
+        segment_dir = os.path.join(temp_dir, vector_segment)
+
+        def read_segment() -> Dict[str, bytes]:
+            files = {}
+            for name in os.listdir(segment_dir):
+                with open(os.path.join(segment_dir, name), "rb") as f:
+                    files[name] = f.read()
+            return files
+
+        before = read_segment()
+        with pytest.raises(ValueError, match="dimensions"):
+            apply_wal(temp_dir, yes=True, batch_size=50)
+        assert read_segment() == before
+        assert (
+            conn.execute(
+                "SELECT seq_id FROM max_seq_id WHERE segment_id = ?", (vector_segment,)
+            ).fetchone()[0]
+            == max_seq_id
+        )
+        conn.close()
@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+import chromadb
+import numpy as np
+import pytest
+
+from chroma_ops.compression import Codec
+from chroma_ops.wal_apply import apply_wal
+from chroma_ops.wal_archive import archive_wal, get_archive_file
+from chroma_ops.wal_import import read_wal_export
+
+
+@pytest.mark.parametrize("codec", [Codec.ZLIB, Codec.NONE])
+def test_archive_wal(codec: Codec) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        persist_dir = os.path.join(temp_dir, "chroma")
+        archive_dir = os.path.join(temp_dir, "archive")
+        client = chromadb.PersistentClient(path=persist_dir)
+        col = client.create_collection("test")
+        for i in range(3):
+            col.add(
+                ids=[f"id-{i}-{j}" for j in range(100)],
+                embeddings=np.random.uniform(0, 1, (100, 8)).tolist(),
+                documents=[f"document {i} {j}" for j in range(100)],
+            )
+        client.create_collection("other").add(
+            ids=[f"other-{j}" for j in range(50)],
+            embeddings=np.random.uniform(0, 1, (50, 8)).tolist(),
+        )
+        del client, col
+        conn = sqlite3.connect(os.path.join(persist_dir, "chroma.sqlite3"))
+        first_seq_id = conn.execute(
+            "SELECT MIN(seq_id) FROM embeddings_queue"
+        ).fetchone()[0]
+        # the first two batches were written in past months
+        conn.execute(
+            "UPDATE embeddings_queue SET created_at = CASE WHEN seq_id < ?1 + 100 THEN '2024-01-15 10:00:00' ELSE '2024-02-10 10:00:00' END WHERE seq_id < ?1 + 200",
+            (first_seq_id,),
+        )
+        conn.commit()
+        original = conn.execute(
+            "SELECT seq_id, id, vector FROM embeddings_queue WHERE seq_id < ? ORDER BY seq_id",
+            (first_seq_id + 200,),
+        ).fetchall()
+        conn.close()
+
+        # the vector segments were never persisted, nothing is applied yet
+        assert archive_wal(persist_dir, archive_dir, older_than_days=30, yes=True) == {}
+        assert not os.path.exists(archive_dir)
+
+        apply_wal(persist_dir, yes=True, backup=False)
+        expected = {"2024-01": 100, "2024-02": 100}
+        assert (
+            archive_wal(persist_dir, archive_dir, older_than_days=30, dry_run=True)
+            == expected
+        )
+        assert not os.path.exists(archive_dir)
+        assert (
+            archive_wal(
+                persist_dir,
+                archive_dir,
+                older_than_days=30,
+                codec=codec,
+                batch_size=30,
+                yes=True,
+            )
+            == expected
+        )
+        assert archive_wal(persist_dir, archive_dir, older_than_days=30, yes=True) == {}
+        conn = sqlite3.connect(os.path.join(persist_dir, "chroma.sqlite3"))
+        assert (
+            conn.execute("SELECT COUNT(*) FROM embeddings_queue").fetchone()[0] == 150
+        )
+        conn.close()
+        archived = list(
+            read_wal_export(get_archive_file(archive_dir, "2024-01"))
+        ) + list(read_wal_export(get_archive_file(archive_dir, "2024-02")))
+        assert [(entry[0], entry[4], entry[5]) for entry in archived] == original
+        assert all(entry[7] for entry in archived)
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                f"import chromadb; print(chromadb.PersistentClient(path={persist_dir!r}).get_collection('test').count())",
+            ]
+        )
+        assert int(output.decode().strip().splitlines()[-1]) == 300
+
+
+def test_archive_wal_keeps_newest_entry() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        persist_dir = os.path.join(temp_dir, "chroma")
+        archive_dir = os.path.join(temp_dir, "archive")
+        client = chromadb.PersistentClient(path=persist_dir)
+        client.create_collection("test").add(
+            ids=[f"id-{j}" for j in range(100)],
+            embeddings=np.random.uniform(0, 1, (100, 8)).tolist(),
+        )
+        del client
+        apply_wal(persist_dir, yes=True, backup=False)
+        conn = sqlite3.connect(os.path.join(persist_dir, "chroma.sqlite3"))
+        conn.execute("UPDATE embeddings_queue SET created_at = '2024-01-15 10:00:00'")
+        conn.commit()
+        newest = conn.execute("SELECT MAX(seq_id) FROM embeddings_queue").fetchone()[0]
+        conn.close()
+
+        # everything is applied and older than now, the newest entry still stays
+        archived = archive_wal(persist_dir, archive_dir, older_than_days=0, yes=True)
+        assert sum(archived.values()) == 99
+        conn = sqlite3.connect(os.path.join(persist_dir, "chroma.sqlite3"))
+        assert conn.execute("SELECT seq_id FROM embeddings_queue").fetchall() == [
+            (newest,)
+        ]
+        conn.close()
+        # a new write gets a fresh seq id and is replayed after a restart
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                "import chromadb\n"
+                f"chromadb.PersistentClient(path={persist_dir!r}).get_collection('test').add(ids=['new'], embeddings=[[2.0] * 8])\n",
+            ]
+        )
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                "import chromadb\n"
+                f"col = chromadb.PersistentClient(path={persist_dir!r}).get_collection('test')\n"
+                "print(col.query(query_embeddings=[[2.0] * 8], n_results=1)['ids'][0][0])\n",
+            ]
+        )
+        assert output.decode().strip().splitlines()[-1] == "new"
+
+
+@pytest.mark.parametrize(
+    "codec,level",
+    [(Codec.ZLIB, 10), (Codec.ZLIB, -2), (Codec.LZ4, 17), (Codec.ZSTD, 23)],
+)
+def test_archive_wal_rejects_invalid_level(codec: Codec, level: int) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        persist_dir = os.path.join(temp_dir, "chroma")
+        archive_dir = os.path.join(temp_dir, "archive")
+        chromadb.PersistentClient(path=persist_dir)
+        with pytest.raises(ValueError, match="Compression level"):
+            archive_wal(persist_dir, archive_dir, codec=codec, level=level, yes=True)
+        assert not os.path.exists(archive_dir)
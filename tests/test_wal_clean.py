@@ -1,15 +1,19 @@
 import os.path
 import sqlite3
 import tempfile
+import threading
 import uuid
 
 from hypothesis import given, settings
 import hypothesis.strategies as st
 
 import chromadb
+import numpy as np
+import pytest
+from rich.console import Console
 
 from chroma_ops.utils import get_dir_size
-from chroma_ops.wal_clean import clean_wal
+from chroma_ops.wal_clean import _vacuum_into, clean_wal
 
 
 # the min sample must be 1000
@@ -66,3 +70,191 @@ def test_clean_skip_collections() -> None:
         )  # no changes as we skip the only collection
         size_after = get_dir_size(temp_dir)
         assert size_after == size_before  # no changes as we skip the only collection
+
+
+def test_clean_unpersisted_segment_keeps_wal() -> None:
+    records_to_add = 10
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        col = client.create_collection("test")
+        col.add(
+            ids=[f"id-{i}" for i in range(records_to_add)],
+            embeddings=np.full((records_to_add, 8), 0.1, dtype=np.float32),
+        )
+        clean_wal(temp_dir, yes=True)
+        sql_file = os.path.join(temp_dir, "chroma.sqlite3")
+        conn = sqlite3.connect(f"file:{sql_file}?mode=ro", uri=True)
+        # the segment was never persisted, its entries are still needed for replay
+        assert (
+            conn.execute("SELECT count(*) FROM embeddings_queue").fetchone()[0]
+            == records_to_add
+        )
+        conn.close()
+
+
+def test_clean_online(capsys: pytest.CaptureFixture[str]) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        col = client.create_collection("test")
+        col.add(
+            ids=[f"{uuid.uuid4()}" for _ in range(2000)],
+            embeddings=np.full((2000, 16), 0.1, dtype=np.float32),
+        )
+        sql_file = os.path.join(temp_dir, "chroma.sqlite3")
+        conn = sqlite3.connect(sql_file, check_same_thread=False)
+        topic, min_seq_id = conn.execute(
+            "SELECT topic, MIN(seq_id) FROM embeddings_queue"
+        ).fetchone()
+        if min_seq_id < 1000:
+            pytest.skip("WAL is not purged on this version of Chroma")
+        # stale WAL entries below the max seq id of the HNSW segment
+        conn.executemany(
+            "INSERT INTO embeddings_queue (seq_id, operation, topic, id) VALUES (?, 0, ?, ?)",
+            [(i, topic, f"{i}") for i in range(1, 501)],
+        )
+        # interleaved entries of a topic without a persisted segment are kept
+        conn.executemany(
+            "INSERT INTO embeddings_queue (seq_id, operation, topic, id) VALUES (?, 0, ?, ?)",
+            [
+                (i, "persistent://default/default/other", f"{i}")
+                for i in range(501, 601)
+            ],
+        )
+        conn.commit()
+        # a live writer holds the write lock for a while to make the cleanup back off
+        conn.execute("BEGIN IMMEDIATE")
+        timer = threading.Timer(0.3, conn.commit)
+        timer.start()
+        clean_wal(temp_dir, yes=True, online=True, batch_size=50, max_lock_ms=50)
+        timer.join()
+        output = capsys.readouterr().out
+        assert "Deleted 500 WAL entries" in output
+        assert "busy retries" in output
+        assert (
+            conn.execute(
+                "SELECT count(*) FROM embeddings_queue WHERE seq_id <= 500"
+            ).fetchone()[0]
+            == 0
+        )
+        assert (
+            conn.execute(
+                "SELECT count(*) FROM embeddings_queue WHERE topic = 'persistent://default/default/other'"
+            ).fetchone()[0]
+            == 100
+        )
+        assert col.count() == 2000
+        conn.close()
+
+
+@pytest.mark.parametrize("vacuum", ["none", "incremental", "into"])
+def test_clean_vacuum_modes(vacuum: str) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        persist_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=persist_dir)
+        col = client.create_collection("test")
+        ids = [f"{uuid.uuid4()}" for _ in range(1000)]
+        col.add(ids=ids, embeddings=np.full((1000, 1536), 0.1, dtype=np.float32))
+        col.delete(ids=ids)
+        sql_file = os.path.join(persist_dir, "chroma.sqlite3")
+        vacuum_dir = os.path.join(temp_dir, "vacuum")
+        os.makedirs(vacuum_dir)
+        if vacuum == "into":
+            vacuum = f"into={vacuum_dir}"
+        clean_wal(persist_dir, yes=True, vacuum=vacuum)
+        conn = sqlite3.connect(f"file:{sql_file}?mode=ro", uri=True)
+        freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        conn.close()
+        if vacuum == "none":
+            assert freelist_count > 0
+        else:
+            assert freelist_count == 0
+        assert auto_vacuum == (2 if vacuum == "incremental" else 0)
+        assert os.listdir(vacuum_dir) == []
+        if vacuum == "incremental":
+            # the database is already incremental, a second clean frees pages in slices online
+            col.add(ids=ids, embeddings=np.full((1000, 1536), 0.1, dtype=np.float32))
+            col.delete(ids=ids)
+            clean_wal(persist_dir, yes=True, online=True, vacuum="incremental")
+            conn = sqlite3.connect(f"file:{sql_file}?mode=ro", uri=True)
+            assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+            conn.close()
+        assert client.get_collection("test").count() == 0
+
+
+def test_vacuum_into_refuses_database_in_use() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        persist_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=persist_dir)
+        client.create_collection("test").add(
+            ids=[f"{uuid.uuid4()}" for _ in range(100)],
+            embeddings=np.full((100, 8), 0.1, dtype=np.float32),
+        )
+        sql_file = os.path.join(persist_dir, "chroma.sqlite3")
+        vacuum_dir = os.path.join(temp_dir, "vacuum")
+        os.makedirs(vacuum_dir)
+        reader = sqlite3.connect(sql_file)
+        reader.execute("BEGIN")
+        reader.execute("SELECT count(*) FROM embeddings_queue").fetchone()
+        conn = sqlite3.connect(sql_file)
+        try:
+            with pytest.raises(ValueError, match="in use"):
+                _vacuum_into(conn, persist_dir, vacuum_dir, Console())
+        finally:
+            conn.close()
+            reader.close()
+        assert os.listdir(vacuum_dir) == []
+
+
+def test_clean_vacuum_invalid_mode() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chromadb.PersistentClient(path=temp_dir).create_collection("test")
+        with pytest.raises(ValueError, match="Unknown vacuum mode"):
+            clean_wal(temp_dir, yes=True, vacuum="sometimes")
+        with pytest.raises(ValueError, match="cannot be used with --online"):
+            clean_wal(temp_dir, yes=True, online=True, vacuum="full")
+
+
+def test_clean_dry_run() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        col = client.create_collection("test")
+        col.add(
+            ids=[f"{uuid.uuid4()}" for _ in range(2000)],
+            embeddings=np.full((2000, 16), 0.1, dtype=np.float32),
+        )
+        sql_file = os.path.join(temp_dir, "chroma.sqlite3")
+        conn = sqlite3.connect(sql_file)
+        topic, min_seq_id = conn.execute(
+            "SELECT topic, MIN(seq_id) FROM embeddings_queue"
+        ).fetchone()
+        if min_seq_id < 1000:
+            pytest.skip("WAL is not purged on this version of Chroma")
+        conn.executemany(
+            "INSERT INTO embeddings_queue (seq_id, operation, topic, id, vector) VALUES (?, 0, ?, ?, ?)",
+            [(i, topic, f"é-{i}", b"\x00" * 64) for i in range(1, 301)],
+        )
+        conn.commit()
+        count_before = conn.execute("SELECT count(*) FROM embeddings_queue").fetchone()[
+            0
+        ]
+        estimate = clean_wal(temp_dir, dry_run=True)
+        assert estimate is not None
+        assert [(t, count) for t, count, _ in estimate] == [(topic, 300)]
+        # sizes are counted in bytes, not characters
+        assert estimate[0][2] == sum(
+            len(topic.encode())
+            + len(f"é-{i}".encode())
+            + 64
+            + len("2024-01-01 00:00:00")
+            for i in range(1, 301)
+        )
+        assert (
+            conn.execute("SELECT count(*) FROM embeddings_queue").fetchone()[0]
+            == count_before
+        )
+        clean_wal(temp_dir, yes=True, vacuum="none")
+        assert conn.execute("SELECT count(*) FROM embeddings_queue").fetchone()[
+            0
+        ] == count_before - sum(count for _, count, _ in estimate)
+        conn.close()
@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+from typing import Any, List
+
+import chromadb
+import numpy as np
+
+from chroma_ops.wal_apply import WalOperation
+from chroma_ops.wal_compact import compact_wal
+
+
+def _collection_state(persist_dir: str) -> List[Any]:
+    # a fresh client replays whatever is left of the WAL
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import json, chromadb\n"
+            f"col = chromadb.PersistentClient(path={persist_dir!r}).get_collection('test')\n"
+            "result = col.get(include=['metadatas', 'embeddings'])\n"
+            "print(json.dumps(sorted([i, m, [round(float(x), 4) for x in e]] for i, m, e in zip(result['ids'], result['metadatas'], result['embeddings']))))\n",
+        ]
+    )
+    state: List[Any] = json.loads(output.decode().strip().splitlines()[-1])
+    return state
+
+
+def test_compact_wal() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        persist_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=persist_dir)
+        col = client.create_collection("test")
+        col.add(
+            ids=[f"id-{i}" for i in range(10)],
+            embeddings=np.random.uniform(0, 1, (10, 4)).tolist(),
+            metadatas=[{"i": i} for i in range(10)],
+        )
+        topic = f"persistent://default/default/{col.id}"
+        del client, col
+        conn = sqlite3.connect(os.path.join(persist_dir, "chroma.sqlite3"))
+        next_seq_id = (
+            conn.execute("SELECT MAX(seq_id) FROM embeddings_queue").fetchone()[0] + 1
+        )
+        entries = [
+            # added, updated twice and deleted, only the delete is left
+            (WalOperation.ADD, "churn", {"v": 1}),
+            (WalOperation.UPDATE, "churn", {"v": 2}),
+            (WalOperation.UPDATE, "churn", {"v": 3}),
+            (WalOperation.DELETE, "churn", None),
+            # the second add of an existing id is ignored
+            (WalOperation.ADD, "twice", {"v": 1}),
+            (WalOperation.ADD, "twice", {"v": 2}),
+            (WalOperation.ADD, "id-1", {"v": 2}),
+            # deleted and added back, both are needed
+            (WalOperation.DELETE, "id-2", None),
+            (WalOperation.ADD, "id-2", {"v": 2}),
+            # updates merge metadata and are kept
+            (WalOperation.UPSERT, "merged", {"a": 1}),
+            (WalOperation.UPDATE, "merged", {"b": 2}),
+            (WalOperation.UPDATE, "id-3", {"a": 1}),
+            (WalOperation.UPDATE, "id-3", {"b": 2}),
+            # superseded but the newest entry of the queue, deleting it lets SQLite reuse its seq id
+            (WalOperation.ADD, "id-4", {"v": 2}),
+        ]
+        conn.executemany(
+            "INSERT INTO embeddings_queue (seq_id, operation, topic, id, vector, encoding, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    next_seq_id + i,
+                    int(operation),
+                    topic,
+                    _id,
+                    (
+                        struct.pack("%sf" % 4, *np.random.uniform(0, 1, 4))
+                        if metadata is not None
+                        else None
+                    ),
+                    "FLOAT32" if metadata is not None else None,
+                    json.dumps(metadata) if metadata is not None else None,
+                )
+                for i, (operation, _id, metadata) in enumerate(entries)
+            ],
+        )
+        conn.commit()
+        conn.close()
+        uncompacted_dir = os.path.join(temp_dir, "uncompacted")
+        shutil.copytree(persist_dir, uncompacted_dir)
+
+        # the original add of id-2 is superseded by its delete as well
+        assert compact_wal(persist_dir, dry_run=True) == {"test": 6}
+        assert compact_wal(persist_dir, yes=True, batch_size=2) == {"test": 6}
+        assert compact_wal(persist_dir, yes=True) == {}
+        conn = sqlite3.connect(os.path.join(persist_dir, "chroma.sqlite3"))
+        remaining = conn.execute(
+            "SELECT operation, id FROM embeddings_queue WHERE seq_id >= ? ORDER BY seq_id",
+            (next_seq_id,),
+        ).fetchall()
+        conn.close()
+        assert [_id for _, _id in remaining] == [
+            "churn",
+            "twice",
+            "id-2",
+            "id-2",
+            "merged",
+            "merged",
+            "id-3",
+            "id-3",
+            "id-4",
+        ]
+        assert remaining[0][0] == WalOperation.DELETE
+        assert _collection_state(persist_dir) == _collection_state(uncompacted_dir)
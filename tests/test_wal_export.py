@@ -1,5 +1,14 @@
+from datetime import datetime
+import gzip
+import hashlib
+import json
 import os.path
+import sqlite3
+import struct
+import subprocess
+import sys
 import tempfile
+from typing import Any, List, Tuple
 import uuid
 from packaging import version
 import pytest
@@ -9,8 +18,21 @@ from hypothesis import given, settings
 import hypothesis.strategies as st
 
 import chromadb
+import numpy as np
+from typer.testing import CliRunner
 
-from chroma_ops.wal_export import export_wal
+from chroma_ops.main import app
+from chroma_ops.wal_export import (
+    _build_filter,
+    _export_wal_jsonl,
+    _export_wal_npy,
+    _export_wal_sharded,
+    ExportCompression,
+    get_export_compression,
+    export_wal,
+)
+
+EMBEDDINGS_QUEUE_SCHEMA = "CREATE TABLE embeddings_queue (seq_id INTEGER PRIMARY KEY, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, operation INTEGER NOT NULL, topic TEXT NOT NULL, id TEXT NOT NULL, vector BLOB, encoding TEXT, metadata TEXT)"
 
 
 def count_lines(file_path: str) -> int:
@@ -50,3 +72,269 @@ def test_basic_export(records_to_add: int) -> None:
                     assert count_lines(temp_file.name) <= records_to_add
             else:
                 assert count_lines(temp_file.name) == records_to_add
+
+
+def test_export_npy() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        conn = sqlite3.connect(os.path.join(temp_dir, "chroma.sqlite3"))
+        conn.execute(EMBEDDINGS_QUEUE_SCHEMA)
+        vectors = np.random.uniform(0, 1, (25, 8)).astype(np.float32)
+        rows: List[Tuple[Any, ...]] = [
+            (
+                i + 1,
+                0,
+                f"persistent://default/default/{i % 2}",
+                f"id-{i}",
+                struct.pack("%sf" % 8, *vectors[i]),
+                "FLOAT32",
+                json.dumps({"i": i}),
+            )
+            for i in range(25)
+        ]
+        # a delete has no vector
+        rows.append((26, 3, "persistent://default/default/0", "id-0", None, None, None))
+        conn.executemany(
+            "INSERT INTO embeddings_queue (seq_id, operation, topic, id, vector, encoding, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+        output_dir = os.path.join(temp_dir, "export")
+        assert _export_wal_npy(conn, output_dir, {}, batch_size=4) == 26
+        with open(os.path.join(output_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+        assert [t["vectors"] for t in manifest["topics"]] == [13, 12]
+        for topic in manifest["topics"]:
+            matrix = np.load(os.path.join(output_dir, topic["vectors_file"]))
+            assert matrix.dtype == np.float32
+            assert matrix.shape == (topic["vectors"], 8)
+            with open(os.path.join(output_dir, topic["entries_file"])) as f:
+                entries = [json.loads(line) for line in f]
+            for entry in entries:
+                if entry["vector_row"] is None:
+                    assert entry["operation"] == 3
+                    continue
+                i = int(entry["id"].split("-")[1])
+                assert np.array_equal(matrix[entry["vector_row"]], vectors[i])
+        with pytest.raises(ValueError, match="not empty"):
+            _export_wal_npy(conn, output_dir, {})
+        conn.close()
+
+
+def test_export_filtered_and_resumed(monkeypatch: pytest.MonkeyPatch) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        conn = sqlite3.connect(os.path.join(temp_dir, "chroma.sqlite3"))
+        conn.execute(EMBEDDINGS_QUEUE_SCHEMA)
+        # one entry per minute, seq ids with gaps
+        conn.executemany(
+            "INSERT INTO embeddings_queue (seq_id, created_at, operation, topic, id, vector, encoding) VALUES (?, ?, 0, ?, ?, ?, 'FLOAT32')",
+            [
+                (
+                    i * 3,
+                    f"2024-01-01 {i // 60:02d}:{i % 60:02d}:00",
+                    f"persistent://default/default/{i % 2}",
+                    f"id-{i}",
+                    struct.pack("%sf" % 4, *([float(i)] * 4)),
+                )
+                for i in range(1, 201)
+            ],
+        )
+        conn.commit()
+        where, params = _build_filter(
+            conn,
+            topics=["persistent://default/default/0"],
+            from_seq=30,
+            since=datetime(2024, 1, 1, 0, 20),
+            until=datetime(2024, 1, 1, 2, 0),
+        )
+        seq_ids = [
+            row[0]
+            for row in conn.execute(
+                f"SELECT seq_id FROM embeddings_queue {where} ORDER BY seq_id", params
+            )
+        ]
+        assert seq_ids == [i * 3 for i in range(20, 120, 2)]
+        assert "seq_id >= ?" in where and "seq_id <= ?" in where
+
+        output_file = os.path.join(temp_dir, "export.jsonl")
+        checkpoint_file = os.path.join(temp_dir, "export.checkpoint")
+        where, params = _build_filter(conn, from_seq=10, to_seq=400)
+        filters = {"from_seq": 10, "to_seq": 400}
+
+        class Interrupted(Exception):
+            pass
+
+        # interrupt the export while checkpointing the second batch, after it has been written
+        original_fsync = os.fsync
+        calls = []
+
+        def failing_fsync(fd: int) -> None:
+            calls.append(fd)
+            if len(calls) == 4:
+                raise Interrupted()
+            original_fsync(fd)
+
+        monkeypatch.setattr(os, "fsync", failing_fsync)
+        with pytest.raises(Interrupted):
+            _export_wal_jsonl(
+                conn, output_file, where, params, checkpoint_file, filters, 25
+            )
+        monkeypatch.setattr(os, "fsync", original_fsync)
+        with open(checkpoint_file) as f:
+            assert json.load(f)["exported_rows"] == 25
+        assert (
+            _export_wal_jsonl(
+                conn, output_file, where, params, checkpoint_file, filters, 25
+            )
+            == 130
+        )
+        with open(output_file) as f:
+            entries = [json.loads(line) for line in f]
+        assert [e["seq_id"] for e in entries] == list(range(12, 401, 3))
+        with pytest.raises(ValueError, match="different export"):
+            _export_wal_jsonl(
+                conn, output_file, where, params, checkpoint_file, {"from_seq": 1}, 25
+            )
+        conn.close()
+
+
+def test_export_sharded() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        conn = sqlite3.connect(os.path.join(temp_dir, "chroma.sqlite3"))
+        conn.execute(EMBEDDINGS_QUEUE_SCHEMA)
+        conn.executemany(
+            "INSERT INTO embeddings_queue (seq_id, operation, topic, id, vector, encoding) VALUES (?, 0, 'persistent://default/default/0', ?, ?, 'FLOAT32')",
+            [
+                (i, f"id-{i}", struct.pack("%sf" % 4, *([float(i)] * 4)))
+                for i in range(1, 1001)
+            ],
+        )
+        conn.commit()
+        output_file = os.path.join(temp_dir, "out.jsonl")
+        exported_rows, _ = _export_wal_sharded(
+            conn, temp_dir, output_file, 3, "WHERE seq_id > ?", [100]
+        )
+        assert exported_rows == 900
+        with open(os.path.join(temp_dir, "out.manifest.json")) as f:
+            manifest = json.load(f)
+        assert [shard["file"] for shard in manifest["shards"]] == [
+            "out.00000.jsonl",
+            "out.00001.jsonl",
+            "out.00002.jsonl",
+        ]
+        assert [shard["rows"] for shard in manifest["shards"]] == [300, 300, 300]
+        seq_ids: List[int] = []
+        for shard in manifest["shards"]:
+            with open(os.path.join(temp_dir, shard["file"]), "rb") as f:
+                data = f.read()
+            assert hashlib.sha256(data).hexdigest() == shard["sha256"]
+            assert len(data) == shard["size"]
+            seq_ids.extend(json.loads(line)["seq_id"] for line in data.splitlines())
+        assert seq_ids == list(range(101, 1001))
+        conn.close()
+
+
+@pytest.mark.parametrize("extension", [".gz", ".zst"])
+def test_export_compressed(extension: str) -> None:
+    compression = get_export_compression(f"out.jsonl{extension}")
+    if compression == ExportCompression.ZSTD:
+        zstandard = pytest.importorskip("zstandard")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        conn = sqlite3.connect(os.path.join(temp_dir, "chroma.sqlite3"))
+        conn.execute(EMBEDDINGS_QUEUE_SCHEMA)
+        conn.executemany(
+            "INSERT INTO embeddings_queue (seq_id, operation, topic, id, vector, encoding) VALUES (?, 0, 'persistent://default/default/0', ?, ?, 'FLOAT32')",
+            [
+                (i, f"id-{i}", struct.pack("%sf" % 4, *([0.5] * 4)))
+                for i in range(1, 501)
+            ],
+        )
+        conn.commit()
+        output_file = os.path.join(temp_dir, f"out.jsonl{extension}")
+        assert (
+            _export_wal_sharded(
+                conn, temp_dir, output_file, 2, compression=compression
+            )[0]
+            == 500
+        )
+        with open(os.path.join(temp_dir, "out.manifest.json")) as f:
+            manifest = json.load(f)
+        seq_ids: List[int] = []
+        for shard in manifest["shards"]:
+            assert shard["file"].endswith(f".jsonl{extension}")
+            with open(os.path.join(temp_dir, shard["file"]), "rb") as f:
+                data = f.read()
+            assert hashlib.sha256(data).hexdigest() == shard["sha256"]
+            if compression == ExportCompression.GZIP:
+                data = gzip.decompress(data)
+            else:
+                data = zstandard.ZstdDecompressor().stream_reader(data).read()
+            seq_ids.extend(json.loads(line)["seq_id"] for line in data.splitlines())
+        assert seq_ids == list(range(1, 501))
+        with pytest.raises(ValueError, match="not supported for compressed"):
+            _export_wal_jsonl(
+                conn,
+                output_file,
+                checkpoint_file=os.path.join(temp_dir, "checkpoint"),
+                compression=compression,
+            )
+        conn.close()
+
+
+@pytest.mark.parametrize("extension", [".jsonl", ".jsonl.gz"])
+def test_export_import_cli_round_trip(extension: str) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "target")
+        embeddings = np.random.uniform(0, 1, (200, 8)).astype(np.float32)
+        client = chromadb.PersistentClient(path=source_dir)
+        col = client.create_collection("test")
+        col.add(
+            ids=[f"id-{i}" for i in range(200)],
+            embeddings=embeddings,
+            metadatas=[{"i": i} for i in range(200)],
+        )
+        client.create_collection("other").add(
+            ids=["other"], embeddings=np.full((1, 8), 0.5, dtype=np.float32)
+        )
+        source_id = str(col.id)
+        chromadb.PersistentClient(path=target_dir).create_collection("imported").add(
+            ids=["existing"], embeddings=np.zeros((1, 8), dtype=np.float32)
+        )
+        del client, col
+
+        runner = CliRunner()
+        output_file = os.path.join(temp_dir, f"export{extension}")
+        result = runner.invoke(
+            app,
+            ["wal", "export", source_dir, "--out", output_file, "-c", "test", "-y"],
+        )
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(
+            app,
+            [
+                "wal",
+                "import",
+                target_dir,
+                output_file,
+                "--map",
+                f"{source_id}=imported",
+                "-y",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        # a fresh client replays the imported entries
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                "import json, chromadb\n"
+                f"col = chromadb.PersistentClient(path={target_dir!r}).get_collection('imported')\n"
+                f"result = col.query(query_embeddings=[{embeddings[42].tolist()!r}], n_results=1, include=['metadatas'])\n"
+                "print(json.dumps([col.count(), result['ids'][0][0], result['metadatas'][0][0]]))\n",
+            ]
+        )
+        assert json.loads(output.decode().strip().splitlines()[-1]) == [
+            201,
+            "id-42",
+            {"i": 42},
+        ]
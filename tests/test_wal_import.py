@@ -0,0 +1,169 @@
+import base64
+import gzip
+import json
+import os
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+import chromadb
+import numpy as np
+import pytest
+
+from chroma_ops.wal_export import _export_wal_npy, _export_wal_sharded
+from chroma_ops.wal_import import _peek_topics, import_wal, read_wal_export
+
+SOURCE_TOPIC = "persistent://default/default/source"
+
+
+def _entries(count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "seq_id": i + 1,
+            "created_at": "2024-01-01 00:00:00",
+            "operation": 0,
+            "topic": SOURCE_TOPIC,
+            "id": f"id-{i}",
+            "vector": base64.b64encode(
+                struct.pack("%sf" % 4, *([float(i)] * 4))
+            ).decode(),
+            "encoding": "FLOAT32",
+            "metadata": json.dumps({"chroma:document": f"document {i}"}),
+        }
+        for i in range(count)
+    ]
+
+
+def _count_in_new_process(persist_dir: str) -> int:
+    # a fresh client applies the imported entries as pending writes
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            f"import chromadb; print(chromadb.PersistentClient(path={persist_dir!r}).get_collection('target').count())",
+        ]
+    )
+    return int(output.decode().strip().splitlines()[-1])
+
+
+def test_import_jsonl() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        persist_dir = os.path.join(temp_dir, "chroma")
+        client = chromadb.PersistentClient(path=persist_dir)
+        col = client.create_collection("target")
+        col.add(ids=["existing"], embeddings=np.zeros((1, 4), dtype=np.float32))
+        export_file = os.path.join(temp_dir, "wal.jsonl.gz")
+        with gzip.open(export_file, "wt") as f:
+            for entry in _entries(1000):
+                f.write(json.dumps(entry) + "\n")
+        with pytest.raises(ValueError, match="No target collection"):
+            import_wal(persist_dir, export_file, yes=True)
+        assert (
+            import_wal(persist_dir, export_file, mappings=["source=target"], yes=True)
+            == 1000
+        )
+        conn = sqlite3.connect(os.path.join(persist_dir, "chroma.sqlite3"))
+        rows = conn.execute(
+            "SELECT seq_id, id FROM embeddings_queue WHERE topic = ? ORDER BY seq_id",
+            (f"persistent://default/default/{col.id}",),
+        ).fetchall()
+        conn.close()
+        imported = [row for row in rows if row[1] != "existing"]
+        assert [row[1] for row in imported] == [f"id-{i}" for i in range(1000)]
+        assert imported[0][0] > max(row[0] for row in rows if row[1] == "existing")
+        assert _count_in_new_process(persist_dir) == 1001
+
+
+def test_import_into_new_collection() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        persist_dir = os.path.join(temp_dir, "chroma")
+        chromadb.PersistentClient(path=persist_dir).create_collection("target")
+        export_file = os.path.join(temp_dir, "wal.jsonl")
+        entries = _entries(100)
+        with open(export_file, "w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        bad_file = os.path.join(temp_dir, "bad.jsonl")
+        with open(bad_file, "w") as f:
+            for entry in entries[:2]:
+                f.write(json.dumps(entry) + "\n")
+            # 4 INT32 dimensions are 16 bytes like 4 FLOAT32 ones, 8 FLOAT32 ones are not
+            f.write(
+                json.dumps(
+                    {
+                        **entries[2],
+                        "vector": base64.b64encode(
+                            struct.pack("%sf" % 8, *([1.0] * 8))
+                        ).decode(),
+                    }
+                )
+                + "\n"
+            )
+        assert _peek_topics(export_file) is None
+
+        with pytest.raises(ValueError, match="has 8 dimensions"):
+            import_wal(persist_dir, bad_file, mappings=["source=target"], yes=True)
+        conn = sqlite3.connect(os.path.join(persist_dir, "chroma.sqlite3"))
+        assert conn.execute("SELECT dimension FROM collections").fetchone()[0] is None
+        assert conn.execute("SELECT COUNT(*) FROM embeddings_queue").fetchone()[0] == 0
+        conn.close()
+
+        assert (
+            import_wal(persist_dir, export_file, mappings=["source=target"], yes=True)
+            == 100
+        )
+        conn = sqlite3.connect(os.path.join(persist_dir, "chroma.sqlite3"))
+        assert conn.execute("SELECT dimension FROM collections").fetchone()[0] == 4
+        conn.close()
+        # without a dimension Chroma would not replay the imported entries
+        assert _count_in_new_process(persist_dir) == 100
+
+
+@pytest.mark.parametrize("export_format", ["shards", "npy"])
+def test_read_wal_export_formats(export_format: str) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        conn = sqlite3.connect(os.path.join(temp_dir, "chroma.sqlite3"))
+        conn.execute(
+            "CREATE TABLE embeddings_queue (seq_id INTEGER PRIMARY KEY, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, operation INTEGER NOT NULL, topic TEXT NOT NULL, id TEXT NOT NULL, vector BLOB, encoding TEXT, metadata TEXT)"
+        )
+        entries = _entries(300)
+        for i, entry in enumerate(entries):
+            # interleave two topics and a delete without a vector
+            entry["topic"] = f"{SOURCE_TOPIC}-{i % 2}"
+        entries[-1].update(operation=3, vector=None, encoding=None, metadata=None)
+        conn.executemany(
+            "INSERT INTO embeddings_queue VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    e["seq_id"],
+                    e["created_at"],
+                    e["operation"],
+                    e["topic"],
+                    e["id"],
+                    base64.b64decode(e["vector"]) if e["vector"] else None,
+                    e["encoding"],
+                    e["metadata"],
+                )
+                for e in entries
+            ],
+        )
+        conn.commit()
+        if export_format == "shards":
+            _export_wal_sharded(conn, temp_dir, os.path.join(temp_dir, "out.jsonl"), 3)
+            path = os.path.join(temp_dir, "out.manifest.json")
+        else:
+            path = os.path.join(temp_dir, "export")
+            _export_wal_npy(conn, path, {})
+        conn.close()
+        assert _peek_topics(path) == [f"{SOURCE_TOPIC}-0", f"{SOURCE_TOPIC}-1"]
+        read = list(read_wal_export(path))
+        assert [entry[0] for entry in read] == list(range(1, 301))
+        for row, expected in zip(read, entries):
+            assert row[3] == expected["topic"]
+            assert row[5] == (
+                base64.b64decode(expected["vector"]) if expected["vector"] else None
+            )
+            assert row[7] == expected["metadata"]
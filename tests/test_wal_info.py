@@ -1,9 +1,14 @@
+import os
+import sqlite3
 import tempfile
 from hypothesis import given, settings
 import hypothesis.strategies as st
 import chromadb
 import uuid
 import numpy as np
+from typer.testing import CliRunner
+
+from chroma_ops.main import app
 from chroma_ops.wal_info import info_wal
 
 
@@ -27,3 +32,76 @@ def test_wal_info(collections_to_create: int) -> None:
         assert len(stats) == collections_to_create
         for stat in stats:
             assert collecttion_records_to_add[stat[0]] == stat[2]
+
+
+def test_wal_info_sizes_and_gaps() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        col = client.create_collection("test")
+        col.add(
+            ids=[f"é-{i}" for i in range(100)],
+            embeddings=np.zeros((100, 8), dtype=np.float32),
+        )
+        client.create_collection("deleted").add(
+            ids=["a"], embeddings=np.zeros((1, 8), dtype=np.float32)
+        )
+        client.delete_collection("deleted")
+        stats = {stat[0]: stat for stat in info_wal(temp_dir)}
+        name, topic, count, size, oldest, newest, vector_gap, metadata_gap = stats[
+            "test"
+        ]
+        assert topic.endswith(str(col.id))
+        assert count == 100
+        # sizes are counted in bytes, the ids are not ASCII
+        conn = sqlite3.connect(os.path.join(temp_dir, "chroma.sqlite3"))
+        rows = conn.execute(
+            "SELECT topic, id, vector, metadata, created_at FROM embeddings_queue WHERE topic = ?",
+            (topic,),
+        ).fetchall()
+        conn.close()
+        assert size == sum(
+            len(t.encode())
+            + len(i.encode())
+            + len(v or b"")
+            + len((m or "").encode())
+            + len(c.encode())
+            for t, i, v, m, c in rows
+        )
+        assert oldest <= newest
+        # below the sync threshold, the vector segment was never persisted
+        assert vector_gap == 100
+        assert metadata_gap == 0
+        # entries of a deleted collection are reported without a name
+        assert set(stats) <= {"test", "-"}
+
+
+def test_wal_info_without_sizes() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        client.create_collection("test").add(
+            ids=[f"id-{i}" for i in range(100)],
+            embeddings=np.random.uniform(0, 1, (100, 8)).tolist(),
+        )
+        with_sizes = info_wal(temp_dir)
+        without_sizes = info_wal(temp_dir, sizes=False)
+        assert [stat[3] for stat in without_sizes] == [0]
+        # everything but the size matches the full scan
+        assert [stat[:3] + stat[4:] for stat in without_sizes] == [
+            stat[:3] + stat[4:] for stat in with_sizes
+        ]
+        result = CliRunner().invoke(
+            app,
+            [
+                "wal",
+                "info",
+                temp_dir,
+                "--no-sizes",
+                "--tenant",
+                "other",
+                "--topic-namespace",
+                "other",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        # the topics do not belong to the given tenant, so no collection name is found
+        assert "test" not in result.output.split("WAL Info")[1]
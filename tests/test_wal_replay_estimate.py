@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import struct
+import tempfile
+
+import chromadb
+import numpy as np
+import pytest
+
+from chroma_ops.wal_apply import WalOperation, apply_wal
+from chroma_ops.wal_replay_estimate import estimate_wal_replay
+
+
+def test_estimate_wal_replay() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        col = client.create_collection("test")
+        col.add(
+            ids=[f"id-{i}" for i in range(300)],
+            embeddings=np.random.uniform(0, 1, (300, 16)).tolist(),
+        )
+        client.create_collection("empty")
+        topic = f"persistent://default/default/{col.id}"
+        del client, col
+        conn = sqlite3.connect(os.path.join(temp_dir, "chroma.sqlite3"))
+        next_seq_id = (
+            conn.execute("SELECT MAX(seq_id) FROM embeddings_queue").fetchone()[0] + 1
+        )
+        # writes neither segment has seen, e.g. after an unclean shutdown
+        conn.executemany(
+            "INSERT INTO embeddings_queue (seq_id, operation, topic, id, vector, encoding, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    next_seq_id + i,
+                    int(WalOperation.DELETE if i % 4 == 0 else WalOperation.UPSERT),
+                    topic,
+                    f"id-{i}",
+                    (
+                        None
+                        if i % 4 == 0
+                        else struct.pack("%sf" % 16, *np.random.uniform(0, 1, 16))
+                    ),
+                    None if i % 4 == 0 else "FLOAT32",
+                    None if i % 4 == 0 else "{}",
+                )
+                for i in range(200)
+            ],
+        )
+        conn.commit()
+        conn.close()
+
+        with pytest.raises(ValueError, match="do not exist"):
+            estimate_wal_replay(temp_dir, collections=["missing"])
+        estimates = estimate_wal_replay(temp_dir, sample_size=100)
+        # the first adds are below the sync threshold, the vector segment was never persisted
+        assert estimates["test"]["vector_max_seq_id"] == 0
+        assert estimates["test"]["vector_gap"] == 500
+        assert estimates["test"]["metadata_gap"] == 200
+        assert estimates["test"]["operations"] == {
+            "add": 300,
+            "upsert": 150,
+            "delete": 50,
+        }
+        assert estimates["test"]["vector_bytes"] == 450 * 16 * 4
+        assert estimates["test"]["estimated_seconds"] > 0
+        assert estimates["empty"]["vector_gap"] == 0
+        assert estimates["empty"]["estimated_seconds"] == 0
+
+        apply_wal(temp_dir, yes=True, backup=False)
+        estimates = estimate_wal_replay(temp_dir, collections=["test"])
+        assert estimates["test"]["vector_gap"] == 0
+        assert estimates["test"]["estimated_seconds"] == 0
+
+
+def test_estimate_wal_replay_decodes_dimension(
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client = chromadb.PersistentClient(path=temp_dir)
+        col = client.create_collection("no_dimension")
+        topic = f"persistent://default/default/{col.id}"
+        del client, col
+        conn = sqlite3.connect(os.path.join(temp_dir, "chroma.sqlite3"))
+        # the collection never saw a write, so its dimension is not set
+        conn.executemany(
+            "INSERT INTO embeddings_queue (operation, topic, id, vector, encoding) VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    int(WalOperation.ADD),
+                    topic,
+                    f"id-{i}",
+                    struct.pack("<%si" % 8, *range(8)),
+                    "INT32",
+                )
+                for i in range(50)
+            ],
+        )
+        conn.commit()
+        conn.close()
+        capsys.readouterr()
+        estimates = estimate_wal_replay(
+            temp_dir, collections=["no_dimension", "no_dimension"], sample_size=50
+        )
+        assert list(estimates) == ["no_dimension"]
+        assert estimates["no_dimension"]["vector_gap"] == 50
+        output = capsys.readouterr().out
+        benchmark = output.split("Replay Benchmark")[1]
+        assert benchmark.count("no_dimension") == 1
+        row = next(line for line in benchmark.splitlines() if "no_dimension" in line)
+        assert [cell.strip() for cell in row.split("│")][2:4] == ["50", "8"]